@@ -0,0 +1,4 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 ShadowMan
+#
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 ShadowMan
+#
+"""Loopback helpers shared by the benchmarks
+
+The server always runs in a child process, so the load generator and the
+server never compete for the same interpreter lock.
+"""
+import os
+import ssl
+import time
+import socket
+import base64
+import logging
+import multiprocessing
+from websocket.net import ws_frame
+
+
+# event loop of each engine
+ENGINES = ('selectors', 'asyncio', 'uvloop')
+
+
+def _serve(host, port, setup, engine, workers, tls):
+    import websocket
+    if tls is None:
+        server = websocket.create_websocket_server(
+            host, port, debug=True, logging_level='warning', loop=engine,
+            workers=workers)
+    elif engine == 'selectors':
+        server = websocket.create_websocket_secure_server(
+            host, port, debug=True, logging_level='warning',
+            cert_file=tls[0], key_file=tls[1])
+    else:
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(*tls)
+        server = websocket.create_async_websocket_server(
+            host, port, debug=True, logging_level='warning', loop=engine,
+            workers=workers, ssl_context=context)
+    # debug mode force the console logger into DEBUG level
+    logging.getLogger().setLevel(logging.WARNING)
+    setup(server)
+    server.run_forever()
+
+
+def start_server(setup, host='127.0.0.1', port=0, engine='selectors',
+                 workers=None, tls=None):
+    """ Run `setup(server)` and the server main loop in a child process
+
+    With `workers` the child is the supervisor of the worker processes.
+
+    :param tls: (cert_file, key_file) of a TLS server, see `self_signed`
+    :return: (process, port)
+    """
+    if port == 0:
+        port = free_port(host)
+    process = multiprocessing.Process(
+        target=_serve, args=(host, port, setup, engine, workers, tls),
+        daemon=True)
+    process.start()
+    wait_listening(host, port)
+    return process, port
+
+
+def stop_server(process):
+    process.terminate()
+    process.join(5)
+
+
+def cpu_seconds(process):
+    """ User + system CPU time of the child process, None if unknown """
+    try:
+        with open('/proc/{}/stat'.format(process.pid)) as fd:
+            fields = fd.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def peak_rss(process):
+    """ (current, peak) resident set size of the child in KiB """
+    sizes = dict()
+    try:
+        with open('/proc/{}/status'.format(process.pid)) as fd:
+            for line in fd:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    name, value = line.split(':', 1)
+                    sizes[name] = int(value.split()[0])
+    except OSError:
+        return None, None
+    return sizes.get('VmRSS'), sizes.get('VmHWM')
+
+
+def self_signed(directory):
+    """ Self-signed certificate for localhost made by the openssl tool
+
+    :return: (cert_file, key_file)
+    """
+    import subprocess
+    cert_file = os.path.join(directory, 'server.crt')
+    key_file = os.path.join(directory, 'server.key')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+         '-subj', '/CN=localhost', '-days', '1',
+         '-keyout', key_file, '-out', cert_file],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert_file, key_file
+
+
+def raise_open_files_limit():
+    """ Raise the soft limit of the open files, inherited by the server """
+    import resource
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+def free_port(host='127.0.0.1'):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def wait_listening(host, port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), 0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('server not listening on {}:{}'.format(host, port))
+
+
+def handshake_request(host, port, path='/', headers=()):
+    key = base64.b64encode(os.urandom(16))
+    lines = [
+        b'GET ' + path.encode() + b' HTTP/1.1',
+        b'Host: ' + '{}:{}'.format(host, port).encode(),
+        b'Upgrade: websocket',
+        b'Connection: Upgrade',
+        b'Sec-WebSocket-Key: ' + key,
+        b'Sec-WebSocket-Version: 13',
+    ]
+    lines.extend(headers)
+    return b'\r\n'.join(lines) + b'\r\n\r\n'
+
+
+def connect(host, port, path='/'):
+    """ Open a connection and finish the opening handshake
+
+    :return: (socket, FrameReader)
+    """
+    sock = socket.create_connection((host, port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.sendall(handshake_request(host, port, path))
+    reader = FrameReader(sock)
+    reader.read_handshake()
+    return sock, reader
+
+
+class FrameReader(object):
+
+    def __init__(self, sock):
+        self._socket = sock
+        self._buffer = bytearray()
+
+    def _fill(self):
+        data = self._socket.recv(1 << 20)
+        if not data:
+            raise ConnectionError('connection closed by server')
+        self._buffer += data
+
+    def read_handshake(self):
+        while b'\r\n\r\n' not in self._buffer:
+            self._fill()
+        head, _, rest = bytes(self._buffer).partition(b'\r\n\r\n')
+        if not head.startswith(b'HTTP/1.1 101'):
+            raise ConnectionError('handshake rejected: {}'.format(head))
+        self._buffer = bytearray(rest)
+        return head
+
+    def read_frame(self):
+        while True:
+            header, _ = ws_frame.decode_frame_header(self._buffer)
+            if header is not None and \
+                    len(self._buffer) >= header.frame_length:
+                frame = ws_frame.WebSocketFrame(
+                    self._buffer[:header.frame_length], header)
+                del self._buffer[:header.frame_length]
+                return frame
+            self._fill()
+
+
+def client_frame(payload, opcode=0x2):
+    """ Masked client-to-server frame bytes """
+    if opcode == 0x1:
+        return ws_frame.generate_text_frame(payload, True).pack()
+    return ws_frame.generate_binary_frame(payload, True).pack()
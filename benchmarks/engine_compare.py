@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 ShadowMan
+#
+"""Selectors engine against the asyncio engine over loopback
+
+    python -m benchmarks.engine_compare [--engines selectors,asyncio,uvloop]
+
+connect:   open connection, opening handshake, close
+ping-pong: one client, each message waits for the echo
+pipelined: all messages written at once, then all echoes read
+fan-out:   one message broadcast to every subscriber of the namespace
+"""
+import sys
+import time
+import argparse
+import importlib.util
+from benchmarks import common
+
+
+def _setup(server):
+    import websocket
+    from websocket.ext import handler
+
+    class EchoHandler(handler.WebSocketHandlerProtocol):
+
+        def on_connect(self):
+            pass
+
+        def on_message(self, message):
+            return websocket.TextMessage(message)
+
+        def on_close(self, code, reason):
+            pass
+
+        def on_error(self, code, reason):
+            pass
+
+    class ChatHandler(EchoHandler):
+
+        def on_message(self, message):
+            return self.broadcast(websocket.TextMessage(message))
+
+    server.register_default_handler(EchoHandler)
+    server.register_handler('/chat')(ChatHandler)
+
+
+def _connect(port, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        sock, _ = common.connect('127.0.0.1', port)
+        sock.close()
+    return count / (time.perf_counter() - start)
+
+
+def _ping_pong(port, count):
+    sock, reader = common.connect('127.0.0.1', port)
+    frame = common.client_frame(b'x' * 32, 0x1)
+    start = time.perf_counter()
+    for _ in range(count):
+        sock.sendall(frame)
+        reader.read_frame()
+    elapsed = time.perf_counter() - start
+    sock.close()
+    return count / elapsed
+
+
+def _pipelined(port, count):
+    sock, reader = common.connect('127.0.0.1', port)
+    frames = common.client_frame(b'x' * 32, 0x1) * count
+    start = time.perf_counter()
+    sock.sendall(frames)
+    for _ in range(count):
+        reader.read_frame()
+    elapsed = time.perf_counter() - start
+    sock.close()
+    return count / elapsed
+
+
+def _fan_out(process, port, subscribers, count, size):
+    clients = [common.connect('127.0.0.1', port, '/chat')
+               for _ in range(subscribers)]
+    sock, _ = common.connect('127.0.0.1', port, '/chat')
+    frame = common.client_frame(b'x' * size, 0x1)
+    cpu_start = common.cpu_seconds(process)
+    start = time.perf_counter()
+    for _ in range(count):
+        sock.sendall(frame)
+        for _, reader in clients:
+            reader.read_frame()
+    elapsed = time.perf_counter() - start
+    cpu_end = common.cpu_seconds(process)
+    for client, _ in clients:
+        client.close()
+    sock.close()
+    cpu = None if cpu_start is None else (cpu_end - cpu_start) / count
+    return elapsed / count, cpu
+
+
+def run(engines, count, subscribers, size):
+    print('{:>10} {:>12} {:>14} {:>14} {:>14} {:>14}'.format(
+        'engine', 'connect/s', 'ping-pong/s', 'pipelined/s', 'fan-out ms',
+        'fan-out cpu ms'))
+    fallback = 'uvloop' in engines and \
+        importlib.util.find_spec('uvloop') is None
+    for engine in engines:
+        process, port = common.start_server(_setup, engine=engine)
+        try:
+            connect = _connect(port, max(1, count // 10))
+            ping_pong = _ping_pong(port, count)
+            pipelined = _pipelined(port, count)
+            fan_out, fan_out_cpu = _fan_out(
+                process, port, subscribers, max(1, count // 100), size)
+        finally:
+            common.stop_server(process)
+        print('{:>10} {:>12.0f} {:>14.0f} {:>14.0f} {:>14.2f} {:>14}'.format(
+            engine + ('*' if fallback and engine == 'uvloop' else ''),
+            connect, ping_pong, pipelined, fan_out * 1000,
+            '-' if fan_out_cpu is None else
+            '{:.2f}'.format(fan_out_cpu * 1000)))
+    if fallback:
+        print('* uvloop not installed, the asyncio loop used instead')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--engines', default=','.join(common.ENGINES),
+                        help='comma separated engines: '
+                             + ','.join(common.ENGINES))
+    parser.add_argument('--count', type=int, default=10000,
+                        help='messages of the ping-pong/pipelined tests')
+    parser.add_argument('--subscribers', type=int, default=500,
+                        help='connections receiving the broadcast')
+    parser.add_argument('--size', type=int, default=1024,
+                        help='broadcast payload size in bytes')
+    args = parser.parse_args(argv)
+    run(args.engines.split(','), args.count, args.subscribers, args.size)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 ShadowMan
+#
+"""Encode and decode cost of the frame and packet primitives
+
+    python -m benchmarks.frame_micro [--sizes 0,125,65536,16777216]
+        [--operations parse,pack,mask,length,packet] [--min-time 0.2]
+        [--json result.json] [--compare baseline.json] [--threshold 10]
+
+Each operation runs over every payload size, masked and unmasked:
+
+    parse   `WebSocketFrame` of a raw frame, unmask included
+    pack    `FrameGenerator.pack` of a payload
+    mask    `ws_transform_payload_data`, masked only
+    length  `parse_frame_length` of the frame header
+    packet  `Packet` writer, the header fields and the payload, `build`
+
+The throughput is the best of `--repeat` runs, each runs the operation
+for `--min-time` seconds at least. The allocation is the peak traced by
+`tracemalloc` during one operation, in a separate run, so the tracing
+never slows the timed runs. A payload copied once shows as 1.0 copies.
+
+With `--compare` the results are checked against a baseline saved by
+`--json`, an operation is a regression when the ops/s dropped or the
+allocation grew by more than `--threshold` percent.
+"""
+import sys
+import json
+import time
+import argparse
+import contextlib
+import platform
+import tracemalloc
+from websocket.net import ws_frame
+from websocket.utils import packet
+
+
+# 0 B to 16 MiB, every payload length flag [ <125, 126, 127 ]
+DEFAULT_SIZES = (0, 125, 126, 4096, 65535, 65536, 1024 * 1024,
+                 16 * 1024 * 1024)
+
+_MASK_KEY = 0x37fa213d
+
+
+def _payload(size):
+    return bytes(range(256)) * (size // 256) + bytes(range(size % 256))
+
+
+def _frame_generator(payload, masked):
+    generator = ws_frame.FrameGenerator().opcode(0x2)
+    if masked:
+        generator.set_mask_key(_MASK_KEY)
+    return generator.set_payload_data(payload)
+
+
+def _parse(payload, masked):
+    raw = _frame_generator(payload, masked).pack()
+    return lambda: ws_frame.WebSocketFrame(raw)
+
+
+def _pack(payload, masked):
+    return _frame_generator(payload, masked).pack
+
+
+def _mask(payload, masked):
+    if not masked:
+        return None
+    return lambda: ws_frame.ws_transform_payload_data(payload, _MASK_KEY)
+
+
+def _length(payload, masked):
+    generator = _frame_generator(payload, masked)
+    header, _ = generator.pack_parts()
+    return lambda: ws_frame.parse_frame_length(header)
+
+
+def _packet(payload, masked):
+    length = len(payload)
+
+    def _write():
+        writer = packet.Packet()
+        writer.put_bits(1, 0, 0, 0, 0, 0, 1, 0)
+        if length < 126:
+            writer.put_int8((masked << 7) | length)
+        elif length < 65536:
+            writer.put_int8((masked << 7) | 126)
+            writer.put_int16(length)
+        else:
+            writer.put_int8((masked << 7) | 127)
+            writer.put_int64(length)
+        if masked:
+            writer.put_int32(_MASK_KEY)
+        writer.put_string(payload)
+        return writer.build()
+    return _write
+
+
+# name -> factory of the operation, None if not applicable
+OPERATIONS = {
+    'parse': _parse,
+    'pack': _pack,
+    'mask': _mask,
+    'length': _length,
+    'packet': _packet,
+}
+
+# cost independent of the payload, no throughput nor copies
+_HEADER_ONLY = frozenset(['length'])
+
+
+def _timed(operation, min_time):
+    # calibrate the loop count, the clock read once for each batch
+    loops, elapsed = 1, 0.0
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            operation()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return loops / elapsed
+        if elapsed < min_time / 10:
+            loops *= 10
+        else:
+            loops = int(loops * min_time / elapsed) + 1
+
+
+def _traced_peak(operation):
+    operation()
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - baseline
+
+
+def run_operation(name, size, masked, min_time, repeat):
+    payload = _payload(size)
+    operation = OPERATIONS[name](payload, masked)
+    if operation is None:
+        return None
+    ops = max(_timed(operation, min_time) for _ in range(repeat))
+    allocated = _traced_peak(operation)
+    # bytes of payload processed by an operation
+    processed = 0 if name in _HEADER_ONLY else size
+    return {
+        'operation': name,
+        'size': size,
+        'masked': masked,
+        'ops_per_second': ops,
+        'mb_per_second': ops * processed / (1024 * 1024)
+        if processed else None,
+        'allocated_bytes': allocated,
+        'copies': allocated / processed if processed else None,
+    }
+
+
+def _key(result):
+    return result['operation'], result['size'], result['masked']
+
+
+def compare(results, baseline, threshold):
+    """ Regressions of the results against the baseline results
+
+    :return: list of (result, metric, baseline value, value)
+    """
+    previous = {_key(result): result for result in baseline}
+    regressions = list()
+    for result in results:
+        before = previous.get(_key(result))
+        if before is None:
+            continue
+        if result['ops_per_second'] < \
+                before['ops_per_second'] * (1 - threshold / 100):
+            regressions.append((result, 'ops/s', before['ops_per_second'],
+                                result['ops_per_second']))
+        # a few bytes more of a tiny operation is noise
+        if result['allocated_bytes'] > max(
+                before['allocated_bytes'] * (1 + threshold / 100),
+                before['allocated_bytes'] + 256):
+            regressions.append((result, 'allocated', before['allocated_bytes'],
+                                result['allocated_bytes']))
+    return regressions
+
+
+def _size_name(size):
+    for unit, scale in (('MiB', 1024 * 1024), ('KiB', 1024)):
+        if size >= scale and size % scale == 0:
+            return '{}{}'.format(size // scale, unit)
+    return '{}B'.format(size)
+
+
+def _print_result(result, baseline=None):
+    change = ''
+    if baseline is not None:
+        change = '{:>+9.1f}%'.format(
+            (result['ops_per_second'] / baseline['ops_per_second'] - 1) * 100)
+    print('{:>8} {:>9} {:>7} {:>14.0f} {:>11} {:>13} {:>7}{}'.format(
+        result['operation'], _size_name(result['size']),
+        'yes' if result['masked'] else 'no', result['ops_per_second'],
+        '-' if result['mb_per_second'] is None else
+        '{:.1f}'.format(result['mb_per_second']), result['allocated_bytes'],
+        '-' if result['copies'] is None else
+        '{:.2f}'.format(result['copies']), change))
+
+
+def run(operations, sizes, min_time, repeat, baseline=None):
+    previous = {_key(result): result for result in baseline or ()}
+    print('{:>8} {:>9} {:>7} {:>14} {:>11} {:>13} {:>7}{}'.format(
+        'op', 'size', 'masked', 'ops/s', 'MB/s', 'alloc bytes', 'copies',
+        '{:>10}'.format('vs base') if baseline is not None else ''))
+    results = list()
+    for name in operations:
+        for size in sizes:
+            for masked in (False, True):
+                result = run_operation(name, size, masked, min_time, repeat)
+                if result is None:
+                    continue
+                _print_result(result, previous.get(_key(result))
+                              if baseline is not None else None)
+                results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes',
+                        default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help='comma separated payload sizes in bytes')
+    parser.add_argument('--operations', default=','.join(OPERATIONS),
+                        help='comma separated operations: '
+                             + ','.join(OPERATIONS))
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='seconds of each timed run at least')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='timed runs of each operation, the best kept')
+    parser.add_argument('--json', metavar='PATH',
+                        help="write the results as JSON, '-' for stdout "
+                             "and the table to stderr")
+    parser.add_argument('--compare', metavar='PATH',
+                        help='baseline JSON written by --json')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='regression threshold in percent')
+    args = parser.parse_args(argv)
+    operations = args.operations.split(',')
+    for name in operations:
+        if name not in OPERATIONS:
+            parser.error('unknown operation: {}'.format(name))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fd:
+            baseline = json.load(fd)['results']
+    # stdout holds only the JSON document
+    table = sys.stderr if args.json == '-' else sys.stdout
+    with contextlib.redirect_stdout(table):
+        results = run(operations, [int(s) for s in args.sizes.split(',')],
+                      args.min_time, args.repeat, baseline)
+    if args.json:
+        document = json.dumps({
+            'benchmark': 'frame_micro',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'results': results,
+        }, indent=2)
+        if args.json == '-':
+            print(document)
+        else:
+            with open(args.json, 'w') as fd:
+                fd.write(document + '\n')
+    if baseline is None:
+        return 0
+    regressions = compare(results, baseline, args.threshold)
+    for result, metric, before, after in regressions:
+        print('regression: {} {} masked={} {} {:.0f} -> {:.0f}'.format(
+            result['operation'], _size_name(result['size']),
+            result['masked'], metric, before, after), file=table)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
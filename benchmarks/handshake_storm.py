@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 ShadowMan
+#
+"""Opening handshake throughput under a connection storm over loopback
+
+    python -m benchmarks.handshake_storm [--engines selectors,asyncio]
+        [--connections 2000] [--concurrency 256] [--tls] [--no-verify]
+        [--header-size 512] [--json result.json]
+
+All connections are opened by an asyncio load generator and kept open
+until the storm finished, at most `concurrency` handshakes in progress.
+The latency of a connection is from the connect to the 101 response
+received, including the TCP connect and the TLS handshake. The resident
+set size of the server is read before and after the storm.
+
+The load generator runs in this process and the server in a child, on
+a machine with few cores they compete for the same CPUs.
+"""
+import sys
+import ssl
+import json
+import time
+import asyncio
+import argparse
+import contextlib
+import platform
+import tempfile
+import collections
+from benchmarks import common
+
+
+def _setup_factory(verify):
+    def _setup(server):
+        from websocket.ext import handler, http_verifier
+
+        class IdleHandler(handler.WebSocketHandlerProtocol):
+
+            def on_connect(self):
+                pass
+
+            def on_message(self, message):
+                return True
+
+            def on_close(self, code, reason):
+                pass
+
+            def on_error(self, code, reason):
+                pass
+
+        if not verify:
+            http_verifier.disable()
+        server.register_default_handler(IdleHandler)
+    return _setup
+
+
+def _requests(port, count, header_size):
+    # keys generated before the storm, never measured
+    requests = list()
+    for _ in range(count):
+        request = common.handshake_request('127.0.0.1', port, '/')
+        padding = header_size - len(request) - len(b'X-Padding: \r\n')
+        if padding > 0:
+            request = common.handshake_request(
+                '127.0.0.1', port, '/', [b'X-Padding: ' + b'x' * padding])
+        requests.append(request)
+    return requests
+
+
+async def _handshake(port, request, ssl_context, semaphore, latencies,
+                     failures):
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', port, ssl=ssl_context)
+            writer.write(request)
+            head = await reader.readuntil(b'\r\n\r\n')
+        except (OSError, ssl.SSLError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError) as e:
+            failures[type(e).__name__] += 1
+            return None
+        if not head.startswith(b'HTTP/1.1 101'):
+            failures[head.split(b'\r\n', 1)[0].decode()] += 1
+            writer.close()
+            return None
+        latencies.append(time.perf_counter() - start)
+        return writer
+
+
+async def _storm(port, requests, concurrency, ssl_context):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, failures = list(), collections.Counter()
+    start = time.perf_counter()
+    writers = await asyncio.gather(*(
+        _handshake(port, request, ssl_context, semaphore, latencies,
+                   failures)
+        for request in requests))
+    elapsed = time.perf_counter() - start
+    return writers, latencies, failures, elapsed
+
+
+async def _close_all(writers):
+    for writer in writers:
+        if writer is not None:
+            writer.close()
+    await asyncio.gather(*(writer.wait_closed() for writer in writers
+                           if writer is not None), return_exceptions=True)
+
+
+def _percentile(samples, percent):
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+
+def run_engine(engine, connections, concurrency, tls, verify, header_size):
+    ssl_context = None
+    if tls is not None:
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+    process, port = common.start_server(
+        _setup_factory(verify), engine=engine, tls=tls)
+    try:
+        requests = _requests(port, connections, header_size)
+        rss_idle, _ = common.peak_rss(process)
+        loop = asyncio.new_event_loop()
+        try:
+            writers, latencies, failures, elapsed = loop.run_until_complete(
+                _storm(port, requests, concurrency, ssl_context))
+            # all connections still open
+            _, rss_peak = common.peak_rss(process)
+            loop.run_until_complete(_close_all(writers))
+        finally:
+            loop.close()
+    finally:
+        common.stop_server(process)
+    latencies.sort()
+    return {
+        'engine': engine,
+        'connections': connections,
+        'concurrency': concurrency,
+        'tls': tls is not None,
+        'verify': verify,
+        'header_size': len(requests[0]),
+        'handshakes': len(latencies),
+        'handshakes_per_second': len(latencies) / elapsed,
+        'elapsed': elapsed,
+        'latency_ms': {
+            name: None if value is None else value * 1000
+            for name, value in (
+                ('p50', _percentile(latencies, 50)),
+                ('p90', _percentile(latencies, 90)),
+                ('p99', _percentile(latencies, 99)),
+                ('max', latencies[-1] if latencies else None))
+        },
+        'failures': dict(failures),
+        'server_rss_kb': {'idle': rss_idle, 'peak': rss_peak},
+    }
+
+
+def _print_result(result):
+    latency = result['latency_ms']
+    print('{:>10} {:>12.0f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} '
+          '{:>10} {:>10} {:>8}'.format(
+              result['engine'], result['handshakes_per_second'],
+              *(latency[name] or 0.0 for name in ('p50', 'p90', 'p99', 'max')),
+              result['server_rss_kb']['idle'] or '-',
+              result['server_rss_kb']['peak'] or '-',
+              sum(result['failures'].values())))
+    for reason, count in sorted(result['failures'].items()):
+        print('{:>10} failed {}: {}'.format('', count, reason))
+
+
+def _print_banner(connections, concurrency, tls, verify, header_size):
+    print('connections: {}, concurrency: {}, tls: {}, verify: {}, '
+          'header size: {}'.format(connections, concurrency,
+                                   'on' if tls else 'off',
+                                   'on' if verify else 'off', header_size))
+    print('{:>10} {:>12} {:>9} {:>9} {:>9} {:>9} {:>10} {:>10} {:>8}'.format(
+        'engine', 'handshake/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms',
+        'rss KiB', 'peak KiB', 'failed'))
+
+
+def run(engines, connections, concurrency, tls, verify, header_size):
+    limit = common.raise_open_files_limit()
+    if connections + 64 > limit:
+        raise SystemExit('{} connections exceed the open files limit {}'
+                         .format(connections, limit))
+    results = list()
+    with tempfile.TemporaryDirectory() as directory:
+        certificate = common.self_signed(directory) if tls else None
+        for engine in engines:
+            result = run_engine(engine, connections, concurrency,
+                                certificate, verify, header_size)
+            if not results:
+                # the request size depends on the port of the server
+                _print_banner(connections, concurrency, tls, verify,
+                              result['header_size'])
+            _print_result(result)
+            results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--engines', default='selectors,asyncio',
+                        help='comma separated engines: '
+                             + ','.join(common.ENGINES))
+    parser.add_argument('--connections', type=int, default=2000,
+                        help='connections opened and kept open')
+    parser.add_argument('--concurrency', type=int, default=256,
+                        help='handshakes in progress at most')
+    parser.add_argument('--tls', action='store_true',
+                        help='handshake over TLS, needs the openssl tool')
+    parser.add_argument('--no-verify', dest='verify', action='store_false',
+                        help='disable the handshake request verifier')
+    parser.add_argument('--header-size', type=int, default=0,
+                        help='pad the handshake request to it in bytes')
+    parser.add_argument('--json', metavar='PATH',
+                        help="write the results as JSON, '-' for stdout "
+                             "and the table to stderr")
+    args = parser.parse_args(argv)
+    # stdout holds only the JSON document
+    table = sys.stderr if args.json == '-' else sys.stdout
+    with contextlib.redirect_stdout(table):
+        results = run(args.engines.split(','), args.connections,
+                      args.concurrency, args.tls, args.verify,
+                      args.header_size)
+    if args.json:
+        document = json.dumps({
+            'benchmark': 'handshake_storm',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'results': results,
+        }, indent=2)
+        if args.json == '-':
+            print(document)
+        else:
+            with open(args.json, 'w') as fd:
+                fd.write(document + '\n')
+    failed = sum(sum(result['failures'].values()) for result in results)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,467 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 ShadowMan
+#
+"""Messages/s and round-trip latency of the server under load over loopback
+
+    python -m benchmarks.message_load [--scenarios echo,chat,upload]
+        [--connections 1000,10000,50000] [--processes 4] [--duration 10]
+        [--size 32] [--publishers 16] [--upload-size 1048576]
+        [--upload-connections 16] [--engine selectors]
+        [--json result.json] [--compare baseline.json] [--threshold 10]
+
+echo:    every connection writes a message and waits for the echo
+chat:    every connection joins the '/chat' namespace, the publishers
+         write a message and wait for their own copy of the broadcast,
+         the latency is from the publish to the receive of each copy
+upload:  `--upload-connections` connections write a binary frame of
+         `--upload-size` and wait for the acknowledgement
+
+The connections are opened by client processes, each runs an asyncio
+loop and binds its own loopback source address (127.0.0.2, 127.0.0.3,
+...) so 50k connections never exhaust the ephemeral ports. The client
+frames are masked with a zero key, the masking never costs the clients.
+The CPU and the resident set size of the server are sampled during the
+measurement.
+
+With `--compare` the results are checked against a baseline saved by
+`--json`, a run is a regression when the messages/s dropped or the p99
+round trip grew by more than `--threshold` percent. The exit status is
+nonzero on a regression or a failed connection.
+"""
+import sys
+import json
+import time
+import array
+import struct
+import asyncio
+import argparse
+import contextlib
+import platform
+import threading
+import multiprocessing
+from benchmarks import common
+from websocket.net import ws_frame
+
+
+# opening handshakes in progress of a client process at most
+_CONNECT_CONCURRENCY = 64
+# chat message header: publish time (monotonic ns), publisher id
+_chat_header = struct.Struct('!QI')
+_length_uint16 = struct.Struct('!H')
+_length_uint64 = struct.Struct('!Q')
+
+
+def _setup(server):
+    import websocket
+    from websocket.ext import handler
+
+    class EchoHandler(handler.WebSocketHandlerProtocol):
+
+        def on_connect(self):
+            pass
+
+        def on_message(self, message):
+            return websocket.BinaryMessage(message)
+
+        def on_close(self, code, reason):
+            pass
+
+        def on_error(self, code, reason):
+            pass
+
+    class ChatHandler(EchoHandler):
+
+        def on_message(self, message):
+            return self.broadcast(websocket.BinaryMessage(message),
+                                  include_self=True)
+
+    class UploadHandler(EchoHandler):
+
+        def on_message(self, message):
+            return websocket.TextMessage(str(len(message)))
+
+    server.register_default_handler(EchoHandler)
+    server.register_handler('/chat')(ChatHandler)
+    server.register_handler('/upload')(UploadHandler)
+
+
+def _client_frame(payload):
+    # the zero masking key leaves the payload as is
+    return ws_frame.encode_frame_header(0x82, len(payload), 0) + payload
+
+
+async def _read_frame(reader):
+    """ Payload of the next server-to-client frame, never masked """
+    header = await reader.readexactly(2)
+    length = header[1] & 0x7f
+    if length == 126:
+        length = _length_uint16.unpack(await reader.readexactly(2))[0]
+    elif length == 127:
+        length = _length_uint64.unpack(await reader.readexactly(8))[0]
+    return await reader.readexactly(length)
+
+
+async def _open(port, path, source, semaphore, failures):
+    async with semaphore:
+        try:
+            reader, writer = await asyncio.open_connection(
+                '127.0.0.1', port, local_addr=(source, 0))
+            writer.write(common.handshake_request('127.0.0.1', port, path))
+            head = await reader.readuntil(b'\r\n\r\n')
+        except (OSError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError) as e:
+            failures[type(e).__name__] = failures.get(type(e).__name__, 0) + 1
+            return None
+        if not head.startswith(b'HTTP/1.1 101'):
+            reason = head.split(b'\r\n', 1)[0].decode()
+            failures[reason] = failures.get(reason, 0) + 1
+            writer.close()
+            return None
+        return reader, writer
+
+
+async def _echo(reader, writer, frame, counters, samples):
+    while True:
+        sent = time.monotonic()
+        writer.write(frame)
+        await _read_frame(reader)
+        samples.append(time.monotonic() - sent)
+        counters['messages'] += 1
+        counters['bytes'] += len(frame)
+
+
+async def _chat(reader, writer, publisher_id, padding, counters, samples):
+    while True:
+        if publisher_id is not None:
+            writer.write(_client_frame(_chat_header.pack(
+                time.monotonic_ns(), publisher_id) + padding))
+            counters['published'] += 1
+        while True:
+            payload = await _read_frame(reader)
+            published, sender = _chat_header.unpack_from(payload)
+            samples.append((time.monotonic_ns() - published) / 1e9)
+            counters['messages'] += 1
+            counters['bytes'] += len(payload)
+            if publisher_id is None or sender == publisher_id:
+                break
+
+
+async def _client_main(index, port, options, ready):
+    scenario = options['scenario']
+    path = {'echo': '/', 'chat': '/chat', 'upload': '/upload'}[scenario]
+    # 127.0.0.1 is the server, each client process has its own source
+    source = '127.0.{}.{}'.format(index // 250, 2 + index % 250)
+    semaphore = asyncio.Semaphore(_CONNECT_CONCURRENCY)
+    failures = dict()
+    opened = await asyncio.gather(*(
+        _open(port, path, source, semaphore, failures)
+        for _ in range(options['connections'])))
+    connections = [connection for connection in opened if connection]
+    # every process connected, then the measurement starts together
+    await asyncio.get_running_loop().run_in_executor(
+        None, ready.wait, options['connect_timeout'])
+
+    counters = {'messages': 0, 'bytes': 0, 'published': 0}
+    samples = array.array('d')
+    if scenario == 'chat':
+        padding = b'x' * max(0, options['size'] - _chat_header.size)
+        tasks = [_chat(reader, writer,
+                       index * options['connections'] + number
+                       if number < options['publishers'] else None,
+                       padding, counters, samples)
+                 for number, (reader, writer) in enumerate(connections)]
+    else:
+        size = options['size']
+        if scenario == 'upload':
+            size = options['upload_size']
+        frame = _client_frame(b'x' * size)
+        tasks = [_echo(reader, writer, frame, counters, samples)
+                 for reader, writer in connections]
+    tasks = [asyncio.ensure_future(task) for task in tasks]
+    start = time.monotonic()
+    done, pending = await asyncio.wait(tasks, timeout=options['duration'])
+    elapsed = time.monotonic() - start
+    for task in pending:
+        task.cancel()
+    for task in done:
+        # a connection closed by the server during the measurement
+        error = task.exception()
+        if error is not None:
+            name = type(error).__name__
+            failures[name] = failures.get(name, 0) + 1
+    for _, writer in connections:
+        writer.close()
+    await asyncio.gather(*pending, return_exceptions=True)
+    return {
+        'connections': len(connections),
+        'elapsed': elapsed,
+        'counters': counters,
+        'samples': samples.tobytes(),
+        'failures': failures,
+    }
+
+
+def _client(index, port, options, ready, results):
+    common.raise_open_files_limit()
+    loop = asyncio.new_event_loop()
+    try:
+        result = loop.run_until_complete(
+            _client_main(index, port, options, ready))
+    except threading.BrokenBarrierError:
+        result = {'failures': {'BrokenBarrierError': 1}}
+    finally:
+        loop.close()
+    results.put(result)
+
+
+def _split(total, parts):
+    return [total // parts + (1 if index < total % parts else 0)
+            for index in range(parts)]
+
+
+def _sample_server(process, stop, samples):
+    while not stop.wait(0.25):
+        rss, _ = common.peak_rss(process)
+        if rss is not None:
+            samples.append(rss)
+
+
+def _percentile(samples, percent):
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+
+def run_scenario(engine, scenario, connections, options):
+    processes = min(options['processes'], connections)
+    process, port = common.start_server(_setup, engine=engine)
+    try:
+        ready = multiprocessing.Barrier(processes + 1)
+        results = multiprocessing.Queue()
+        publishers = _split(options['publishers'], processes)
+        clients = [multiprocessing.Process(
+            target=_client, args=(index, port, dict(
+                options, scenario=scenario, connections=count,
+                publishers=publishers[index]), ready, results),
+            daemon=True)
+            for index, count in enumerate(_split(connections, processes))]
+        for client in clients:
+            client.start()
+        try:
+            ready.wait(options['connect_timeout'])
+        except threading.BrokenBarrierError:
+            pass
+        rss_idle, _ = common.peak_rss(process)
+        cpu_start = common.cpu_seconds(process)
+        stop, rss_samples = threading.Event(), list()
+        sampler = threading.Thread(
+            target=_sample_server, args=(process, stop, rss_samples))
+        sampler.start()
+        start = time.monotonic()
+        try:
+            outcomes = [results.get(timeout=options['duration']
+                                    + options['connect_timeout'])
+                        for _ in clients]
+        finally:
+            stop.set()
+            sampler.join()
+        elapsed = time.monotonic() - start
+        cpu_end = common.cpu_seconds(process)
+        for client in clients:
+            client.join(5)
+    finally:
+        common.stop_server(process)
+
+    latencies, failures = array.array('d'), dict()
+    counters = {'messages': 0, 'bytes': 0, 'published': 0}
+    opened, duration = 0, 0.0
+    for outcome in outcomes:
+        for reason, count in outcome['failures'].items():
+            failures[reason] = failures.get(reason, 0) + count
+        if 'samples' not in outcome:
+            continue
+        opened += outcome['connections']
+        duration = max(duration, outcome['elapsed'])
+        latencies.frombytes(outcome['samples'])
+        for name in counters:
+            counters[name] += outcome['counters'][name]
+    latencies = sorted(latencies)
+    duration = duration or elapsed
+    cpu = None
+    if cpu_start is not None and cpu_end is not None:
+        cpu = (cpu_end - cpu_start) / elapsed
+    return {
+        'engine': engine,
+        'scenario': scenario,
+        'connections': connections,
+        'connected': opened,
+        'client_processes': processes,
+        'duration': duration,
+        'messages': counters['messages'],
+        'messages_per_second': counters['messages'] / duration,
+        'mb_per_second': counters['bytes'] / duration / (1024 * 1024),
+        'published': counters['published'],
+        'rtt_ms': {
+            name: None if value is None else value * 1000
+            for name, value in (
+                ('p50', _percentile(latencies, 50)),
+                ('p99', _percentile(latencies, 99)),
+                ('p999', _percentile(latencies, 99.9)),
+                ('max', latencies[-1] if latencies else None))
+        },
+        'server_cpu': cpu,
+        'server_rss_kb': {
+            'idle': rss_idle,
+            'peak': max(rss_samples) if rss_samples else None,
+        },
+        'failures': failures,
+    }
+
+
+def _key(result):
+    return result['engine'], result['scenario'], result['connections']
+
+
+def compare(results, baseline, threshold):
+    """ Regressions of the results against the baseline results
+
+    :return: list of (result, metric, baseline value, value)
+    """
+    previous = {_key(result): result for result in baseline}
+    regressions = list()
+    for result in results:
+        before = previous.get(_key(result))
+        if before is None:
+            continue
+        if result['messages_per_second'] < \
+                before['messages_per_second'] * (1 - threshold / 100):
+            regressions.append((result, 'messages/s',
+                                before['messages_per_second'],
+                                result['messages_per_second']))
+        p99, before_p99 = result['rtt_ms']['p99'], before['rtt_ms']['p99']
+        if p99 is not None and before_p99 is not None and \
+                p99 > before_p99 * (1 + threshold / 100):
+            regressions.append((result, 'p99 ms', before_p99, p99))
+    return regressions
+
+
+def _print_result(result):
+    rtt = result['rtt_ms']
+    print('{:>8} {:>8} {:>12.0f} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f} '
+          '{:>6} {:>10} {:>8}'.format(
+              result['scenario'], result['connected'],
+              result['messages_per_second'], result['mb_per_second'],
+              *(rtt[name] or 0.0 for name in ('p50', 'p99', 'p999')),
+              '-' if result['server_cpu'] is None else
+              '{:.0%}'.format(result['server_cpu']),
+              result['server_rss_kb']['peak'] or '-',
+              sum(result['failures'].values())))
+    for reason, count in sorted(result['failures'].items()):
+        print('{:>8} failed {}: {}'.format('', count, reason))
+
+
+def run(engine, scenarios, connections_list, options):
+    limit = common.raise_open_files_limit()
+    print('engine: {}, client processes: {}, duration: {}s, size: {}, '
+          'publishers: {}'.format(engine, options['processes'],
+                                  options['duration'], options['size'],
+                                  options['publishers']))
+    print('{:>8} {:>8} {:>12} {:>9} {:>9} {:>9} {:>9} {:>6} {:>10} {:>8}'
+          .format('scenario', 'conns', 'message/s', 'MB/s', 'p50 ms',
+                  'p99 ms', 'p999 ms', 'cpu', 'peak KiB', 'failed'))
+    results = list()
+    for scenario in scenarios:
+        counts = connections_list
+        if scenario == 'upload':
+            counts = [options['upload_connections']]
+        for connections in counts:
+            if connections + 64 > limit:
+                print('{:>8} {:>8} skipped, exceed the open files limit {}'
+                      .format(scenario, connections, limit))
+                continue
+            result = run_scenario(engine, scenario, connections, options)
+            _print_result(result)
+            results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default='echo,chat,upload',
+                        help='comma separated scenarios: echo,chat,upload')
+    parser.add_argument('--connections', default='1000,10000,50000',
+                        help='comma separated connection counts')
+    parser.add_argument('--processes', type=int,
+                        default=min(8, multiprocessing.cpu_count()),
+                        help='client processes')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='seconds of each measurement')
+    parser.add_argument('--connect-timeout', type=float, default=300.0,
+                        help='seconds to open all connections at most')
+    parser.add_argument('--size', type=int, default=32,
+                        help='echo and chat payload size in bytes')
+    parser.add_argument('--publishers', type=int, default=16,
+                        help='chat connections publishing messages')
+    parser.add_argument('--upload-size', type=int, default=1024 * 1024,
+                        help='upload payload size in bytes')
+    parser.add_argument('--upload-connections', type=int, default=16,
+                        help='connections of the upload scenario')
+    parser.add_argument('--engine', default='selectors',
+                        choices=common.ENGINES)
+    parser.add_argument('--json', metavar='PATH',
+                        help="write the results as JSON, '-' for stdout "
+                             "and the table to stderr")
+    parser.add_argument('--compare', metavar='PATH',
+                        help='baseline JSON written by --json')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='regression threshold in percent')
+    args = parser.parse_args(argv)
+    scenarios = args.scenarios.split(',')
+    for scenario in scenarios:
+        if scenario not in ('echo', 'chat', 'upload'):
+            parser.error('unknown scenario: {}'.format(scenario))
+    options = {
+        'processes': max(1, args.processes),
+        'duration': args.duration,
+        'connect_timeout': args.connect_timeout,
+        'size': args.size,
+        'publishers': args.publishers,
+        'upload_size': args.upload_size,
+        'upload_connections': args.upload_connections,
+    }
+    # stdout holds only the JSON document
+    table = sys.stderr if args.json == '-' else sys.stdout
+    with contextlib.redirect_stdout(table):
+        results = run(args.engine, scenarios,
+                      [int(c) for c in args.connections.split(',')], options)
+    if args.json:
+        document = json.dumps({
+            'benchmark': 'message_load',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'options': options,
+            'results': results,
+        }, indent=2)
+        if args.json == '-':
+            print(document)
+        else:
+            with open(args.json, 'w') as fd:
+                fd.write(document + '\n')
+    failed = sum(sum(result['failures'].values()) for result in results)
+    regressions = list()
+    if args.compare:
+        with open(args.compare) as fd:
+            regressions = compare(results, json.load(fd)['results'],
+                                  args.threshold)
+    for result, metric, before, after in regressions:
+        print('regression: {} {} {} connections: {} {:.2f} -> {:.2f}'
+              .format(result['engine'], result['scenario'],
+                      result['connections'], metric, before, after),
+              file=table)
+    return 1 if failed or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 ShadowMan
+#
+"""Compare the legacy ctypes `ByteArray` with the bytearray-backed one
+
+    python -m benchmarks.packet_compare [--sizes 125,65536,16777216]
+
+The receive path constructs a byte array from a raw frame, reads the two
+header octets and builds the payload. The send path packs a header and
+the payload through the `Packet` writer and builds the frame.
+"""
+import sys
+import time
+import ctypes
+import struct
+import argparse
+from websocket.utils import packet
+
+
+class _LegacyByte(ctypes.Union):
+
+    class _Bits(ctypes.Structure):
+
+        _fields_ = [
+            ('b7', ctypes.c_uint8, 1), ('b6', ctypes.c_uint8, 1),
+            ('b5', ctypes.c_uint8, 1), ('b4', ctypes.c_uint8, 1),
+            ('b3', ctypes.c_uint8, 1), ('b2', ctypes.c_uint8, 1),
+            ('b1', ctypes.c_uint8, 1), ('b0', ctypes.c_uint8, 1),
+        ]
+
+    _fields_ = [
+        ('value', ctypes.c_char),
+        ('bits', _Bits)
+    ]
+    _anonymous_ = ('bits',)
+
+    def __init__(self, octet_data):
+        super(_LegacyByte, self).__init__()
+        self.value = octet_data & 0xff
+
+
+class _LegacyPacket(object):
+    """The previous `packet.Packet`, one ctypes object per octet"""
+
+    def __init__(self, raw_data=None):
+        raw_data = b'' if raw_data is None else raw_data
+        self.size = len(raw_data)
+        self.elements = list(map(lambda el: _LegacyByte(el), raw_data))
+
+    def build(self, start=0):
+        return struct.pack('!{}B'.format(self.size - start), *[
+            ord(byte.value) for byte in self.elements[start:]
+        ])
+
+    def get_bits(self, index):
+        byte = self.elements[index]
+        return (byte.b0, byte.b1, byte.b2, byte.b3,
+                byte.b4, byte.b5, byte.b6, byte.b7)
+
+    def update(self, raw_data):
+        ba = _LegacyPacket(raw_data)
+        self.size += ba.size
+        self.elements += ba.elements
+
+    def put_int8(self, value):
+        self.elements.insert(self.size, _LegacyByte(value))
+        self.size += 1
+
+    def put_int16(self, value):
+        self.put_int8((value & 0xff00) >> 8)
+        self.put_int8((value & 0x00ff) >> 0)
+
+    def put_int64(self, value):
+        for shift in (48, 32, 16, 0):
+            self.put_int16((value >> shift) & 0xffff)
+
+    def put_bits(self, *bits):
+        self.put_int8(int(''.join([str(b) for b in bits]), 2))
+
+
+def _frame_header(size):
+    if size < 126:
+        return b'\x82' + struct.pack('!B', size)
+    elif size < 65536:
+        return b'\x82\x7e' + struct.pack('!H', size)
+    return b'\x82\x7f' + struct.pack('!Q', size)
+
+
+def _receive(factory, frame):
+    byte_array = factory(frame)
+    byte_array.get_bits(0)
+    flag_length = packet.bits_to_integer(byte_array.get_bits(1)[1:])
+    return byte_array.build({126: 4, 127: 10}.get(flag_length, 2))
+
+
+def _send(factory, payload):
+    frame = factory()
+    frame.put_bits(1, 0, 0, 0, 0, 0, 1, 0)
+    if len(payload) < 126:
+        frame.put_bits(*packet.number_to_bits(len(payload), 8))
+    elif len(payload) < 65536:
+        frame.put_bits(0, 1, 1, 1, 1, 1, 1, 0)
+        frame.put_int16(len(payload))
+    else:
+        frame.put_bits(0, 1, 1, 1, 1, 1, 1, 1)
+        frame.put_int64(len(payload))
+    frame.update(payload)
+    return frame.build()
+
+
+def _timeit(func, *args, min_time=0.2):
+    rounds, start = 0, time.perf_counter()
+    while True:
+        func(*args)
+        rounds += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return elapsed / rounds
+
+
+def run(sizes, legacy=True):
+    implementations = [('bytearray', packet.Packet)]
+    if legacy:
+        implementations.insert(0, ('ctypes', _LegacyPacket))
+
+    print('{:>10} {:>10} {:>14} {:>14}'.format(
+        'size', 'impl', 'receive(us)', 'send(us)'))
+    for size in sizes:
+        payload = b'\xa5' * size
+        frame = _frame_header(size) + payload
+        results = []
+        for name, factory in implementations:
+            assert _receive(factory, frame) == payload
+            assert _send(factory, payload) == frame
+            receive = _timeit(_receive, factory, frame)
+            send = _timeit(_send, factory, payload)
+            results.append((receive, send))
+            print('{:>10} {:>10} {:>14.1f} {:>14.1f}'.format(
+                size, name, receive * 1e6, send * 1e6))
+        if len(results) == 2:
+            print('{:>10} {:>10} {:>13.1f}x {:>13.1f}x'.format(
+                size, 'speedup', results[0][0] / results[1][0],
+                results[0][1] / results[1][1]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='125,65536,16777216',
+                        help='comma separated payload sizes in bytes')
+    parser.add_argument('--no-legacy', action='store_true',
+                        help='only measure the bytearray implementation')
+    args = parser.parse_args(argv)
+    run([int(size) for size in args.sizes.split(',')], not args.no_legacy)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 ShadowMan
+#
+"""Large-frame upload throughput over loopback
+
+    python -m benchmarks.upload_throughput [--sizes 1048576,16777216]
+
+Each masked binary frame is acknowledged by the server with its payload
+length, the next frame is sent after the acknowledgement.
+"""
+import sys
+import time
+import argparse
+from benchmarks import common
+
+
+def _setup(server):
+    import websocket
+    from websocket.ext import handler
+
+    @server.register_default_handler
+    class UploadHandler(handler.WebSocketHandlerProtocol):
+
+        def on_connect(self):
+            pass
+
+        def on_message(self, message):
+            return websocket.TextMessage(str(len(message)))
+
+        def on_close(self, code, reason):
+            pass
+
+        def on_error(self, code, reason):
+            pass
+
+
+def run(sizes, total):
+    process, port = common.start_server(_setup)
+    try:
+        sock, reader = common.connect('127.0.0.1', port)
+        print('{:>10} {:>8} {:>12} {:>10}'.format(
+            'size', 'frames', 'seconds', 'MB/s'))
+        for size in sizes:
+            frame = common.client_frame(b'\x5a' * size)
+            count = max(1, total // size)
+            start = time.perf_counter()
+            for _ in range(count):
+                sock.sendall(frame)
+                assert reader.read_frame().payload_data == str(size).encode()
+            elapsed = time.perf_counter() - start
+            print('{:>10} {:>8} {:>12.3f} {:>10.1f}'.format(
+                size, count, elapsed, size * count / elapsed / 1e6))
+        sock.close()
+    finally:
+        common.stop_server(process)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='65536,1048576,16777216',
+                        help='comma separated payload sizes in bytes')
+    parser.add_argument('--total', type=int, default=64 * 1024 * 1024,
+                        help='bytes uploaded for each size')
+    args = parser.parse_args(argv)
+    run([int(size) for size in args.sizes.split(',')], args.total)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 ShadowMan
+#
+"""Delivery and fan-out latency of the worker bus over loopback
+
+    python -m benchmarks.worker_bus [--workers 4] [--clients 32]
+        [--large-size 1048576] [--large-count 5]
+
+The clients are connected until each worker has some of them. Each
+message published by one client must be received by all clients in
+order, the fan-out latency is the time until the last client received it.
+The large messages exceed a datagram and are fragmented by the bus, a
+message exceeding the bus limit must be refused to the publisher. The
+statistics of the bus are collected from each worker at the end.
+"""
+import sys
+import json
+import time
+import argparse
+from benchmarks import common
+from websocket.net import worker_bus
+
+
+def _setup(server):
+    import os
+    import websocket
+    from websocket.ext import handler
+    from websocket.utils import exceptions
+
+    class RoomHandler(handler.WebSocketHandlerProtocol):
+
+        def on_connect(self):
+            self.subscribe('room')
+
+        def on_message(self, message):
+            message = message.decode() \
+                if isinstance(message, (bytes, bytearray)) else message
+            if message == 'pid':
+                return websocket.TextMessage(str(os.getpid()))
+            if message == 'statistics':
+                return websocket.TextMessage(json.dumps(
+                    server.worker_bus.statistics.as_dict()))
+            try:
+                if message.startswith('broadcast:'):
+                    return self.broadcast(
+                        websocket.TextMessage(message), True)
+                return self.publish(
+                    'room', websocket.TextMessage(message), True)
+            except exceptions.BroadcastError:
+                return websocket.TextMessage('refused')
+
+        def on_close(self, code, reason):
+            pass
+
+        def on_error(self, code, reason):
+            pass
+
+    server.register_handler('/room')(RoomHandler)
+
+
+def _ask(sock, reader, request):
+    sock.sendall(common.client_frame(request.encode(), 0x1))
+    return reader.read_frame().payload_data.decode()
+
+
+def _connect_all_workers(port, workers, clients):
+    connections, pids = list(), dict()
+    attempts = 0
+    while len(connections) < clients or len(pids) < workers:
+        attempts += 1
+        if attempts > clients * 20:
+            raise RuntimeError('only {} of {} workers reached'.format(
+                len(pids), workers))
+        sock, reader = common.connect('127.0.0.1', port, '/room')
+        pid = int(_ask(sock, reader, 'pid'))
+        if len(connections) >= clients and pid in pids:
+            sock.close()
+            continue
+        pids.setdefault(pid, (sock, reader))
+        connections.append((sock, reader))
+    return connections, pids
+
+
+def _fan_out(connections, count, prefix, size=0):
+    publisher, _ = connections[0]
+    latencies, missing = list(), 0
+    for index in range(count):
+        payload = '{}{}:'.format(prefix, index).encode()
+        payload += b'x' * (size - len(payload))
+        start = time.perf_counter()
+        publisher.sendall(common.client_frame(payload, 0x1))
+        for _, reader in connections:
+            if reader.read_frame().payload_data != payload:
+                missing += 1
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies, missing
+
+
+def _print_latency(name, latencies):
+    print('{:>10} p50 {:.3f} ms, p99 {:.3f} ms, max {:.3f} ms'.format(
+        name, latencies[len(latencies) // 2] * 1000,
+        latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] * 1000,
+        latencies[-1] * 1000))
+
+
+def _refused(connections, size):
+    # exceeds the bus limit, only the publisher answered
+    sock, reader = connections[0]
+    sock.sendall(common.client_frame(b'publish:' + b'x' * size, 0x1))
+    return reader.read_frame().payload_data == b'refused'
+
+
+def run(engine, workers, clients, count, large_size, large_count):
+    process, port = common.start_server(
+        _setup, engine=engine, workers=workers)
+    try:
+        connections, pids = _connect_all_workers(port, workers, clients)
+        print('engine: {}, workers: {}, clients: {}, messages: {}'.format(
+            engine, len(pids), len(connections), count))
+        publish, publish_missing = _fan_out(connections, count, 'publish:')
+        broadcast, broadcast_missing = \
+            _fan_out(connections, count, 'broadcast:')
+        large, large_missing = _fan_out(
+            connections, large_count, 'publish:', large_size)
+        refused = _refused(connections, worker_bus.WorkerBus.MAX_RECORD_SIZE)
+        _print_latency('publish', publish)
+        _print_latency('broadcast', broadcast)
+        _print_latency('large', large)
+        missing = publish_missing + broadcast_missing + large_missing
+        total = (2 * count + large_count) * len(connections)
+        print('delivered {}/{}, over-size message {}'.format(
+            total - missing, total, 'refused' if refused else 'NOT refused'))
+
+        print('{:>8} {:>10} {:>10} {:>10} {:>10} {:>12}'.format(
+            'worker', 'sent', 'received', 'datagrams', 'dropped',
+            'bus p99 ms'))
+        for pid, (sock, reader) in sorted(pids.items()):
+            statistics = json.loads(_ask(sock, reader, 'statistics'))
+            print('{:>8} {:>10} {:>10} {:>10} {:>10} {:>12.3f}'.format(
+                pid, statistics['messages_sent'],
+                statistics['messages_received'],
+                statistics['datagrams_sent'],
+                statistics['datagrams_dropped'],
+                statistics['latency_p99'] * 1000))
+        for sock, _ in connections:
+            sock.close()
+        return 1 if missing or not refused else 0
+    finally:
+        common.stop_server(process)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--engine', default='selectors',
+                        choices=common.ENGINES)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--count', type=int, default=500,
+                        help='messages of each fan-out')
+    parser.add_argument('--large-size', type=int, default=1024 * 1024,
+                        help='bytes of the fragmented messages')
+    parser.add_argument('--large-count', type=int, default=5,
+                        help='fragmented messages of the fan-out')
+    args = parser.parse_args(argv)
+    return run(args.engine, args.workers, args.clients, args.count,
+               args.large_size, args.large_count)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 ShadowMan
+#
+"""Throughput of the pre-fork worker mode over loopback
+
+    python -m benchmarks.worker_scaling [--workers 1,2,4] [--clients 8]
+
+Each client process opens and closes connections for the connect phase,
+then keeps one connection and waits for the echo of each message. The
+throughput should grow with the workers until the cores run out.
+"""
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+from benchmarks import common
+
+
+def _setup(server):
+    import websocket
+    from websocket.ext import handler
+
+    class EchoHandler(handler.WebSocketHandlerProtocol):
+
+        def on_connect(self):
+            pass
+
+        def on_message(self, message):
+            return websocket.TextMessage(message)
+
+        def on_close(self, code, reason):
+            pass
+
+        def on_error(self, code, reason):
+            pass
+
+    server.register_default_handler(EchoHandler)
+
+
+def _client(port, duration, results):
+    deadline = time.perf_counter() + duration
+    connects = 0
+    while time.perf_counter() < deadline:
+        sock, _ = common.connect('127.0.0.1', port)
+        sock.close()
+        connects += 1
+
+    sock, reader = common.connect('127.0.0.1', port)
+    frame = common.client_frame(b'ping')
+    deadline = time.perf_counter() + duration
+    messages = 0
+    while time.perf_counter() < deadline:
+        sock.sendall(frame)
+        reader.read_frame()
+        messages += 1
+    sock.close()
+    results.put((connects, messages))
+
+
+def _measure(port, clients, duration):
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(
+        target=_client, args=(port, duration, results))
+        for _ in range(clients)]
+    for process in processes:
+        process.start()
+    totals = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return (sum(t[0] for t in totals) / duration,
+            sum(t[1] for t in totals) / duration)
+
+
+def run(engine, workers_list, clients, duration):
+    print('engine: {}, clients: {}, cores: {}'.format(
+        engine, clients, os.cpu_count()))
+    print('{:>8} {:>12} {:>12} {:>10}'.format(
+        'workers', 'connect/s', 'message/s', 'speedup'))
+    baseline = None
+    for workers in workers_list:
+        process, port = common.start_server(
+            _setup, engine=engine, workers=workers)
+        try:
+            connect, message = _measure(port, clients, duration)
+        finally:
+            common.stop_server(process)
+        if baseline is None:
+            baseline = message
+        print('{:>8} {:>12.0f} {:>12.0f} {:>9.2f}x'.format(
+            workers, connect, message, message / baseline))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    default_workers = sorted({1, 2, max(1, os.cpu_count() or 1)})
+    parser.add_argument('--workers',
+                        default=','.join(map(str, default_workers)),
+                        help='comma separated worker counts')
+    parser.add_argument('--engine', default='selectors',
+                        choices=common.ENGINES)
+    parser.add_argument('--clients', type=int, default=8,
+                        help='client processes')
+    parser.add_argument('--duration', type=float, default=2.0,
+                        help='seconds of each phase')
+    args = parser.parse_args(argv)
+    run(args.engine, [int(w) for w in args.workers.split(',')],
+        args.clients, args.duration)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
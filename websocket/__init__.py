@@ -23,14 +23,23 @@ if sys.version_info[0] < 3:
 
 # import create server method
 from websocket.server import *
+# import asyncio server
+from websocket.async_server import *
 # import logger
 from websocket.utils import logger
 # import all response type
 from websocket.net.ws_frame import (
     TextMessage, FileTextMessage,
-    BinaryMessage, FileBinaryMessage
+    BinaryMessage, FileBinaryMessage,
+    PackedFrame, BroadcastReport
 )
 # import all controller
 from websocket.controller.base_controller import BaseController
 from websocket.controller.plain_controller import PlainController
 from websocket.controller.event_controller import EventController
+from websocket.controller.process_controller import ProcessController
+# import extension interfaces and options
+from websocket.ext.extension import (
+    Extension, ExtensionOptions, enable_extension
+)
+from websocket.ext.ws_exts.permessage_deflate import PerMessageDeflateOptions
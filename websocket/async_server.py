@@ -0,0 +1,633 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 ShadowMan
+#
+# The asyncio engine shares the handshake, the handlers, the controllers
+# and the registration API with the selectors engine. Each connection is a
+# `WebSocketProtocol`, the transport receives into the buffer of the
+# `TCPStream` directly and the frames are handled by the controller.
+#
+# Message handlers can be `async def` functions. The frames of a connection
+# are still handled in order, the next frame waits until the coroutine
+# of the previous one finished.
+import os
+import signal
+import asyncio
+from websocket.utils import (
+    exceptions, logger, generic
+)
+from websocket.ext import (
+    handler, http_verifier, handler_executor, process_executor
+)
+from websocket.net import (
+    ws_frame, tcp_stream, http_parser
+)
+from websocket import prefork
+from websocket.server import (
+    Daemon, HandlerRegistry, Broadcaster, WebSocketServerBase,
+    handshake_response, handshake_error_response, check_listen_backlog
+)
+
+
+__all__ = ['AsyncWebSocketServer', 'create_async_websocket_server']
+
+
+# event loops supported by the asyncio engine
+EVENT_LOOPS = ('asyncio', 'uvloop')
+
+
+def install_event_loop_policy(loop_name):
+    """ Install the event loop policy, fall back to asyncio if unavailable
+
+    :return: name of the event loop actually used
+    """
+    if loop_name not in EVENT_LOOPS:
+        raise exceptions.ParameterError(
+            'event loop must be one of {}'.format(', '.join(EVENT_LOOPS)))
+    if loop_name == 'uvloop':
+        try:
+            import uvloop
+        except ImportError:
+            logger.warning('uvloop not installed, using the asyncio loop')
+            return 'asyncio'
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return loop_name
+
+
+class WebSocketProtocol(asyncio.BufferedProtocol):
+
+    def __init__(self, server):
+        """ WebSocketProtocol members
+
+        :type self._server: AsyncWebSocketServer
+        :type self._transport: asyncio.Transport
+        :type self._tcp_stream: tcp_stream.TCPStream
+        :type self._controller: BaseController
+        :type self._waiting: asyncio.Task
+        """
+        self._server = server
+        self._transport = None
+        self._socket_fd = None
+        self._tcp_stream = None
+        # handshake request parser, None after the handshake
+        self._handshake_parser = None
+        self._controller = None
+        # task of the coroutine handler, later frames wait for it
+        self._waiting = None
+        # drain scheduled for frames deferred by the frame budget
+        self._drain_handle = None
+        # transport buffer exceeds the high watermark
+        self._paused_writing = False
+        # reading paused until the offloaded handler finished
+        self._offload_paused = False
+        self._drain_waiters = list()
+        # responses of a drained batch written at once
+        self._corked = None
+        # close frame information (endpoint, receive/send close flag)
+        self._close_information = (None, False)
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._socket_fd = transport.get_extra_info('socket')
+        # the transport knows the address, never query the socket
+        self._tcp_stream = tcp_stream.TCPStream(
+            self._socket_fd, transport.get_extra_info('peername'))
+        self._handshake_parser = self._server._create_handshake_parser()
+        transport.set_write_buffer_limits(
+            self._server.high_watermark, self._server.low_watermark)
+        logger.debug('Client({}:{}) connecting'.format(
+            *self._tcp_stream.peer_name))
+
+    def get_buffer(self, size_hint):
+        # receive into the stream buffer, no copy
+        return self._tcp_stream.receive_view(size_hint)
+
+    def buffer_updated(self, size):
+        self._tcp_stream.commit(size)
+        if self._controller is None:
+            self._accept_http_handshake()
+        else:
+            self._drain_frames()
+
+    def eof_received(self):
+        # close the transport
+        return False
+
+    def connection_lost(self, exc):
+        if exc is not None:
+            logger.info('Client connection lost, reason({})'.format(exc))
+        logger.debug('Client socket fd closed')
+        self._server._remove_connection(self._socket_fd)
+        if self._waiting is not None:
+            self._waiting.cancel()
+        if self._drain_handle is not None:
+            self._drain_handle.cancel()
+        self._wakeup_drain_waiters()
+
+    def pause_writing(self):
+        # stop reading from the client until the transport buffer drained
+        self._paused_writing = True
+        self._transport.pause_reading()
+        self._notify_backpressure('on_pause_writing')
+
+    def resume_writing(self):
+        self._paused_writing = False
+        if not self._transport.is_closing() and not self._offload_paused:
+            self._transport.resume_reading()
+        self._wakeup_drain_waiters()
+        self._notify_backpressure('on_resume_writing')
+        # frames buffered while paused
+        if self._controller is not None and self._drain_handle is None:
+            self._drain_handle = \
+                self._server.loop.call_soon(self._drain_frames)
+
+    async def drain(self):
+        """ Wait until the transport buffer below the low watermark """
+        if self._paused_writing:
+            waiter = self._server.loop.create_future()
+            self._drain_waiters.append(waiter)
+            await waiter
+
+    def write(self, data_pack):
+        """ Output method of the controller """
+        if self._transport.is_closing():
+            return
+        if isinstance(data_pack, (ws_frame.FrameBase, ws_frame.PackedFrame)):
+            if data_pack.frame_type == ws_frame.Close_Frame:
+                # from server(normal or error occurs) first send close-frame
+                if self._close_information[0] is None:
+                    self._close_information = ('server', False)
+                else:
+                    self._close_information = (
+                        self._close_information[0], True)
+        if logger.debug_enabled():
+            logger.debug('Response: {}'.format(data_pack))
+        if hasattr(data_pack, 'pack_parts'):
+            data = data_pack.pack_parts()
+        elif hasattr(data_pack, 'pack'):
+            data = (data_pack.pack(),)
+        else:
+            raise exceptions.SendDataPackError('data pack invalid')
+        if self._corked is not None:
+            self._corked.extend(data)
+        else:
+            self._transport.writelines(data)
+        if self._close_information[1] is True:
+            # closed after the buffered data flushed
+            self._uncork()
+            self._transport.close()
+
+    @property
+    def controller(self):
+        return self._controller
+
+    def _accept_http_handshake(self):
+        if self._transport.is_closing():
+            # rejected, closed when the response sent
+            return
+        try:
+            # resume from the previous scan, the payload dropped
+            http_request = self._handshake_parser.feed(self._tcp_stream)
+        except exceptions.HttpParserError as e:
+            logger.warning('Client({}:{}) handshake invalid({})'.format(
+                *self._tcp_stream.peer_name, e))
+            http_response, accepted = handshake_error_response(e), False
+        else:
+            if http_request is None:
+                return
+            # Verify http request is correct
+            http_response, accepted, extensions = handshake_response(
+                self._tcp_stream.peer_name, http_request,
+                self._server.extensions, self._server._enabled_extensions(
+                    generic.to_string(http_request.url_path)))
+        self._handshake_parser = None
+        if not accepted:
+            self.write(http_response)
+            self._transport.close()
+            return
+
+        namespace = generic.to_string(http_request.url_path)
+        self._controller = self._server._create_controller(
+            namespace, self._tcp_stream, self.write, self._offload_ready,
+            extensions)
+        self._controller.await_response = True
+        if self._server.frame_budget is not None:
+            self._controller.frame_budget = self._server.frame_budget
+        if self._server.max_frame_size is not None:
+            self._controller.max_frame_size = self._server.max_frame_size
+        self._server._add_connection(namespace, self._socket_fd, self)
+        # send http-handshake-response
+        self.write(http_response)
+        # notification handler connect event
+        awaitable = self._controller.connect()
+        if awaitable is not None:
+            self._waiting = self._create_task(self._resolve_connect(awaitable))
+            return
+        # frames pipelined behind the handshake request
+        self._drain_frames()
+
+    def _drain_frames(self):
+        self._drain_handle = None
+        if self._waiting is not None or self._paused_writing or \
+                self._transport.is_closing():
+            return
+        # all responses of the batch sent by one write
+        self._corked = list()
+        try:
+            more_frames = self._controller.drain_frames()
+        except exceptions.ConnectClosed as e:
+            self._uncork()
+            self._connect_closed(*e.args[0])
+            return
+        except exceptions.InvalidResponse:
+            self._corked = None
+            self._transport.abort()
+            return
+        self._uncork()
+        if self._controller.has_pending_response:
+            self._waiting = self._create_task(self._resolve_message())
+        elif more_frames:
+            # frame budget exhausted, other connections run first
+            self._drain_handle = \
+                self._server.loop.call_soon(self._drain_frames)
+        if self._controller.offload_enabled:
+            self._update_offload_reading()
+
+    def _offload_ready(self):
+        # the executor has capacity again
+        if self._drain_handle is None and self._waiting is None:
+            self._drain_handle = \
+                self._server.loop.call_soon(self._drain_frames)
+
+    def _update_offload_reading(self):
+        # read ahead a little while the offloaded handler busy
+        blocked = self._waiting is not None or \
+            self._controller.offload_blocked
+        paused = blocked and self._tcp_stream.buffer_length() >= \
+            self._controller.OFFLOAD_READ_AHEAD
+        if paused == self._offload_paused:
+            return
+        self._offload_paused = paused
+        if paused:
+            self._transport.pause_reading()
+        elif not self._paused_writing:
+            self._transport.resume_reading()
+
+    async def _resolve_connect(self, awaitable):
+        try:
+            # encoded by the negotiated extensions as the others
+            self._controller.connect_response(await awaitable)
+        except Exception as e:
+            logger.error('Client({}:{}) Error occurs({})'.format(
+                *self._tcp_stream.peer_name, str(e)))
+            self._waiting = None
+            self._connect_closed(1011, str(e))
+            return
+        self._waiting = None
+        self._drain_frames()
+
+    async def _resolve_message(self):
+        try:
+            await self._controller.resolve_pending_response()
+        except exceptions.ConnectClosed as e:
+            self._waiting = None
+            self._connect_closed(*e.args[0])
+            return
+        except exceptions.InvalidResponse:
+            self._waiting = None
+            self._transport.abort()
+            return
+        self._waiting = None
+        self._drain_frames()
+
+    def _connect_closed(self, code, reason):
+        closing = self._controller.pop_pending_close()
+        if closing is not None:
+            self._create_task(closing)
+        # closed abnormally, a close frame can't be sent
+        if code == 1006:
+            logger.info('Client connection lost, reason({})'.format(reason))
+            self._transport.abort()
+            return
+        if self._close_information[0] is None:
+            if code == 1000:
+                # client first send close-frame
+                self._close_information = ('client', False)
+        else:
+            # close handshake completed
+            self._close_information = (self._close_information[0], True)
+            self._transport.close()
+            return
+
+        self.write(ws_frame.generate_close_frame(
+            extra_data=reason, errno=code))
+        if code != 1000:
+            logger.info('Server active close-frame, reason({})'.format(code))
+            # the frames after the error can't be parsed, closed when the
+            # close frame sent
+            self._transport.close()
+
+    def _uncork(self):
+        data, self._corked = self._corked, None
+        if data and not self._transport.is_closing():
+            self._transport.writelines(data)
+
+    def _create_task(self, coroutine):
+        # the task runs with the handler as the current handler
+        return handler.invoke_as(self._controller.handler,
+                                 self._server.loop.create_task, coroutine)
+
+    def _notify_backpressure(self, callback_name):
+        if self._controller is None:
+            return
+        try:
+            handler.invoke(getattr(self._controller.handler, callback_name))
+        except Exception as e:
+            logger.error('Backpressure callback error occurs({})'.format(e))
+
+    def _wakeup_drain_waiters(self):
+        for waiter in self._drain_waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._drain_waiters.clear()
+
+
+class AsyncWebSocketServer(Daemon, HandlerRegistry, Broadcaster):
+
+    # the coroutine handler callbacks are awaited
+    COROUTINE_HANDLERS = True
+
+    # pending connections the kernel queues before accepted
+    LISTEN_SIZE = WebSocketServerBase.LISTEN_SIZE
+    # pause_writing when the transport buffer exceed it
+    WRITE_HIGH_WATERMARK = WebSocketServerBase.WRITE_HIGH_WATERMARK
+    # resume_writing when the transport buffer below it
+    WRITE_LOW_WATERMARK = WebSocketServerBase.WRITE_LOW_WATERMARK
+    # seconds waiting for the clients closed on the graceful shutdown
+    SHUTDOWN_TIMEOUT = WebSocketServerBase.SHUTDOWN_TIMEOUT
+
+    def __init__(self, host, port, *, pid_file=None, debug=False,
+                 server_name=None, ssl_context=None, frame_budget=None,
+                 high_watermark=None, low_watermark=None, loop='asyncio',
+                 workers=None, offload_workers=None, offload_queue_depth=None,
+                 process_workers=None, process_in_flight=None,
+                 max_header_bytes=None, max_header_count=None,
+                 permessage_deflate=None, max_frame_size=None,
+                 listen_backlog=None):
+        """ AsyncWebSocketServer members
+
+        :type self._client_list: dict[str, dict[object, BaseController]]
+        :type self._connections: dict[object, WebSocketProtocol]
+        :type self._loop: asyncio.AbstractEventLoop
+        :type self._server: asyncio.AbstractServer
+        """
+        super(AsyncWebSocketServer, self).__init__(pid_file=pid_file,
+                                                   debug=debug)
+        if loop not in EVENT_LOOPS:
+            raise exceptions.ParameterError(
+                'event loop must be one of {}'.format(', '.join(EVENT_LOOPS)))
+        # event loop used by `run_forever`
+        self._loop_name = loop
+        if server_name is None:
+            server_name = host
+        http_verifier.set_server_name(server_name, port=port)
+        # handler and controller registration
+        HandlerRegistry.__init__(self)
+        self._set_deflate_options(permessage_deflate)
+        # broadcast and topic subscriptions
+        Broadcaster.__init__(self)
+        # Server address information
+        self._server_address = (host, port)
+        self._ssl_context = ssl_context
+        # all handshake client
+        self._client_list = dict()
+        # namespace of all clients
+        self._client_namespace = dict()
+        # protocol of all clients
+        self._connections = dict()
+        # frames handled for each drain, None is controller default
+        self._frame_budget = frame_budget
+        # payload length of a frame at most, None is controller default
+        self._max_frame_size = max_frame_size
+        # accept queue length of the listening socket
+        self._listen_backlog = check_listen_backlog(
+            self.LISTEN_SIZE if listen_backlog is None else listen_backlog)
+        # transport buffer watermarks
+        self._high_watermark = self.WRITE_HIGH_WATERMARK \
+            if high_watermark is None else high_watermark
+        self._low_watermark = self.WRITE_LOW_WATERMARK \
+            if low_watermark is None else low_watermark
+        if not 0 <= self._low_watermark <= self._high_watermark:
+            raise exceptions.ParameterError(
+                'watermarks must be 0 <= low_watermark <= high_watermark')
+        # pre-fork worker processes, 1 is the single process mode
+        self._workers = prefork.check_workers(workers)
+        # thread pool of the offloaded handlers
+        self._offload_workers = offload_workers
+        self._offload_queue_depth = offload_queue_depth
+        # process pool of the message transforms
+        self._process_workers = process_workers
+        self._process_in_flight = process_in_flight
+        # limits of the handshake request, None is parser default
+        self._max_header_bytes = max_header_bytes
+        self._max_header_count = max_header_count
+        self._loop = None
+        self._server = None
+        # set when the last connection removed
+        self._all_closed = None
+
+    async def start(self):
+        """ Start listening on the running event loop """
+        self._loop = asyncio.get_running_loop()
+        # results of the offloaded handlers posted back to the loop
+        self._handler_executor = handler_executor.HandlerExecutor(
+            self._offload_workers, self._offload_queue_depth)
+        self._loop.add_reader(self._handler_executor.fileno(),
+                              self._handler_executor.run_completed)
+        # the worker processes started on the first transform
+        self._process_executor = process_executor.ProcessExecutor(
+            self._handler_executor.call_soon_threadsafe,
+            self._process_workers, self._process_in_flight)
+        self._server = await self._loop.create_server(
+            lambda: WebSocketProtocol(self), *self._server_address,
+            backlog=self._listen_backlog, reuse_address=True,
+            reuse_port=self._workers > 1, ssl=self._ssl_context)
+        logger.info('Server running in {}:{}, pid = {}'.format(
+            *self._server_address, os.getpid()))
+        return self._server
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+            self._stop_executor()
+
+    async def close(self):
+        if self._server is None:
+            return
+        self._server.close()
+        for connection in list(self._connections.values()):
+            connection.write(ws_frame.generate_close_frame(errno=1001))
+        await self._server.wait_closed()
+        self._server = None
+
+    async def shutdown(self, timeout=None):
+        """ Stop listening, close all connections and wait them closed """
+        if timeout is None:
+            timeout = self.SHUTDOWN_TIMEOUT
+        logger.info('Server shutting down, {} clients connected'.format(
+            len(self._connections)))
+        self._all_closed = asyncio.Event()
+        if not self._connections:
+            self._all_closed.set()
+        await self.close()
+        try:
+            await asyncio.wait_for(self._all_closed.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning('{} clients not closed in {} seconds'.format(
+                len(self._connections), timeout))
+
+    def run_forever(self):
+        # Start deamon on background
+        super(AsyncWebSocketServer, self).run_forever()
+        self._loop_name = install_event_loop_policy(self._loop_name)
+        logger.info('Event loop: {}'.format(self._loop_name))
+        if self._workers > 1:
+            # the supervisor keeps the pid file, workers accept the clients
+            prefork.Supervisor(
+                self._workers, self._serve_worker,
+                shutdown_timeout=self.SHUTDOWN_TIMEOUT + 1.0).run()
+            return
+        try:
+            asyncio.run(self.serve_forever())
+        except KeyboardInterrupt:  # when start debug mode listen Ctrl-C
+            logger.info('<Ctrl + C> Bye, Never BUG')
+
+    def _serve_worker(self, bus):
+        asyncio.run(self._serve_until_shutdown(bus))
+
+    async def _serve_until_shutdown(self, bus):
+        await self.start()
+        # broadcast to the clients of the siblings, flushed once a tick
+        self._worker_bus = bus
+        self._loop.add_reader(bus.fileno(), self._deliver_bus_messages)
+        bus.set_flush_scheduler(
+            lambda: self._loop.call_soon(self._flush_worker_bus))
+        stopping = asyncio.Event()
+        self._loop.add_signal_handler(signal.SIGTERM, stopping.set)
+        await stopping.wait()
+        await self.shutdown()
+        self._stop_executor()
+
+    def _create_handshake_parser(self):
+        return http_parser.HandshakeParser(
+            self._max_header_bytes, self._max_header_count)
+
+    def _stop_executor(self):
+        self._process_executor.shutdown(wait=False)
+        self._loop.remove_reader(self._handler_executor.fileno())
+        self._handler_executor.shutdown(wait=False)
+
+    def _flush_worker_bus(self):
+        if self._worker_bus.flush():
+            # retry the datagrams of the busy siblings
+            self._loop.call_later(self._worker_bus.RETRY_INTERVAL,
+                                  self._flush_worker_bus)
+
+    async def drain(self):
+        """ Wait until the output of current connection drained """
+        _self_class = self._get_handler_self()
+        connection = self._connections.get(_self_class.socket_fd)
+        if connection is not None:
+            await connection.drain()
+
+    @property
+    def loop(self):
+        return self._loop
+
+    @property
+    def loop_name(self):
+        return self._loop_name
+
+    @property
+    def frame_budget(self):
+        return self._frame_budget
+
+    @property
+    def max_frame_size(self):
+        return self._max_frame_size
+
+    @property
+    def high_watermark(self):
+        return self._high_watermark
+
+    @property
+    def low_watermark(self):
+        return self._low_watermark
+
+    @property
+    def is_debug(self):
+        return self._debug
+
+    def _enqueue_write(self, socket_fd, data_pack):
+        self._connections[socket_fd].write(data_pack)
+
+    def _add_connection(self, namespace, socket_fd, protocol):
+        if namespace not in self._client_list:
+            self._client_list[namespace] = dict()
+        self._client_list[namespace][socket_fd] = protocol.controller
+        self._client_namespace[socket_fd] = namespace
+        self._connections[socket_fd] = protocol
+
+    def _remove_connection(self, socket_fd):
+        namespace = self._client_namespace.pop(socket_fd, None)
+        if namespace is None:
+            # closed before handshake completed
+            return
+        self._client_list[namespace].pop(socket_fd)
+        self._connections.pop(socket_fd)
+        # drop all subscriptions of the client
+        self._unsubscribe_all(socket_fd)
+        if not self._connections and self._all_closed is not None:
+            self._all_closed.set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type and exc_tb:
+            raise exc_val
+
+
+def create_async_websocket_server(host='localhost', port=8999, *, debug=False,
+                                  logging_level='info', log_file=None,
+                                  server_name=True, ssl_context=None,
+                                  loop='asyncio', workers=None,
+                                  offload_workers=None,
+                                  offload_queue_depth=None,
+                                  process_workers=None,
+                                  process_in_flight=None,
+                                  max_header_bytes=None,
+                                  max_header_count=None,
+                                  permessage_deflate=None,
+                                  max_frame_size=None,
+                                  listen_backlog=None):
+    server = AsyncWebSocketServer(host, port, debug=debug,
+                                  server_name=server_name,
+                                  ssl_context=ssl_context, loop=loop,
+                                  workers=workers,
+                                  offload_workers=offload_workers,
+                                  offload_queue_depth=offload_queue_depth,
+                                  process_workers=process_workers,
+                                  process_in_flight=process_in_flight,
+                                  max_header_bytes=max_header_bytes,
+                                  max_header_count=max_header_count,
+                                  permessage_deflate=permessage_deflate,
+                                  max_frame_size=max_frame_size,
+                                  listen_backlog=listen_backlog)
+    with server:
+        logger.init(logging_level, server.is_debug, log_file)
+        return server
@@ -3,7 +3,10 @@
 # Copyright (C) 2017 ShadowMan
 #
 import abc
-from websocket.ext import frame_verifier
+import asyncio
+import inspect
+from concurrent import futures
+from websocket.ext import frame_verifier, handler
 from websocket.net import tcp_stream, ws_frame
 from websocket.utils import (
     logger, exceptions
@@ -12,9 +15,20 @@ from websocket.utils import (
 
 class BaseController(object, metaclass=abc.ABCMeta):
 
+    # frames handled for each readiness event
+    FRAME_BUDGET = 32
+    # bytes read ahead while waiting for the offloaded handler
+    OFFLOAD_READ_AHEAD = 64 * 1024
+    # payload length of a frame at most, closed with 1009 if exceeded
+    MAX_FRAME_SIZE = 64 * 1024 * 1024
+    # buffer grown at most for each receive of a large frame
+    RESERVE_STEP = 1024 * 1024
+
     def __init__(self, stream: tcp_stream.TCPStream, output, handler):
         # socket file descriptor
         self._socket_fd = stream.get_socket_fd()
+        # remote address, never query the socket for logging
+        self._peer_name = stream.peer_name
         # TCP stream buffer
         self._tcp_stream = stream
         # websocket event handler
@@ -23,6 +37,27 @@ class BaseController(object, metaclass=abc.ABCMeta):
         if not callable(output):
             raise TypeError('output method must be callable')
         self._output = output
+        # fairness accounting
+        self._frame_budget = self.FRAME_BUDGET
+        self._max_frame_size = self.MAX_FRAME_SIZE
+        self._frames_received = 0
+        self._budget_exhausted = 0
+        # coroutine handlers, only the asyncio engine can await them
+        self._await_response = False
+        # awaitable returned by the handler, later frames wait for it
+        self._pending_response = None
+        self._pending_close = None
+        # handle the result of the pending response
+        self._pending_dispatch = self._dispatch_response
+        # thread pool of the offloaded handler, None runs in the loop
+        self._executor = None
+        # called by the loop when the offloaded handler can make progress
+        self._offload_ready = None
+        self._offload_parked = False
+        # negotiated extensions, None if the frames are never transformed
+        self._extensions = None
+        # RSV bits of the negotiated extensions
+        self._rsv_bits = 0
         # opcode handler mapping
         self._opcode_handlers = {
             0x0: lambda f: print(f),  0x1: self._valid_message,
@@ -36,50 +71,307 @@ class BaseController(object, metaclass=abc.ABCMeta):
         }
 
     def ready_receive(self):
-        frame_header = self._tcp_stream.peek_buffer(10)
+        """ Receive once and handle all complete frames within the budget
+
+        :return: True if complete frames still buffered
+        """
+        # receive once for each readiness event
+        self._tcp_stream.ready_receive()
+        return self.drain_frames()
+
+    def drain_frames(self):
+        """ Handle the complete frames already buffered, without receive
+
+        At most `frame_budget` frames handled for each call, so one chatty
+        client can't starve others.
+
+        :return: True if complete frames still buffered
+        """
+        handled = 0
+        while True:
+            # frames are handled in order, wait for the pending handler
+            if self._pending_response is not None and \
+                    not self._resolve_offloaded_response():
+                return False
+            # the longest header: 2 + 8(payload length) + 4(masking key)
+            header, missing = ws_frame.decode_frame_header(
+                self._tcp_stream.peek(14))
+            if header is None:
+                return False
+            if header.payload_length > self._max_frame_size:
+                # never buffer the frame the client declared
+                raise exceptions.ConnectClosed((
+                    1009, 'frame exceeds {} bytes'.format(
+                        self._max_frame_size)))
+            buffered = self._tcp_stream.buffer_length()
+            if buffered < header.frame_length:
+                # grow the buffer as the payload arrives, not ahead of it
+                self._tcp_stream.reserve(min(
+                    header.frame_length, buffered + self.RESERVE_STEP))
+                return False
+            if handled == self._frame_budget:
+                self._budget_exhausted += 1
+                return True
+            executor = self._next_executor()
+            if executor is not None and executor.saturated:
+                # wait for the pool capacity
+                if not self._offload_parked:
+                    self._offload_parked = True
+                    executor.park(self._unpark)
+                return False
+            handled += 1
+            self._frames_received += 1
+
+            frame = ws_frame.WebSocketFrame(
+                self._tcp_stream.consume(header.frame_length), header)
+            if not frame_verifier.verify_frame(
+                    self._peer_name, frame, self._rsv_bits):
+                logger.error(
+                    'Receive Client Frame Format Invalid {}'.format(frame))
+            if logger.debug_enabled():
+                logger.debug('Receive Client({}:{}) frame: {}'.format(
+                    *self._peer_name, frame))
+            self._opcode_handlers.get(frame.flag_opcode)(frame)
+
+    def connect(self):
+        """ Notify the handler the connection opened
+
+        The response is written by the output method, the offloaded
+        handler becomes the pending response.
+
+        :return: awaitable returned by the coroutine handler, or None
+        """
+        if self._executor is not None:
+            self._offload(self._dispatch_connect_response,
+                          self._handlers.on_connect)
+            return None
+        response = handler.invoke(self._handlers.on_connect)
+        if inspect.isawaitable(response):
+            self._check_awaitable(response)
+            return response
+        self._dispatch_connect_response(response)
+        return None
+
+    def connect_response(self, response):
+        """ Write the response of the awaited coroutine connect handler """
+        self._dispatch_connect_response(response)
+
+    @property
+    def handler(self):
+        return self._handlers
+
+    @property
+    def executor(self):
+        return self._executor
+
+    def set_executor(self, executor, ready_callback=None):
+        """ Offload the handler callbacks to the executor
+
+        :param executor: None runs the handler callbacks in the loop
+        :param ready_callback: called in the loop thread when the offloaded
+            handler finished or the executor has capacity again, the
+            engine should drain the frames of the connection
+        """
+        self._executor = executor
+        self._offload_ready = ready_callback
+
+    def set_extensions(self, extensions):
+        """ Transform the frames by the negotiated extensions
+
+        :type extensions: extension.ExtensionPipeline | None
+        """
+        self._extensions = extensions
+        self._rsv_bits = 0 if extensions is None else extensions.rsv_bits
+
+    @property
+    def extensions(self):
+        return self._extensions
+
+    @property
+    def offload_enabled(self):
+        """ Frames may wait for an executor, see `offload_blocked` """
+        return self._executor is not None
+
+    @property
+    def offload_blocked(self):
+        """ Waiting for the offloaded handler or the executor capacity """
+        return self._offload_parked or \
+            isinstance(self._pending_response, futures.Future)
+
+    @property
+    def await_response(self):
+        return self._await_response
+
+    @await_response.setter
+    def await_response(self, enable):
+        self._await_response = bool(enable)
+
+    @property
+    def has_pending_response(self):
+        return self._pending_response is not None
+
+    async def resolve_pending_response(self):
+        """ Await the response of the coroutine message handler """
+        awaitable, self._pending_response = self._pending_response, None
+        dispatch, self._pending_dispatch = \
+            self._pending_dispatch, self._dispatch_response
+        if isinstance(awaitable, futures.Future):
+            awaitable = asyncio.wrap_future(awaitable)
         try:
-            if len(frame_header) < 2:
-                return
-            frame_length = ws_frame.parse_frame_length(frame_header)
-        except Exception:
-            raise
+            dispatch(await awaitable)
+        except Exception as e:
+            self._handler_error(e)
 
-        if self._tcp_stream.buffer_length() < frame_length:
-            return
-        frame = ws_frame.WebSocketFrame(
-            self._tcp_stream.feed_buffer(frame_length))
-        if not frame_verifier.verify_frame(self._socket_fd, frame):
-            logger.error('Receive Client Frame Format Invalid {}'.format(frame))
-        logger.debug('Receive Client({}:{}) frame: {}'.format(
-            *self._socket_fd.getpeername(), frame))
-        self._opcode_handlers.get(frame.flag_opcode)(frame)
+    def pop_pending_close(self):
+        """ Awaitable returned by the coroutine close handler, or None """
+        awaitable, self._pending_close = self._pending_close, None
+        return awaitable
+
+    @property
+    def frame_budget(self):
+        return self._frame_budget
+
+    @frame_budget.setter
+    def frame_budget(self, budget):
+        if not isinstance(budget, int) or budget < 1:
+            raise exceptions.ParameterError('frame budget must be positive')
+        self._frame_budget = budget
+
+    @property
+    def max_frame_size(self):
+        return self._max_frame_size
+
+    @max_frame_size.setter
+    def max_frame_size(self, size):
+        if not isinstance(size, int) or size < 0:
+            raise exceptions.ParameterError(
+                'max frame size must be non-negative')
+        self._max_frame_size = size
+
+    @property
+    def frames_received(self):
+        return self._frames_received
+
+    @property
+    def budget_exhausted(self):
+        """ Number of times frames are deferred to the next loop """
+        return self._budget_exhausted
 
     # opcode =data_pack:ws_frame.FrameBase 1 or opcode = 2
     # TODO. opcode = 0
     def _valid_message(self, complete_frame: ws_frame.FrameBase):
+        payload_data = self._message_payload(complete_frame)
+        self._handle_message(self._before_message_handler(payload_data))
+
+    def _message_payload(self, complete_frame):
+        """ Payload of the data frame, decoded by the extensions """
+        if self._extensions is None:
+            return complete_frame.payload_data
         try:
-            response = self._handlers.on_message(
-                self._before_message_handler(complete_frame.payload_data))
-            response = self._after_message_handler(response)
-            if response is True:
-                return
-            elif response is None:
-                logger.warning('message handler ignore from client message')
+            return self._extensions.decode_payload(
+                complete_frame, complete_frame.payload_data)
+        except exceptions.MessageTooBig as e:
+            raise exceptions.ConnectClosed((1009, str(e)))
+        except exceptions.ExtensionError as e:
+            raise exceptions.ConnectClosed((1007, str(e)))
+
+    def _encode(self, response):
+        if self._extensions is None or not isinstance(
+                response, (ws_frame.FrameBase, ws_frame.PackedFrame)):
+            return response
+        return self._extensions.encode_frame(response)
+
+    def _handle_message(self, message):
+        if self._executor is not None:
+            self._offload(
+                self._dispatch_response, self._handlers.on_message, message)
+            return
+        try:
+            response = handler.invoke(self._handlers.on_message, message)
+            if inspect.isawaitable(response):
+                self._check_awaitable(response)
+                self._pending_response = response
                 return
-            elif hasattr(response, 'pack'):
-                self._output(response)
-            elif hasattr(response, 'generate_frame'):
-                self._output(response.generate_frame)
-            else:
-                raise exceptions.InvalidResponse('invalid response')
-        except exceptions.InvalidResponse:
-            logger.error('message handler return value is invalid response')
-            raise
+            self._dispatch_response(response)
+        except Exception as e:
+            self._handler_error(e)
+
+    def _check_awaitable(self, awaitable):
+        # only the asyncio engine can await the coroutine handlers
+        if self._await_response:
+            return
+        if inspect.iscoroutine(awaitable):
+            awaitable.close()
+        raise exceptions.InvalidResponse(
+            'coroutine handler require AsyncWebSocketServer')
+
+    def _offload(self, dispatch, callback, *args):
+        self._pending_response = self._executor.submit(
+            self._handlers, callback, *args, on_done=self._offload_done)
+        self._pending_dispatch = dispatch
+
+    def _offload_done(self, future):
+        if self._pending_response is future and \
+                self._offload_ready is not None:
+            self._offload_ready()
+
+    def _next_executor(self):
+        # executor the next frame submitted to
+        return self._executor
+
+    def _unpark(self):
+        self._offload_parked = False
+        if self._offload_ready is not None:
+            self._offload_ready()
+
+    def _resolve_offloaded_response(self):
+        """ Dispatch the result of the finished offloaded handler
+
+        :return: True if the pending response resolved
+        """
+        future = self._pending_response
+        if not isinstance(future, futures.Future) or not future.done():
+            return False
+        self._pending_response = None
+        dispatch, self._pending_dispatch = \
+            self._pending_dispatch, self._dispatch_response
+        try:
+            dispatch(future.result())
         except Exception as e:
-            # error occurs but handler not solution
-            logger.error('Client({}:{}) Error occurs({})'.format(
-                *self._socket_fd.getpeername(), str(e)))
-            raise exceptions.ConnectClosed((1002, str(e)))
+            self._handler_error(e)
+        return True
+
+    def _dispatch_connect_response(self, response):
+        if hasattr(response, 'pack'):
+            self._output(self._encode(response))
+        elif hasattr(response, 'generate_frame'):
+            self._output(self._encode(response.generate_frame))
+
+    def _dispatch_response(self, response):
+        response = self._after_message_handler(response)
+        if response is True or \
+                isinstance(response, ws_frame.BroadcastReport):
+            return
+        elif response is None:
+            logger.warning('message handler ignore from client message')
+            return
+        elif hasattr(response, 'pack'):
+            self._output(self._encode(response))
+        elif hasattr(response, 'generate_frame'):
+            self._output(self._encode(response.generate_frame))
+        else:
+            raise exceptions.InvalidResponse('invalid response')
+
+    def _handler_error(self, error):
+        if isinstance(error, exceptions.ConnectClosed):
+            raise error
+        if isinstance(error, exceptions.InvalidResponse):
+            logger.error('message handler return value is invalid response')
+            raise error
+        # error occurs but handler not solution
+        logger.error('Client({}:{}) Error occurs({})'.format(
+            *self._peer_name, str(error)))
+        raise exceptions.ConnectClosed((1002, str(error)))
 
     @abc.abstractclassmethod
     def _before_message_handler(self, payload_data):
@@ -95,20 +387,32 @@ class BaseController(object, metaclass=abc.ABCMeta):
             reason = complete_frame.payload_data[2:]
         else:
             code, reason = 1000, b''
-        self._handlers.on_close(code, reason)
+        if self._executor is not None:
+            # nothing to respond, frames after the close frame are ignored
+            self._executor.submit(
+                self._handlers, self._handlers.on_close, code, reason)
+            raise exceptions.ConnectClosed((1000, ''))
+        closing = handler.invoke(self._handlers.on_close, code, reason)
+        if inspect.isawaitable(closing):
+            try:
+                self._check_awaitable(closing)
+                self._pending_close = closing
+            except exceptions.InvalidResponse as e:
+                # the close handshake completed anyway
+                logger.error('Close handler error occurs({})'.format(e))
         # If an endpoint receives a Close frame and did not previously send
         # a Close frame, the endpoint MUST send a Close frame in response
         raise exceptions.ConnectClosed((1000, ''))
 
     def _recv_ping(self, complete_frame):
         logger.debug('Client({}:{}) receive ping frame'.format(
-            *self._socket_fd.getpeername()))
+            *self._peer_name))
         self._output(ws_frame.generate_pong_frame(
             extra_data=complete_frame.payload_data))
 
     def _recv_pong(self, complete_frame):
         logger.debug('Client({}:{}) receive pong frame({})'.format(
-            *self._socket_fd.getpeername(), complete_frame.payload_data))
+            *self._peer_name, complete_frame.payload_data))
 
     def __enter__(self):
         return self
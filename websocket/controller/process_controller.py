@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 ShadowMan
+#
+from websocket.controller import base_controller
+
+
+class ProcessController(base_controller.BaseController):
+    """ Transform the messages in the process pool of the server
+
+    `transform` is a module level function, called in a worker process
+    with the payload as a memoryview. Its result is passed to `on_message`
+    of the handler, in the loop or in the thread pool if offloaded. The
+    messages of a connection are transformed in order, one at a time.
+
+        def validate(payload):
+            return json.dumps(schema.validate(json.loads(bytes(payload))))
+
+        class ValidateController(ProcessController):
+            transform = staticmethod(validate)
+    """
+
+    # None handles the messages in the loop like `PlainController`
+    transform = None
+
+    def __init__(self, stream, output, handler):
+        super(ProcessController, self).__init__(stream, output, handler)
+        # process pool of the server, None runs the transform in the loop
+        self._process_executor = None
+
+    def set_process_executor(self, executor):
+        self._process_executor = executor
+
+    @property
+    def offload_enabled(self):
+        return self._process_executor is not None or \
+            super(ProcessController, self).offload_enabled
+
+    def _valid_message(self, complete_frame):
+        # read from the class, never bound to the controller
+        transform = type(self).transform
+        if transform is None:
+            return super(ProcessController, self)._valid_message(
+                complete_frame)
+        if self._process_executor is None:
+            try:
+                message = transform(
+                    memoryview(self._message_payload(complete_frame)))
+            except Exception as e:
+                self._handler_error(e)
+            return self._handle_message(message)
+        self._pending_response = self._process_executor.submit(
+            transform, self._message_payload(complete_frame),
+            self._offload_done)
+        self._pending_dispatch = self._handle_message
+
+    def _next_executor(self):
+        if self._process_executor is not None and \
+                type(self).transform is not None:
+            return self._process_executor
+        return super(ProcessController, self)._next_executor()
+
+    def _before_message_handler(self, payload_data):
+        return payload_data
+
+    def _after_message_handler(self, response):
+        return response
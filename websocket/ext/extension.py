@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 ShadowMan
+#
+# Frame transforming extensions, RFC 6455 section 9. The server registers
+# the `ExtensionOptions` of each extension, the opening handshake
+# negotiates the offers of the client and the accepted extensions of a
+# connection form its `ExtensionPipeline`.
+#
+# The frames sent are encoded by the extensions in the order of the
+# response header, the messages received decoded in the reverse order.
+# Each extension owns some of the RSV bits, the frames with the RSV bits
+# not owned by a negotiated extension are rejected.
+#
+# A connection negotiated no extension has no pipeline, the frames are
+# never passed to the extensions.
+import abc
+from collections import OrderedDict
+from websocket.ext import handler
+from websocket.utils import exceptions, logger
+
+
+class Extension(object, metaclass=abc.ABCMeta):
+    """ Extension negotiated for a connection
+
+    Used in the loop thread only, the frames of a connection are encoded
+    in the order they are sent.
+    """
+
+    # extension token of the Sec-WebSocket-Extensions header
+    name = None
+    # RSV1-3 as 3-bit integer, RSV1 is the highest bit
+    rsv_bits = 0
+
+    @property
+    def parameters(self):
+        """ Key of the encoded frames shareable with other connections
+
+        None if the encoded frame depends on the connection, e.g. the
+        compressor window of the previous messages.
+        """
+        return None
+
+    def encode_frame(self, frame):
+        """ Transform the frame sent to the client
+
+        :param frame: unmasked `ws_frame.FrameBase` or `ws_frame.PackedFrame`,
+            the control frames included
+        :return: the frame, or the transformed frame
+        """
+        return frame
+
+    def decode_payload(self, frame, payload):
+        """ Transform the payload of the data frame received
+
+        :param frame: `ws_frame.FrameBase` received, the RSV bits and opcode
+        :param payload: payload transformed by the later extensions
+        :raise exceptions.MessageTooBig: the connection closed with 1009
+        :raise exceptions.ExtensionError: the connection closed with 1007
+        """
+        return payload
+
+
+class ExtensionOptions(object, metaclass=abc.ABCMeta):
+    """ Extension configured for the server, negotiates the offers """
+
+    # extension token of the Sec-WebSocket-Extensions header
+    name = None
+    # RSV bits owned by the negotiated extension
+    rsv_bits = 0
+
+    @abc.abstractmethod
+    def negotiate(self, offers):
+        """ Accept an offer of the extension
+
+        :param offers: list of (name, params), see `ws_parse_extensions`
+        :return: (response extension as bytes, Extension), or None if no
+            offer accepted
+        """
+        pass
+
+
+class ExtensionPipeline(object):
+    """ Extensions negotiated for a connection, in the order applied to
+    the frames sent
+    """
+
+    __slots__ = ('_extensions', '_rsv_bits', '_parameters')
+
+    def __init__(self, extensions):
+        self._extensions = tuple(extensions)
+        self._rsv_bits = 0
+        for extension in self._extensions:
+            self._rsv_bits |= extension.rsv_bits
+        parameters = tuple(extension.parameters
+                           for extension in self._extensions)
+        # shareable only if all extensions are
+        self._parameters = None if None in parameters else tuple(
+            (extension.name, extension_parameters)
+            for extension, extension_parameters in zip(
+                self._extensions, parameters))
+
+    @property
+    def rsv_bits(self):
+        return self._rsv_bits
+
+    @property
+    def parameters(self):
+        """ Key of the encoded frames shareable with other connections """
+        return self._parameters
+
+    def get(self, name):
+        """ Negotiated extension of the name, or None """
+        for extension in self._extensions:
+            if extension.name == name:
+                return extension
+        return None
+
+    def encode_frame(self, frame):
+        for extension in self._extensions:
+            frame = extension.encode_frame(frame)
+        return frame
+
+    def decode_payload(self, frame, payload):
+        for extension in reversed(self._extensions):
+            payload = extension.decode_payload(frame, payload)
+        return payload
+
+    def __iter__(self):
+        return iter(self._extensions)
+
+    def __len__(self):
+        return len(self._extensions)
+
+    def __str__(self):
+        return '<ExtensionPipeline {}>'.format(
+            ', '.join(extension.name for extension in self._extensions))
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class ExtensionRegistry(object):
+    """ Extensions offered by the server, negotiated in the order
+    registered
+    """
+
+    def __init__(self):
+        # name -> ExtensionOptions
+        self._options = OrderedDict()
+
+    def register(self, options):
+        """ Offer the extension to the clients
+
+        :type options: ExtensionOptions
+        :raise exceptions.ParameterError: name registered or RSV bits owned
+            by a registered extension
+        """
+        if not isinstance(options, ExtensionOptions):
+            raise exceptions.raise_parameter_error(
+                'options', ExtensionOptions, options)
+        if not options.name:
+            raise exceptions.ParameterError('extension name required')
+        if options.name in self._options:
+            raise exceptions.ParameterError(
+                'extension \'{}\' already registered'.format(options.name))
+        for registered in self._options.values():
+            if registered.rsv_bits & options.rsv_bits:
+                raise exceptions.ParameterError(
+                    'RSV bits of \'{}\' owned by \'{}\''.format(
+                        options.name, registered.name))
+        self._options[options.name] = options
+        logger.info('Extension: {} => {}'.format(options.name, options))
+
+    def unregister(self, name):
+        if name not in self._options:
+            raise exceptions.ParameterError(
+                'extension \'{}\' not registered'.format(name))
+        self._options.pop(name)
+
+    def get(self, name):
+        return self._options.get(name)
+
+    def negotiate(self, offers, names=None):
+        """ Accept the offers of the registered extensions
+
+        :param offers: list of (name, params), see `ws_parse_extensions`
+        :param names: extensions enabled for the route, None is all
+        :return: (response header value as bytes, ExtensionPipeline), or
+            (None, None) if no extension accepted
+        """
+        responses, extensions, rsv_bits = list(), list(), 0
+        for name, options in self._options.items():
+            if names is not None and name not in names:
+                continue
+            negotiated = options.negotiate(offers)
+            if negotiated is None:
+                continue
+            response, negotiated_extension = negotiated
+            if negotiated_extension.rsv_bits & rsv_bits:
+                # never two extensions own the same bit
+                logger.warning('extension {} declined, RSV bits '
+                               'owned'.format(name))
+                continue
+            rsv_bits |= negotiated_extension.rsv_bits
+            responses.append(response)
+            extensions.append(negotiated_extension)
+        if not extensions:
+            return None, None
+        return b', '.join(responses), ExtensionPipeline(extensions)
+
+    def __contains__(self, name):
+        return name in self._options
+
+    def __iter__(self):
+        return iter(self._options.values())
+
+    def __len__(self):
+        return len(self._options)
+
+
+def enable_extension(*names):
+    """ Extensions negotiated for the connections of the handler, all
+    extensions of the server if not decorated
+
+        @server.register_handler('/chat')
+        @enable_extension('permessage-deflate')
+        class ChatHandler(WebSocketHandlerProtocol):
+            ...
+    """
+    for name in names:
+        exceptions.raise_parameter_error('name', str, name)
+
+    def _decorator_wrapper(class_object):
+        if not issubclass(class_object, handler.WebSocketHandlerProtocol):
+            raise exceptions.ParameterError(
+                'handlers must be derived with WebSocketHandlerProtocol')
+        class_object.__extensions__ = frozenset(names)
+        return class_object
+    return _decorator_wrapper
+
+
+if __name__ == '__main__':
+    class _Counter(Extension):
+        name = 'x-counter'
+
+        def __init__(self):
+            self.encoded, self.decoded = 0, 0
+
+        @property
+        def parameters(self):
+            return ()
+
+        def encode_frame(self, frame):
+            self.encoded += 1
+            return frame
+
+        def decode_payload(self, frame, payload):
+            self.decoded += 1
+            return payload
+
+    class _CounterOptions(ExtensionOptions):
+        name = 'x-counter'
+
+        def negotiate(self, offers):
+            for name, params in offers:
+                if name == self.name:
+                    return b'x-counter', _Counter()
+            return None
+
+    class _Rsv1Options(_CounterOptions):
+        name = 'x-rsv1'
+        rsv_bits = 0b100
+
+    registry = ExtensionRegistry()
+    registry.register(_CounterOptions())
+    registry.register(_Rsv1Options())
+    for options in (_CounterOptions(), type('_Rsv1', (_Rsv1Options,), {
+            'name': 'x-other-rsv1'})()):
+        try:
+            registry.register(options)
+            raise AssertionError('{} registered'.format(options.name))
+        except exceptions.ParameterError:
+            pass
+
+    assert registry.negotiate([('x-unknown', [])]) == (None, None)
+    response, pipeline = registry.negotiate([('x-counter', [])])
+    assert response == b'x-counter' and pipeline.rsv_bits == 0
+    assert pipeline.parameters == (('x-counter', ()),)
+    assert pipeline.encode_frame(b'frame') == b'frame'
+    assert pipeline.decode_payload(None, b'payload') == b'payload'
+    assert pipeline.get('x-counter').encoded == 1
+    assert registry.negotiate(
+        [('x-counter', [])], names=frozenset())[1] is None
+    print(response, pipeline)
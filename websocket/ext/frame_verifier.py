@@ -10,8 +10,10 @@ from websocket.utils import (
 
 class FrameVerifier(object):
 
-    def __init__(self, client_name):
+    def __init__(self, client_name, rsv_bits=0):
         self._client_name = client_name
+        # RSV1-3 as 3-bit integer, the bits of the negotiated extensions
+        self._rsv_bits = rsv_bits
 
     def verify_frame(self, frame: ws_frame.FrameBase):
         # MUST be 0 unless an extension is negotiated that defines meanings
@@ -19,7 +21,14 @@ class FrameVerifier(object):
         # the negotiated extensions defines the meaning of such a nonzero
         # value, the receiving endpoint MUST _Fail the WebSocket
         # Connection_.
-        if frame.flag_rsv1 or frame.flag_rsv2 or frame.flag_rsv3:
+        rsv = (frame.flag_rsv1 << 2) | (frame.flag_rsv2 << 1) | \
+            frame.flag_rsv3
+        if rsv & ~self._rsv_bits:
+            logger.info('{} send frame invalid'.format(self._client_name))
+            return False
+        # An endpoint MUST NOT set the RSV1 bit on control frames and
+        # continuation frames, RFC 7692 section 6.1.
+        if rsv and (frame.flag_opcode >= 8 or frame.flag_opcode == 0):
             logger.info('{} send frame invalid'.format(self._client_name))
             return False
 
@@ -58,9 +67,9 @@ class FrameVerifier(object):
             raise exc_val
 
 
-def verify_frame(client_name, frame):
+def verify_frame(client_name, frame, rsv_bits=0):
     try:
-        with FrameVerifier(client_name) as verifier:
+        with FrameVerifier(client_name, rsv_bits) as verifier:
             return verifier.verify_frame(frame)
     except exceptions.FrameVerifierError:
         return False
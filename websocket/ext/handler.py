@@ -4,10 +4,44 @@
 #
 import abc
 import socket
+import contextvars
+from websocket.utils import exceptions
+
+
+# handler of the connection currently dispatched
+_current_handler = contextvars.ContextVar('current_handler', default=None)
+
+
+def current_handler():
+    """ Handler of the callback running now, None outside of callbacks """
+    return _current_handler.get()
+
+
+def invoke(callback, *args):
+    """ Call the bound handler callback with its handler as the context """
+    return invoke_as(callback.__self__, callback, *args)
+
+
+def invoke_as(handler_object, callback, *args):
+    """ Call the callback with the handler as the context """
+    token = _current_handler.set(handler_object)
+    try:
+        return callback(*args)
+    finally:
+        _current_handler.reset(token)
 
 
 class WebSocketHandlerProtocol(object, metaclass=abc.ABCMeta):
 
+    # server which the handler registered to
+    __server__ = None
+    # run the callbacks in the thread pool of the server, for the handlers
+    # blocking on I/O, e.g. a database query
+    __offload__ = False
+    # names of the extensions negotiated for the connections, None is all
+    # extensions of the server, see `extension.enable_extension`
+    __extensions__ = None
+
     def __init__(self, socket_fd: socket.socket):
         self._socket_fd = socket_fd
         self._socket_name = socket_fd.getpeername()
@@ -28,6 +62,38 @@ class WebSocketHandlerProtocol(object, metaclass=abc.ABCMeta):
     def on_error(self, code, reason):
         pass
 
+    def on_pause_writing(self):
+        """ Output buffer exceeds the high watermark, reading paused """
+        pass
+
+    def on_resume_writing(self):
+        """ Output buffer drained below the low watermark """
+        pass
+
+    def broadcast(self, message, include_self: bool=False):
+        return self._call_server('broadcast', message, include_self)
+
+    def client_count(self):
+        return self._call_server('client_count')
+
+    def subscribe(self, topic: str):
+        return self._call_server('subscribe', topic)
+
+    def unsubscribe(self, topic: str=None):
+        return self._call_server('unsubscribe', topic)
+
+    def publish(self, topic: str, message, include_self: bool=False):
+        return self._call_server('publish', topic, message, include_self)
+
+    def _call_server(self, method_name, *args):
+        if self.__server__ is None:
+            raise exceptions.FatalError('handler not registered to server')
+        return invoke_as(self, getattr(self.__server__, method_name), *args)
+
+    @property
+    def server(self):
+        return self.__server__
+
     @property
     def socket_fd(self):
         return self._socket_fd
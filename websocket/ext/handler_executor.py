@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 ShadowMan
+#
+# Thread pool for the blocking handler callbacks. The callbacks of an
+# offloaded handler run in the pool, the results are posted back to the
+# event loop through a wakeup socket and handled in the loop thread, so
+# the server state is never touched by the pool threads.
+import socket
+import threading
+from collections import deque
+from concurrent import futures
+from websocket.utils import exceptions, logger
+from websocket.ext import handler
+
+
+class HandlerExecutor(object):
+    """ Bounded executor of the offloaded handler callbacks
+
+    Each connection has at most one callback in the pool, the next frame
+    waits until the previous callback finished. When `max_queue_depth`
+    callbacks are in the pool, the connections stop submitting and are
+    parked until a callback finished.
+    """
+
+    # callbacks submitted and not handled by the loop yet
+    MAX_QUEUE_DEPTH = 1024
+
+    def __init__(self, max_workers=None, max_queue_depth=None):
+        if max_queue_depth is None:
+            max_queue_depth = self.MAX_QUEUE_DEPTH
+        if max_queue_depth < 1:
+            raise exceptions.ParameterError(
+                'executor queue depth must be positive')
+        self._max_workers = max_workers
+        self._max_queue_depth = max_queue_depth
+        # the threads started on the first submit
+        self._pool = None  # type: futures.ThreadPoolExecutor
+        self._in_flight = 0
+        # (future, callback) completed by the pool threads
+        self._completed = deque()
+        # callbacks waiting for the pool capacity
+        self._parked = deque()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        # thread of the event loop
+        self._loop_thread = threading.get_ident()
+        # run_in_loop futures the handler threads wait for
+        self._waiting = set()
+        self._waiting_lock = threading.Lock()
+        self._shutdown = False
+
+    def fileno(self):
+        """ Readable when the loop must call `run_completed` """
+        return self._wakeup_reader.fileno()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @property
+    def saturated(self):
+        return self._in_flight >= self._max_queue_depth
+
+    def in_loop_thread(self):
+        return threading.get_ident() == self._loop_thread
+
+    def submit(self, handler_object, callback, *args, on_done=None):
+        """ Run the handler callback in the pool
+
+        :param on_done: called with the future in the loop thread
+        :return: concurrent.futures.Future of the callback
+        """
+        if self._pool is None:
+            self._pool = futures.ThreadPoolExecutor(
+                self._max_workers, thread_name_prefix='websocket-handler')
+        self._in_flight += 1
+        future = self._pool.submit(
+            handler.invoke_as, handler_object, callback, *args)
+        future.add_done_callback(
+            lambda done_future: self._post(done_future, on_done))
+        return future
+
+    def park(self, callback):
+        """ Call it in the loop thread when the pool has capacity """
+        self._parked.append(callback)
+
+    def call_soon_threadsafe(self, callback):
+        """ Call it in the loop thread, can be called from any thread """
+        self._post(None, callback)
+
+    def run_in_loop(self, handler_object, callback):
+        """ Call it in the loop thread and wait for the result
+
+        :raise exceptions.FatalError: the executor shut down before the
+            loop called it
+        """
+        future = futures.Future()
+
+        def _run_callback():
+            if future.done():
+                # failed by shutdown
+                return
+            try:
+                future.set_result(handler.invoke_as(handler_object, callback))
+            except Exception as e:
+                future.set_exception(e)
+        with self._waiting_lock:
+            if self._shutdown:
+                raise exceptions.FatalError('handler executor shut down')
+            self._waiting.add(future)
+        try:
+            self.call_soon_threadsafe(_run_callback)
+            return future.result()
+        finally:
+            with self._waiting_lock:
+                self._waiting.discard(future)
+
+    def run_completed(self):
+        """ Handle the completed callbacks, called in the loop thread """
+        try:
+            while self._wakeup_reader.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+        while self._completed:
+            future, callback = self._completed.popleft()
+            if future is None:
+                callback()
+                continue
+            self._in_flight -= 1
+            if callback is not None:
+                callback(future)
+            elif future.exception() is not None:
+                logger.error('Offloaded handler error occurs({})'.format(
+                    future.exception()))
+        while self._parked and not self.saturated:
+            self._parked.popleft()()
+
+    def shutdown(self, wait=True):
+        # the loop never runs the pending calls, release the waiting
+        # threads before joining the pool
+        with self._waiting_lock:
+            self._shutdown = True
+            waiting, self._waiting = self._waiting, set()
+        for future in waiting:
+            try:
+                future.set_exception(exceptions.FatalError(
+                    'handler executor shut down'))
+            except futures.InvalidStateError:
+                # completed by the loop meanwhile
+                pass
+        if self._pool is not None:
+            self._pool.shutdown(wait)
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+
+    def _post(self, future, callback):
+        # deque append is thread-safe
+        self._completed.append((future, callback))
+        try:
+            self._wakeup_writer.send(b'\0')
+        except (BlockingIOError, InterruptedError):
+            # the loop already has pending wakeups
+            pass
+        except OSError:
+            # executor shut down
+            pass
+
+
+if __name__ == '__main__':
+    import time
+
+    executor = HandlerExecutor(max_workers=2)
+    # the loop runs the call posted by the handler thread
+    future = executor.submit(
+        None, lambda: executor.run_in_loop(None, lambda: 'loop'))
+    while not future.done():
+        executor.run_completed()
+        time.sleep(0.01)
+    assert future.result() == 'loop'
+    executor.run_completed()
+    assert executor.in_flight == 0
+
+    # the loop exits while a handler thread waits for it
+    waiting = executor.submit(
+        None, lambda: executor.run_in_loop(None, lambda: 'loop'))
+    while not executor._completed:
+        time.sleep(0.01)
+    started = time.time()
+    executor.shutdown(wait=True)
+    assert time.time() - started < 5
+    assert isinstance(waiting.exception(), exceptions.FatalError)
+    try:
+        executor.run_in_loop(None, lambda: 'loop')
+        raise AssertionError('run_in_loop after shutdown')
+    except exceptions.FatalError:
+        pass
+    print('HandlerExecutor OK')
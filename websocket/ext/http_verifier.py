@@ -2,7 +2,7 @@
 #
 # Copyright (C) 2017 ShadowMan
 #
-from websocket.net import http_message
+from websocket.net import http_message, http_parser
 from websocket.utils import (
     logger, generic, exceptions, ws_utils
 )
@@ -66,9 +66,8 @@ class HttpHandshakeVerifier(object):
             return True
         return self._compare_option('Origin', _origin_value, False)
 
-    @staticmethod
-    def verify_sec_websocket_extensions():
-        return []
+    def verify_sec_websocket_extensions(self):
+        return extension_offers(self._request)
 
     def _verify_websocket_options(self):
         # An |Upgrade| header field containing the value "websocket",
@@ -92,7 +91,7 @@ class HttpHandshakeVerifier(object):
                     self._client_name))
         # A |Sec-WebSocket-Version| header field, with a value of 13.
         if not self._compare_option('Sec-WebSocket-Version', '13', False):
-            raise exceptions.HttpVerifierError(
+            raise exceptions.HttpVersionError(
                 'Client({}) `Sec-WebSocket-Version` is not `13`'.format(
                     self._client_name))
 
@@ -119,12 +118,24 @@ class HttpHandshakeVerifier(object):
             raise exc_val
 
 
+def extension_offers(request):
+    """ Extensions offered by the client, see `ws_parse_extensions` """
+    return ws_utils.ws_parse_extensions(
+        request.header.get_value('Sec-WebSocket-Extensions'))
+
+
 def verify_request(client_name, request):
+    """ Verify the handshake request
+
+    :return: extensions offered by the client
+    :raise exceptions.HttpVerifierError: verify failed
+    """
     if _enable_http_verifier is False:
-        return True
-    if not isinstance(request, http_message.HttpRequest):
+        return extension_offers(request)
+    if not isinstance(request, (http_message.HttpRequest,
+                                http_parser.HandshakeRequest)):
         raise exceptions.raise_parameter_error(
-            'request', http_message.HttpRequest, request)
+            'request', http_parser.HandshakeRequest, request)
 
     with HttpHandshakeVerifier(client_name, request) as verifier:
         # A |Host| header field containing the server's authority.
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 ShadowMan
+#
+# Process pool for the CPU-heavy message transforms. The payload is copied
+# into a shared memory block owned by the server, the worker process maps
+# the block by name and writes the result back into it, only the block
+# name and the lengths are pickled. Bytes and str results come back through
+# the block, other results are pickled.
+#
+# The workers are started by forkserver (or spawn), a forked worker would
+# keep the client sockets of the server open. The transform must be a
+# module level function importable by the workers.
+import time
+import multiprocessing
+from collections import deque, OrderedDict
+from concurrent import futures
+from concurrent.futures import process
+from multiprocessing import shared_memory
+from websocket.utils import exceptions, logger
+
+
+# result written into the block
+_RESULT_BYTES = 0
+_RESULT_TEXT = 1
+# result pickled, not bytes/str or larger than the block
+_RESULT_PICKLED = 2
+
+# blocks mapped by the worker process, name -> SharedMemory
+_attached_blocks = OrderedDict()
+# blocks kept mapped by each worker process
+_ATTACHED_BLOCKS = 64
+
+
+def _attach_block(name):
+    # runs in the worker process
+    block = _attached_blocks.get(name)
+    if block is not None:
+        _attached_blocks.move_to_end(name)
+        return block
+    block = shared_memory.SharedMemory(name)
+    _attached_blocks[name] = block
+    while len(_attached_blocks) > _ATTACHED_BLOCKS:
+        _, stale_block = _attached_blocks.popitem(last=False)
+        try:
+            stale_block.close()
+        except BufferError:
+            # the transform still holds a view of the payload
+            pass
+    return block
+
+
+def _run_transform(transform, name, length):
+    """ Job of the worker process
+
+    :return: (result kind, result or result length, started, finished)
+    """
+    started = time.monotonic()
+    block = _attach_block(name)
+    payload = block.buf[:length]
+    try:
+        result = transform(payload)
+    finally:
+        try:
+            payload.release()
+        except BufferError:
+            pass
+    if isinstance(result, str):
+        kind, data = _RESULT_TEXT, result.encode('utf-8')
+    elif isinstance(result, (bytes, bytearray, memoryview)):
+        kind, data = _RESULT_BYTES, bytes(result)
+    else:
+        return _RESULT_PICKLED, result, started, time.monotonic()
+    if len(data) > block.size:
+        return _RESULT_PICKLED, result, started, time.monotonic()
+    block.buf[:len(data)] = data
+    return kind, len(data), started, time.monotonic()
+
+
+class _LatencySamples(object):
+
+    # latest samples kept for the percentiles
+    SAMPLES = 1024
+
+    def __init__(self):
+        self.count = 0
+        self.maximum = 0.0
+        self._sum = 0.0
+        self._samples = deque(maxlen=self.SAMPLES)
+
+    def add(self, latency):
+        self.count += 1
+        self._sum += latency
+        self._samples.append(latency)
+        if latency > self.maximum:
+            self.maximum = latency
+
+    @property
+    def average(self):
+        if not self.count:
+            return 0.0
+        return self._sum / self.count
+
+    def percentile(self, percent):
+        if not self._samples:
+            return 0.0
+        samples = sorted(self._samples)
+        return samples[min(len(samples) - 1,
+                           int(len(samples) * percent / 100))]
+
+
+class ProcessStatistics(object):
+    """ Counters of a process executor, the times are in seconds
+
+    The queue wait is from the submit in the loop to the start of the
+    transform in a worker, the run time is the transform itself.
+    """
+
+    def __init__(self):
+        self.jobs_submitted = 0
+        self.jobs_completed = 0
+        self.jobs_failed = 0
+        self.results_pickled = 0
+        self.bytes_shared = 0
+        self.in_flight_max = 0
+        self.queue_wait = _LatencySamples()
+        self.run_time = _LatencySamples()
+
+    def as_dict(self):
+        return {
+            'jobs_submitted': self.jobs_submitted,
+            'jobs_completed': self.jobs_completed,
+            'jobs_failed': self.jobs_failed,
+            'results_pickled': self.results_pickled,
+            'bytes_shared': self.bytes_shared,
+            'in_flight_max': self.in_flight_max,
+            'queue_wait_average': self.queue_wait.average,
+            'queue_wait_p50': self.queue_wait.percentile(50),
+            'queue_wait_p99': self.queue_wait.percentile(99),
+            'queue_wait_max': self.queue_wait.maximum,
+            'run_time_average': self.run_time.average,
+            'run_time_p99': self.run_time.percentile(99),
+        }
+
+
+class ProcessExecutor(object):
+    """ Bounded executor of the message transforms
+
+    Each connection has at most one job in the pool. When `max_in_flight`
+    jobs are in the pool, the connections stop submitting and are parked
+    until a job finished. The results are handled in the loop thread.
+    """
+
+    # smallest shared memory block, grown to the payload
+    MIN_BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, call_soon_threadsafe, max_workers=None,
+                 max_in_flight=None):
+        """ ProcessExecutor members
+
+        :param call_soon_threadsafe: posts a callback to the loop thread
+        :type self._free_blocks: list[shared_memory.SharedMemory]
+        """
+        if max_workers is None:
+            max_workers = multiprocessing.cpu_count()
+        if max_in_flight is None:
+            max_in_flight = 2 * max_workers
+        if max_workers < 1 or max_in_flight < 1:
+            raise exceptions.ParameterError(
+                'process workers and in-flight jobs must be positive')
+        self._call_soon_threadsafe = call_soon_threadsafe
+        self._max_workers = max_workers
+        self._max_in_flight = max_in_flight
+        # the processes started on the first submit
+        self._pool = None  # type: futures.ProcessPoolExecutor
+        self._in_flight = 0
+        # blocks not used by a job
+        self._free_blocks = list()
+        self._used_blocks = set()
+        # callbacks waiting for the pool capacity
+        self._parked = deque()
+        self._statistics = ProcessStatistics()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @property
+    def saturated(self):
+        return self._in_flight >= self._max_in_flight
+
+    @property
+    def statistics(self):
+        return self._statistics
+
+    def submit(self, transform, payload, on_done=None):
+        """ Run the transform of the payload in a worker process
+
+        :param on_done: called with the future in the loop thread
+        :return: concurrent.futures.Future of the result, resolved in
+            the loop thread
+        """
+        block = self._acquire_block(len(payload))
+        block.buf[:len(payload)] = payload
+        result = futures.Future()
+        if on_done is not None:
+            result.add_done_callback(on_done)
+        submitted = time.monotonic()
+        try:
+            job = self._submit_job(transform, block.name, len(payload))
+        except BaseException:
+            self._release_block(block)
+            raise
+        self._in_flight += 1
+        self._statistics.jobs_submitted += 1
+        self._statistics.bytes_shared += len(payload)
+        self._statistics.in_flight_max = max(
+            self._statistics.in_flight_max, self._in_flight)
+        job.add_done_callback(lambda done_job: self._call_soon_threadsafe(
+            lambda: self._complete(done_job, block, submitted, result)))
+        return result
+
+    def park(self, callback):
+        """ Call it in the loop thread when the pool has capacity """
+        self._parked.append(callback)
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait, cancel_futures=True)
+        for block in self._free_blocks + list(self._used_blocks):
+            # the workers keep the mapping of a running job
+            block.close()
+            block.unlink()
+        self._free_blocks.clear()
+        self._used_blocks.clear()
+
+    def _submit_job(self, *args):
+        if self._pool is None:
+            self._pool = futures.ProcessPoolExecutor(
+                self._max_workers, mp_context=_pool_context())
+        try:
+            return self._pool.submit(_run_transform, *args)
+        except process.BrokenProcessPool:
+            # a worker died, the jobs in the pool failed already
+            logger.warning('Process pool broken, restarted')
+            self._pool.shutdown(wait=False)
+            self._pool = None
+            return self._submit_job(*args)
+
+    def _complete(self, job, block, submitted, result):
+        # runs in the loop thread, the block is reused after it
+        self._in_flight -= 1
+        try:
+            kind, value, started, finished = job.result()
+        except BaseException as e:
+            self._statistics.jobs_failed += 1
+            logger.error('Message transform error occurs({})'.format(
+                repr(e)))
+            result.set_exception(e)
+        else:
+            self._statistics.jobs_completed += 1
+            self._statistics.queue_wait.add(max(0.0, started - submitted))
+            self._statistics.run_time.add(finished - started)
+            if kind == _RESULT_TEXT:
+                value = str(block.buf[:value], 'utf-8')
+            elif kind == _RESULT_BYTES:
+                value = bytes(block.buf[:value])
+            else:
+                self._statistics.results_pickled += 1
+            result.set_result(value)
+        finally:
+            self._release_block(block)
+        while self._parked and not self.saturated:
+            self._parked.popleft()()
+
+    def _acquire_block(self, size):
+        block = None
+        for index, free_block in enumerate(self._free_blocks):
+            if free_block.size >= size:
+                block = self._free_blocks.pop(index)
+                break
+        if block is None:
+            if self._free_blocks:
+                # replace a small block, never keep more than in-flight
+                stale_block = self._free_blocks.pop()
+                stale_block.close()
+                stale_block.unlink()
+            block_size = self.MIN_BLOCK_SIZE
+            while block_size < size:
+                block_size *= 2
+            block = shared_memory.SharedMemory(create=True, size=block_size)
+        self._used_blocks.add(block)
+        return block
+
+    def _release_block(self, block):
+        if block in self._used_blocks:
+            self._used_blocks.remove(block)
+            self._free_blocks.append(block)
+
+
+def _pool_context():
+    # a forked worker inherits the client sockets of the server
+    methods = multiprocessing.get_all_start_methods()
+    if 'forkserver' in methods:
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
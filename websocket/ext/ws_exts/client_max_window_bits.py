@@ -2,3 +2,68 @@
 #
 # Copyright (C) 2017 ShadowMan
 #
+# LZ77 sliding window parameters of permessage-deflate, RFC 7692 section
+# 7.1.2. `client_max_window_bits` limits the window of the client
+# compressor and so the memory of the server decompressor, the server
+# requests it only when the client offered the parameter.
+from websocket.utils import exceptions
+
+
+# window of 2^8 to 2^15 bytes
+MIN_WINDOW_BITS = 8
+MAX_WINDOW_BITS = 15
+
+
+def parse_window_bits(value, allow_empty=False):
+    """ Window bits of an offer parameter
+
+    :param value: str of the parameter, None if offered without value
+    :param allow_empty: the value is optional, `client_max_window_bits`
+    :return: int, or None if offered without value
+    :raise exceptions.ExtensionError: invalid value
+    """
+    if value is None:
+        if allow_empty:
+            return None
+        raise exceptions.ExtensionError('window bits require a value')
+    # 1*DIGIT without leading zero
+    if not value.isdigit() or value.startswith('0'):
+        raise exceptions.ExtensionError(
+            'window bits invalid: {}'.format(value))
+    window_bits = int(value)
+    if not MIN_WINDOW_BITS <= window_bits <= MAX_WINDOW_BITS:
+        raise exceptions.ExtensionError(
+            'window bits out of range: {}'.format(value))
+    return window_bits
+
+
+def check_window_bits(name, window_bits):
+    """ Validate the window bits configured for the server """
+    if window_bits is None:
+        return None
+    if not isinstance(window_bits, int) or \
+            not MIN_WINDOW_BITS <= window_bits <= MAX_WINDOW_BITS:
+        raise exceptions.ParameterError('{} must be {} to {}'.format(
+            name, MIN_WINDOW_BITS, MAX_WINDOW_BITS))
+    return window_bits
+
+
+def negotiate(offered, configured):
+    """ `client_max_window_bits` of the response
+
+    :param offered: False if not offered, None if offered without value,
+        otherwise the window bits offered
+    :param configured: window bits requested by the server, None if any
+    :return: (response value or None, window bits of the decompressor)
+    """
+    if offered is False:
+        # never in the response, the client uses the largest window
+        return None, MAX_WINDOW_BITS
+    if offered is None:
+        if configured is None:
+            return None, MAX_WINDOW_BITS
+        return configured, configured
+    # the client uses the offered window at most, a smaller one requested
+    if configured is None or configured >= offered:
+        return offered, offered
+    return configured, configured
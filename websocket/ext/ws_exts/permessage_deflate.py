@@ -2,3 +2,432 @@
 #
 # Copyright (C) 2017 ShadowMan
 #
+# Per-message compression extension, RFC 7692. The payload of a message is
+# compressed by DEFLATE, the 0x00 0x00 0xff 0xff tail of the sync flush is
+# removed and the RSV1 bit of the first frame marks the message compressed.
+#
+# Each connection has its own compressor and decompressor, the LZ77 window
+# of the previous messages is reused unless the context takeover disabled.
+# Without the context takeover the compressor (decompressor) is released
+# after each message, an idle connection keeps no zlib state at all.
+#
+# Without the server context takeover the compressed payload depends only
+# on the payload and the compressor parameters, the broadcast compresses
+# it once for all recipients with the same parameters.
+import zlib
+import collections
+from websocket.ext import extension
+from websocket.ext.ws_exts import client_max_window_bits as window_bits
+from websocket.net import ws_frame
+from websocket.utils import exceptions, logger, ws_utils
+
+
+EXTENSION_NAME = 'permessage-deflate'
+# RSV1-3 as 3-bit integer, the extension owns RSV1
+RSV_BITS = 0b100
+
+_DEFLATE_TAIL = b'\x00\x00\xff\xff'
+
+
+class PerMessageDeflate(extension.Extension):
+    """ Compressor and decompressor of a connection
+
+    Used in the loop thread only, the messages of a connection are
+    compressed in the order they are sent.
+    """
+
+    name = EXTENSION_NAME
+    rsv_bits = RSV_BITS
+
+    def __init__(self, *, server_no_context_takeover=False,
+                 client_no_context_takeover=False, server_window_bits=15,
+                 client_window_bits=15, threshold=0, compress_level=-1,
+                 mem_level=8, max_message_size=None):
+        self._server_no_context_takeover = server_no_context_takeover
+        self._client_no_context_takeover = client_no_context_takeover
+        self._server_window_bits = server_window_bits
+        self._client_window_bits = client_window_bits
+        self._threshold = threshold
+        self._compress_level = compress_level
+        self._mem_level = mem_level
+        self._max_message_size = max_message_size
+        # created by the first message
+        self._compressor = None
+        self._decompressor = None
+
+    @property
+    def threshold(self):
+        return self._threshold
+
+    @property
+    def parameters(self):
+        """ Key of the compressed payloads shareable with others
+
+        Two connections without the server context takeover and with the
+        same parameters compress a payload to the same bytes.
+        """
+        if not self._server_no_context_takeover:
+            return None
+        return (self._server_window_bits, self._compress_level,
+                self._mem_level)
+
+    def compress(self, payload):
+        """ Compressed payload without the tail of the sync flush
+
+        :rtype: bytes
+        """
+        compressor = self._compressor
+        if compressor is None:
+            compressor = zlib.compressobj(
+                self._compress_level, zlib.DEFLATED,
+                -self._server_window_bits, self._mem_level)
+        data = compressor.compress(payload) + \
+            compressor.flush(zlib.Z_SYNC_FLUSH)
+        if not self._server_no_context_takeover:
+            self._compressor = compressor
+        if data.endswith(_DEFLATE_TAIL):
+            data = data[:-4]
+        # an empty compressed payload is the single octet 0x00
+        return data or b'\x00'
+
+    def decompress(self, payload):
+        """ Payload of a message with the RSV1 bit set
+
+        :raise exceptions.MessageTooBig: exceeds `max_message_size`
+        :raise exceptions.ExtensionError: not a DEFLATE stream
+        """
+        decompressor = self._decompressor
+        if decompressor is None:
+            decompressor = zlib.decompressobj(-self._client_window_bits)
+        max_length = 0 if self._max_message_size is None \
+            else self._max_message_size + 1
+        try:
+            data = decompressor.decompress(
+                bytes(payload) + _DEFLATE_TAIL, max_length)
+        except zlib.error as e:
+            raise exceptions.ExtensionError(
+                'decompress failed({})'.format(e))
+        if max_length and len(data) >= max_length:
+            raise exceptions.MessageTooBig(
+                'message exceeds {} bytes'.format(self._max_message_size))
+        if not self._client_no_context_takeover:
+            self._decompressor = decompressor
+        return data
+
+    def compress_frame(self, frame):
+        """ Compress the data frame of the server, unless below threshold
+
+        :param frame: unmasked `ws_frame.FrameBase` or `ws_frame.PackedFrame`
+        :return: ws_frame.PackedFrame with the RSV1 bit, or the frame if
+            not a complete data frame or below threshold
+        """
+        opcode, payload = _data_frame_payload(frame)
+        if payload is None or len(payload) < self._threshold:
+            return frame
+        return ws_frame.PackedFrame.from_bytes(ws_frame.encode_frame(
+            opcode, self.compress(payload), rsv=RSV_BITS))
+
+    def encode_frame(self, frame):
+        return self.compress_frame(frame)
+
+    def decode_payload(self, frame, payload):
+        # the messages without RSV1 are sent uncompressed
+        if not frame.flag_rsv1:
+            return payload
+        return self.decompress(payload)
+
+    def __str__(self):
+        return '<PerMessageDeflate server_window_bits={} ' \
+               'client_window_bits={}>'.format(self._server_window_bits,
+                                               self._client_window_bits)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class CompressionCache(object):
+    """ Recently compressed frames of the broadcasts, least recently used
+    dropped first
+
+    Only the frames encoded independent of the connection are cached, e.g.
+    compressed without the context takeover, keyed by the `parameters` of
+    the extensions and the frame bytes.
+
+    :param max_entries: cached frames at most
+    :param max_bytes: bytes of the cached frames at most, the original and
+        the compressed, a larger frame is never cached
+    """
+
+    MAX_ENTRIES = 64
+    MAX_BYTES = 8 * 1024 * 1024
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        # (parameters, frame bytes) -> compressed frame
+        self._frames = collections.OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def compress_frame(self, extensions, frame):
+        """ Frame encoded by `extensions.encode_frame`, cached if encoded
+        independent of the connection
+
+        :type extensions: PerMessageDeflate | extension.ExtensionPipeline
+        :type frame: ws_frame.PackedFrame
+        """
+        parameters = extensions.parameters
+        if parameters is None:
+            # compressed with the window of the previous messages
+            return extensions.encode_frame(frame)
+        key = (parameters, frame.pack())
+        compressed = self._frames.get(key)
+        if compressed is not None:
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return compressed
+        self.misses += 1
+        compressed = extensions.encode_frame(frame)
+        if compressed is not frame:
+            self._store(key, compressed)
+        return compressed
+
+    def clear(self):
+        self._frames.clear()
+        self._size = 0
+
+    def _store(self, key, compressed):
+        size = len(key[1]) + len(compressed)
+        if size > self._max_bytes:
+            return
+        self._frames[key] = compressed
+        self._size += size
+        while len(self._frames) > self._max_entries or \
+                self._size > self._max_bytes:
+            (_, frame_bytes), dropped = self._frames.popitem(last=False)
+            self._size -= len(frame_bytes) + len(dropped)
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __str__(self):
+        return '<CompressionCache Entries={} Bytes={} Hits={} ' \
+               'Misses={}>'.format(len(self._frames), self._size,
+                                   self.hits, self.misses)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class PerMessageDeflateOptions(extension.ExtensionOptions):
+    """ Compression configured for the server, negotiates the offers
+
+    :param server_no_context_takeover: compress each message alone, the
+        memory of an idle connection is released and the compressed
+        payloads can be shared with other connections
+    :param client_no_context_takeover: request the client to compress
+        each message alone, the decompressor is released between messages
+    :param server_max_window_bits: window of the server compressor
+    :param client_max_window_bits: window requested for the client
+        compressor, if the client offered the parameter
+    :param threshold: payloads shorter than it are sent uncompressed
+    :param max_message_size: decompressed message size at most, the
+        connection closed with 1009 if exceeded, None is unlimited
+    """
+
+    # payload bytes, the DEFLATE output of a shorter one hardly smaller
+    THRESHOLD = 128
+    # decompressed message size at most
+    MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+    name = EXTENSION_NAME
+    rsv_bits = RSV_BITS
+
+    def __init__(self, *, server_no_context_takeover=False,
+                 client_no_context_takeover=False,
+                 server_max_window_bits=window_bits.MAX_WINDOW_BITS,
+                 client_max_window_bits=None, threshold=None,
+                 compress_level=zlib.Z_DEFAULT_COMPRESSION, mem_level=8,
+                 max_message_size=MAX_MESSAGE_SIZE):
+        self._server_no_context_takeover = bool(server_no_context_takeover)
+        self._client_no_context_takeover = bool(client_no_context_takeover)
+        self._server_max_window_bits = window_bits.check_window_bits(
+            'server_max_window_bits', server_max_window_bits)
+        if self._server_max_window_bits is None or \
+                self._server_max_window_bits == 8:
+            # zlib can't compress with the window of 256 bytes
+            raise exceptions.ParameterError(
+                'server_max_window_bits must be 9 to 15')
+        self._client_max_window_bits = window_bits.check_window_bits(
+            'client_max_window_bits', client_max_window_bits)
+        self._threshold = self.THRESHOLD if threshold is None else threshold
+        self._compress_level = compress_level
+        self._mem_level = mem_level
+        self._max_message_size = max_message_size
+
+    def negotiate(self, offers):
+        """ Accept the first acceptable offer of the client
+
+        :param offers: list of (name, params), see `ws_parse_extensions`
+        :return: (response extension as bytes, PerMessageDeflate), or None
+            if no offer accepted
+        """
+        for name, params in offers:
+            if name != EXTENSION_NAME:
+                continue
+            try:
+                return self._accept(params)
+            except exceptions.ExtensionError as e:
+                # declined, the next offer may be acceptable
+                logger.debug('{} offer declined({})'.format(
+                    EXTENSION_NAME, e))
+        return None
+
+    def _accept(self, params):
+        offer = dict()
+        for param, value in params:
+            if param in offer:
+                raise exceptions.ExtensionError(
+                    'duplicate parameter {}'.format(param))
+            if param in ('server_no_context_takeover',
+                         'client_no_context_takeover'):
+                if value is not None:
+                    raise exceptions.ExtensionError(
+                        '{} has no value'.format(param))
+                offer[param] = True
+            elif param == 'server_max_window_bits':
+                offer[param] = window_bits.parse_window_bits(value)
+            elif param == 'client_max_window_bits':
+                offer[param] = window_bits.parse_window_bits(
+                    value, allow_empty=True)
+            else:
+                raise exceptions.ExtensionError(
+                    'unknown parameter {}'.format(param))
+
+        response = list()
+        server_no_context_takeover = self._server_no_context_takeover or \
+            offer.get('server_no_context_takeover', False)
+        if server_no_context_takeover:
+            response.append(('server_no_context_takeover', None))
+        client_no_context_takeover = self._client_no_context_takeover or \
+            offer.get('client_no_context_takeover', False)
+        if client_no_context_takeover:
+            response.append(('client_no_context_takeover', None))
+
+        server_window_bits = self._server_max_window_bits
+        if 'server_max_window_bits' in offer:
+            if offer['server_max_window_bits'] == 8:
+                raise exceptions.ExtensionError(
+                    'server_max_window_bits=8 not supported')
+            server_window_bits = min(
+                server_window_bits, offer['server_max_window_bits'])
+        if server_window_bits < window_bits.MAX_WINDOW_BITS or \
+                'server_max_window_bits' in offer:
+            response.append(('server_max_window_bits', server_window_bits))
+
+        client_response, client_window_bits = \
+            window_bits.negotiate(
+                offer.get('client_max_window_bits', False),
+                self._client_max_window_bits)
+        if client_response is not None:
+            response.append(('client_max_window_bits', client_response))
+
+        return ws_utils.ws_format_extension(EXTENSION_NAME, response), \
+            PerMessageDeflate(
+                server_no_context_takeover=server_no_context_takeover,
+                client_no_context_takeover=client_no_context_takeover,
+                server_window_bits=server_window_bits,
+                client_window_bits=client_window_bits,
+                threshold=self._threshold,
+                compress_level=self._compress_level,
+                mem_level=self._mem_level,
+                max_message_size=self._max_message_size)
+
+
+def _data_frame_payload(frame):
+    # (opcode, payload) of a complete unmasked data frame without RSV bits,
+    # (None, None) for the frames sent as is
+    if isinstance(frame, ws_frame.PackedFrame):
+        frame_bytes = frame.pack()
+        header, _ = ws_frame.decode_frame_header(frame_bytes)
+        if header is None or header.opcode not in (0x1, 0x2) or \
+                not header.fin or header.mask or \
+                header.rsv1 or header.rsv2 or header.rsv3:
+            return None, None
+        # the payload never copied before compressed
+        return header.opcode, \
+            memoryview(frame_bytes)[header.header_length:]
+    if frame.flag_opcode not in (0x1, 0x2) or not frame.flag_fin or \
+            frame.flag_mask or frame.flag_rsv1 or frame.flag_rsv2 or \
+            frame.flag_rsv3:
+        return None, None
+    return frame.flag_opcode, frame.payload_data
+
+
+def create_options(permessage_deflate):
+    """ Options of the server argument, None if compression disabled
+
+    :param permessage_deflate: None/False, True for the defaults, or
+        a `PerMessageDeflateOptions`
+    """
+    if permessage_deflate is None or permessage_deflate is False:
+        return None
+    if permessage_deflate is True:
+        return PerMessageDeflateOptions()
+    if not isinstance(permessage_deflate, PerMessageDeflateOptions):
+        raise exceptions.raise_parameter_error(
+            'permessage_deflate', PerMessageDeflateOptions,
+            permessage_deflate)
+    return permessage_deflate
+
+
+if __name__ == '__main__':
+    options = PerMessageDeflateOptions(client_max_window_bits=10)
+    response, deflate = options.negotiate(ws_utils.ws_parse_extensions(
+        'permessage-deflate; server_max_window_bits=7, '
+        'permessage-deflate; client_max_window_bits; '
+        'server_no_context_takeover'))
+    assert response == b'permessage-deflate; server_no_context_takeover; ' \
+                       b'client_max_window_bits=10', response
+    assert options.negotiate([('x-webkit-deflate-frame', [])]) is None
+
+    # the client compresses with the negotiated window
+    client = PerMessageDeflate(server_window_bits=10)
+    message = b'{"event": "tick", "value": 42}' * 64
+    for _ in range(3):
+        compressed = client.compress(message)
+        assert len(compressed) < len(message) // 10
+        assert deflate.decompress(compressed) == message
+    assert deflate.decompress(client.compress(b'')) == b''
+
+    frame = deflate.compress_frame(ws_frame.generate_text_frame(message))
+    header, _ = ws_frame.decode_frame_header(frame.pack())
+    assert header.rsv1 == 1 and header.opcode == 0x1
+    # without the context takeover the same payload, the same bytes
+    assert frame.pack() == deflate.compress_frame(
+        ws_frame.generate_text_frame(message)).pack()
+    small = ws_frame.generate_text_frame(b'ok')
+    assert deflate.compress_frame(small) is small
+    # the packed frame of the broadcast compressed once for the group
+    packed = ws_frame.PackedFrame(ws_frame.generate_text_frame(message))
+    assert deflate.compress_frame(packed).pack() == frame.pack()
+    cache = CompressionCache(max_entries=2)
+    others = [PerMessageDeflate(server_no_context_takeover=True,
+                                server_window_bits=15) for _ in range(3)]
+    shared = {cache.compress_frame(other, packed) for other in others}
+    assert len(shared) == 1 and cache.hits == 2 and cache.misses == 1
+    for index in range(3):
+        cache.compress_frame(others[0], ws_frame.PackedFrame(
+            ws_frame.generate_binary_frame(message + bytes([index]))))
+    assert len(cache) == 2
+    assert PerMessageDeflate().compress_frame(packed) is not \
+        cache.compress_frame(PerMessageDeflate(), packed)
+
+    limited = PerMessageDeflate(max_message_size=1024)
+    try:
+        limited.decompress(PerMessageDeflate().compress(message))
+        raise AssertionError('message size not limited')
+    except exceptions.MessageTooBig:
+        pass
+    print(response, deflate)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 ShadowMan
+#
+# Opening handshake responses rendered ahead. The 101 response differs
+# between connections only by `Sec-WebSocket-Accept`, the status line and
+# the other header fields are rendered once for each route configuration
+# (extensions and subprotocol). The rejections are constant bytes.
+from websocket.net import http_message
+from websocket.utils import generic
+
+
+class RenderedResponse(object):
+    """ Http response rendered to bytes, written as is """
+
+    __slots__ = ('_status_code', '_data')
+
+    def __init__(self, status_code: int, data: bytes):
+        self._status_code = status_code
+        self._data = data
+
+    @property
+    def status_code(self):
+        return self._status_code
+
+    def pack(self):
+        return self._data
+
+    def __str__(self):
+        return '<HttpResponse status={}>'.format(self._status_code)
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def render_response(status_code: int, *options):
+    """ Render the status line and the header fields of a response """
+    lines = [b' '.join([b'HTTP/1.1', generic.to_bytes(status_code),
+                        http_message.status_description(status_code)])]
+    for name, value in options:
+        lines.append(generic.to_bytes(name) + b': ' + generic.to_bytes(value))
+    return RenderedResponse(status_code, b'\r\n'.join(lines) + b'\r\n\r\n')
+
+
+class HandshakeTemplate(object):
+    """ 101 response of a route configuration """
+
+    def __init__(self, extensions: bytes=None, protocol: bytes=None):
+        self._prefix = render_response(
+            101, (b'Upgrade', b'websocket'), (b'Connection', b'Upgrade'),
+            (b'Sec-WebSocket-Accept', b'')).pack()[:-4]
+        options = list()
+        if extensions:
+            options.append((b'Sec-WebSocket-Extensions', extensions))
+        if protocol:
+            options.append((b'Sec-WebSocket-Protocol', protocol))
+        self._suffix = b''.join(
+            b'\r\n' + name + b': ' + value for name, value in options
+        ) + b'\r\n\r\n'
+
+    def render(self, accept_key: bytes):
+        return RenderedResponse(
+            101, b''.join((self._prefix, accept_key, self._suffix)))
+
+
+# route configurations seen so far, never grows beyond it
+_MAX_TEMPLATES = 256
+# (extensions, protocol) -> HandshakeTemplate
+_templates = dict()
+
+
+def get_template(extensions: bytes=None, protocol: bytes=None):
+    """ Template of the negotiated extensions and subprotocol, cached """
+    key = (extensions or None, protocol or None)
+    template = _templates.get(key)
+    if template is None:
+        template = HandshakeTemplate(*key)
+        if len(_templates) < _MAX_TEMPLATES:
+            _templates[key] = template
+    return template
+
+
+# verify failed, e.g. not an upgrade request or the origin refused
+FORBIDDEN = render_response(
+    403, (b'X-Forbidden-Reason', b'http-options-invalid'),
+    (b'Content-Length', b'0'), (b'Connection', b'close'))
+# malformed request
+BAD_REQUEST = render_response(
+    400, (b'Content-Length', b'0'), (b'Connection', b'close'))
+# unsupported version, the supported one is advertised, RFC 6455 4.4
+UPGRADE_REQUIRED = render_response(
+    426, (b'Sec-WebSocket-Version', b'13'),
+    (b'Content-Length', b'0'), (b'Connection', b'close'))
+# header limits exceeded
+HEADER_TOO_LARGE = render_response(
+    431, (b'Content-Length', b'0'), (b'Connection', b'close'))
+
+
+if __name__ == '__main__':
+    response = get_template().render(b's3pPLMBiTxaQ9kYGzzhZRbK+xOo=')
+    assert response.pack() == (
+        b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n'
+        b'Connection: Upgrade\r\n'
+        b'Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo=\r\n\r\n')
+    assert get_template() is get_template(b'', None)
+    response = get_template(b'permessage-deflate', b'chat').render(b'key')
+    assert response.pack().endswith(
+        b'Sec-WebSocket-Accept: key\r\n'
+        b'Sec-WebSocket-Extensions: permessage-deflate\r\n'
+        b'Sec-WebSocket-Protocol: chat\r\n\r\n')
+    print(UPGRADE_REQUIRED.pack())
@@ -121,6 +121,7 @@ HTTP_HEAD = b'HEAD'
 # Http methods
 _http_methods = \
     [HTTP_GET, HTTP_POST, HTTP_PUT, HTTP_DELETE, HTTP_UPDATE, HTTP_HEAD]
+HTTP_METHODS = frozenset(_http_methods)
 
 
 class _HttpMessage(object, metaclass=abc.ABCMeta):
@@ -204,6 +205,8 @@ _status_codes = {
     403: b'Forbidden',
     404: b'Not Found',
     405: b'Method Not Allowed',
+    426: b'Upgrade Required',
+    431: b'Request Header Fields Too Large',
 
     # Server Error.
     500: b'Internal Server Error',
@@ -212,6 +215,10 @@ _status_codes = {
 }
 
 
+def status_description(status_code: int):
+    return _status_codes.get(status_code, b'')
+
+
 class HttpResponse(_HttpMessage):
     def __init__(self, status_code, *options,
                  http_version=HTTP_VERSION_1_1, payload_data=None):
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 ShadowMan
+#
+# Incremental parser of the opening handshake request. The receive buffer
+# is scanned from where the previous scan stopped, the request line and
+# the header fields are parsed in one pass once the header block complete.
+# Only the header fields used by the handshake are kept.
+from urllib import parse
+from websocket.net import http_message
+from websocket.utils import generic, exceptions
+
+
+# header fields kept by the parser, lowercase
+HANDSHAKE_HEADERS = frozenset([
+    b'host', b'upgrade', b'connection', b'origin', b'content-length',
+    b'sec-websocket-key', b'sec-websocket-version',
+    b'sec-websocket-extensions', b'sec-websocket-protocol',
+])
+
+_HEADER_TERMINATOR = b'\r\n\r\n'
+
+
+class HeaderIndex(object):
+    """ Header fields of the handshake, lookup like `HttpOptions`
+
+    :param self._fields: lowercase name -> value
+    """
+
+    def __init__(self):
+        self._fields = dict()
+
+    def add(self, name: bytes, value: bytes):
+        if name in self._fields:
+            # repeated fields are combined, RFC 7230 section 3.2.2
+            value = self._fields[name] + b', ' + value
+        self._fields[name] = value
+
+    def get_value(self, key: [bytes, str], *, value_type=bytes):
+        value = self._fields.get(generic.to_bytes(key).lower())
+        if value is None or value_type is bytes:
+            return value
+        if value_type is str:
+            return generic.to_string(value)
+        raise exceptions.ParameterError(
+            'value type except str or bytes, got {}'.format(
+                value_type.__name__))
+
+    def __contains__(self, key: [bytes, str]):
+        return generic.to_bytes(key).lower() in self._fields
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __str__(self):
+        return '<HeaderIndex {}>'.format(
+            ', '.join(generic.to_string(k) for k in self._fields))
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class HandshakeRequest(object):
+
+    def __init__(self, method: bytes, url: bytes, http_version,
+                 header: HeaderIndex, header_count: int):
+        self.method = method
+        self.url = url
+        self.http_version = http_version
+        self.header = header
+        # all header fields received, indexed or not
+        self.header_count = header_count
+
+    @property
+    def url_path(self):
+        return generic.to_string(parse.urlsplit(self.url).path)
+
+    @property
+    def content_length(self):
+        value = self.header.get_value('Content-Length')
+        if value is None:
+            return 0
+        try:
+            length = int(value)
+        except ValueError:
+            raise exceptions.HttpParserError('invalid Content-Length')
+        if length < 0:
+            raise exceptions.HttpParserError('invalid Content-Length')
+        return length
+
+    def __str__(self):
+        return "<HandshakeRequest method='{}' url='{}'>".format(
+            generic.to_string(self.method), generic.to_string(self.url))
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class HandshakeParser(object):
+    """ Parse the handshake request from the receive buffer of a stream
+
+    Call `feed` for each readiness event until it returns the request, the
+    request and its payload are consumed from the stream. The header block
+    and the header field count are limited, a client sending the headers
+    slowly can't grow the buffer without bound.
+    """
+
+    # bytes of the request line and the header fields at most
+    MAX_HEADER_BYTES = 8 * 1024
+    # header fields at most
+    MAX_HEADER_COUNT = 64
+
+    def __init__(self, max_header_bytes=None, max_header_count=None):
+        self._max_header_bytes = self.MAX_HEADER_BYTES \
+            if max_header_bytes is None else max_header_bytes
+        self._max_header_count = self.MAX_HEADER_COUNT \
+            if max_header_count is None else max_header_count
+        # buffered bytes already scanned for the terminator
+        self._scanned = 0
+        # parsed request waiting for its payload
+        self._request = None
+
+    def feed(self, stream):
+        """ Parse the buffered data of the `tcp_stream.TCPStream`
+
+        :return: HandshakeRequest, None if more data required
+        :raise exceptions.HttpParserError: malformed request
+        :raise exceptions.HttpHeaderTooLarge: header limits exceeded
+        """
+        if self._request is None:
+            # the terminator may be split between two receives
+            start = max(0, self._scanned - len(_HEADER_TERMINATOR) + 1)
+            position = stream.find_buffer(_HEADER_TERMINATOR, start)
+            if position < 0:
+                self._scanned = stream.buffer_length()
+                if self._scanned > self._max_header_bytes:
+                    raise exceptions.HttpHeaderTooLarge(
+                        'header exceeds {} bytes'.format(
+                            self._max_header_bytes))
+                return None
+            if position > self._max_header_bytes:
+                raise exceptions.HttpHeaderTooLarge(
+                    'header exceeds {} bytes'.format(self._max_header_bytes))
+            self._request = self._parse(
+                bytes(stream.consume(position)[:-len(_HEADER_TERMINATOR)]))
+            if self._request.content_length > self._max_header_bytes:
+                raise exceptions.HttpHeaderTooLarge(
+                    'payload exceeds {} bytes'.format(self._max_header_bytes))
+        # the payload of the request is dropped
+        content_length = self._request.content_length
+        if stream.buffer_length() < content_length:
+            return None
+        stream.consume(content_length)
+        request, self._request = self._request, None
+        self._scanned = 0
+        return request
+
+    def _parse(self, header_block: bytes):
+        end = header_block.find(b'\r\n')
+        if end < 0:
+            end = len(header_block)
+        request_line = header_block[:end].split(b' ')
+        if len(request_line) != 3:
+            raise exceptions.HttpParserError('invalid request line')
+        method, url, version = request_line
+        if method not in http_message.HTTP_METHODS:
+            raise exceptions.HttpParserError('invalid request method')
+        if version == b'HTTP/1.1':
+            http_version = http_message.HTTP_VERSION_1_1
+        elif version == b'HTTP/1.0':
+            http_version = http_message.HTTP_VERSION_1_0
+        else:
+            raise exceptions.HttpParserError('invalid http version')
+
+        header, count = HeaderIndex(), 0
+        while end < len(header_block):
+            start = end + 2
+            end = header_block.find(b'\r\n', start)
+            if end < 0:
+                end = len(header_block)
+            count += 1
+            if count > self._max_header_count:
+                raise exceptions.HttpHeaderTooLarge(
+                    'header fields exceed {}'.format(self._max_header_count))
+            colon = header_block.find(b':', start, end)
+            if colon <= start:
+                raise exceptions.HttpParserError('invalid header field')
+            name = header_block[start:colon].lower()
+            if name in HANDSHAKE_HEADERS:
+                header.add(name, header_block[colon + 1:end].strip())
+        return HandshakeRequest(method, url, http_version, header, count)
+
+
+if __name__ == '__main__':
+    from websocket.net import tcp_stream
+
+    class _Socket(object):
+        pass
+
+    raw = (b'GET /chat?room=1 HTTP/1.1\r\nHost: localhost:8999\r\n'
+           b'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+           b'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n'
+           b'X-Ignored: value\r\nSec-WebSocket-Version: 13\r\n\r\n\x81')
+    stream = tcp_stream.TCPStream(_Socket(), ('127.0.0.1', 0))
+    parser = HandshakeParser()
+    # byte by byte, the terminator split between the receives
+    for index in range(len(raw) - 2):
+        stream.feed_data(raw[index:index + 1])
+        assert parser.feed(stream) is None
+    stream.feed_data(raw[-2:])
+    request = parser.feed(stream)
+    assert request.url_path == '/chat'
+    assert request.header.get_value('HOST', value_type=str) == \
+        'localhost:8999'
+    assert 'X-Ignored' not in request.header
+    assert request.header_count == 6
+    assert stream.peek_buffer() == b'\x81'
+
+    parser = HandshakeParser(max_header_bytes=64)
+    stream.consume(1)
+    stream.feed_data(b'GET / HTTP/1.1\r\n' + b'X: y\r\n' * 16)
+    try:
+        parser.feed(stream)
+        raise AssertionError('header limit not enforced')
+    except exceptions.HttpHeaderTooLarge:
+        pass
+    print(request, request.header)
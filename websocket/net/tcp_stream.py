@@ -4,66 +4,230 @@
 #
 import ssl
 import socket
+import itertools
+from collections import deque
 from websocket.utils import generic, exceptions
 
 
+class ReceiveBuffer(object):
+    """ Growable receive buffer filled by `socket.recv_into`
+
+    Received data lives in [start, end) of a preallocated bytearray. The
+    consumed head is reclaimed by moving the unread tail to the front when
+    the free space runs out, the buffer grows only when the unread data
+    itself does not fit.
+
+    Views returned by `peek`/`consume` are valid until the next `reserve`
+    or receive.
+    """
+
+    # initial size of the buffer
+    INITIAL_SIZE = 64 * 1024
+    # minimum free space offered to each receive
+    MIN_RECEIVE_SIZE = 16 * 1024
+
+    def __init__(self, size=INITIAL_SIZE):
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        # read offset
+        self._start = 0
+        # write offset
+        self._end = 0
+
+    def reserve(self, size):
+        """ Make sure at least `size` bytes can be written without growing """
+        if len(self._buffer) - self._end >= size:
+            return
+        length = self._end - self._start
+        if length + size <= len(self._buffer):
+            # reclaim the consumed head
+            unread = self._view[self._start:self._end]
+            if self._start < length:
+                # overlapped regions, copy the unread data out first
+                unread = bytes(unread)
+            self._buffer[0:length] = unread
+        else:
+            capacity = len(self._buffer)
+            while capacity < length + size:
+                capacity *= 2
+            new_buffer = bytearray(capacity)
+            new_buffer[0:length] = self._view[self._start:self._end]
+            self._buffer, self._view = new_buffer, memoryview(new_buffer)
+        self._start, self._end = 0, length
+
+    def writable_view(self, size=MIN_RECEIVE_SIZE):
+        self.reserve(size)
+        return self._view[self._end:]
+
+    def commit(self, size):
+        self._end += size
+
+    def feed_data(self, data):
+        size = len(data)
+        self.reserve(size)
+        self._view[self._end:self._end + size] = data
+        self._end += size
+
+    def peek(self, stop=None, start=0):
+        length = self._end - self._start
+        stop = length if stop is None else min(stop, length)
+        return self._view[self._start + start:self._start + stop]
+
+    def consume(self, size):
+        size = min(size, self._end - self._start)
+        data = self._view[self._start:self._start + size]
+        self._start += size
+        if self._start == self._end:
+            # all data consumed, restart from the head
+            self._start = self._end = 0
+        return data
+
+    def find(self, sub_content, start=0):
+        pos = self._buffer.find(sub_content, self._start + start, self._end)
+        return pos if pos < 0 else pos - self._start
+
+    def __len__(self):
+        return self._end - self._start
+
+
 class TCPStream(object):
 
-    def __init__(self, socket_fd: socket.socket):
+    # max buffers gathered by each `sendmsg`
+    SEND_GATHER_SIZE = 64
+
+    def __init__(self, socket_fd: socket.socket, peer_name=None):
         # manager of socket file descriptor
         self._socket_fd = socket_fd  # type: socket.socket
+        # remote address, known by accept or the transport
+        self._peer_name = peer_name
         # receive buffer
-        self._receive_buffer = b''  # type: bytes
+        self._receive_buffer = ReceiveBuffer()  # type: ReceiveBuffer
+        # packed data waiting for send
+        self._send_buffers = deque()  # type: deque
+        self._send_pending = 0
+        # ssl socket does not support scatter-gather
+        self._gather_write = not isinstance(socket_fd, ssl.SSLSocket) and \
+            hasattr(socket_fd, 'sendmsg')
 
     def ready_receive(self):
-        self._receive_buffer = self._receive_buffer + self._socket_feed(4096)
+        """ Receive once, call it exactly once for each readiness event
 
-    def find_buffer(self, sub_content):
-        self.ready_receive()
+        :return: number of bytes received
+        """
+        received = self._socket_feed()
+        # decrypted data buffered by the ssl object never wake up selector
+        if isinstance(self._socket_fd, ssl.SSLSocket):
+            while self._socket_fd.pending():
+                received += self._socket_feed(self._socket_fd.pending())
+        return received
+
+    def receive_view(self, size=ReceiveBuffer.MIN_RECEIVE_SIZE):
+        """ Writable view for data received outside, see `commit` """
+        return self._receive_buffer.writable_view(
+            max(size, ReceiveBuffer.MIN_RECEIVE_SIZE))
+
+    def commit(self, size):
+        self._receive_buffer.commit(size)
+
+    def feed_data(self, data):
+        self._receive_buffer.feed_data(data)
+
+    def peek(self, stop=None, start=0):
+        return self._receive_buffer.peek(stop, start)
+
+    def consume(self, length):
+        return self._receive_buffer.consume(length)
+
+    def reserve(self, length):
+        self._receive_buffer.reserve(length - len(self._receive_buffer))
+
+    def find_buffer(self, sub_content, start=0):
         sub_content = generic.to_bytes(sub_content)
-        pos = self._receive_buffer.find(sub_content)
+        pos = self._receive_buffer.find(sub_content, start)
         if pos >= 0:
-            pos += len(sub_content) + 1
+            pos += len(sub_content)
         return pos
 
     def feed_buffer(self, stop=None, start=0):
-        self.ready_receive()
         if stop is None:
             stop = len(self._receive_buffer)
-        else:
-            stop = min(stop, len(self._receive_buffer))
-        rst = self._receive_buffer[start:stop]
-        self._receive_buffer = self._receive_buffer[stop:]
+        rst = bytes(self._receive_buffer.peek(stop, start))
+        self._receive_buffer.consume(stop)
         return rst
 
     def peek_buffer(self, stop=None, start=0):
-        self.ready_receive()
-        if stop is None:
-            stop = len(self._receive_buffer)
-        else:
-            stop = min(stop, len(self._receive_buffer))
-        return self._receive_buffer[start:stop]
+        return bytes(self._receive_buffer.peek(stop, start))
 
     def buffer_length(self):
-        self.ready_receive()
         return len(self._receive_buffer)
 
-    def _socket_feed(self, buffer_size=4096):
+    def _socket_feed(self, buffer_size=ReceiveBuffer.MIN_RECEIVE_SIZE):
         try:
-            return self._socket_fd.recv(buffer_size)
+            received = self._socket_fd.recv_into(
+                self._receive_buffer.writable_view(buffer_size))
         except BlockingIOError:
-            return b''
+            return 0
         except ssl.SSLWantReadError:
-            return b''
-        except ConnectionAbortedError as e:
-            raise exceptions.ConnectClosed((1002, str(e)))
+            return 0
+        except (ConnectionAbortedError, ConnectionResetError) as e:
+            raise exceptions.ConnectClosed((1006, str(e)))
         except Exception:
             raise
+        if received == 0:
+            # 1006 is reserved value, the connection was closed abnormally
+            raise exceptions.ConnectClosed((1006, 'connection closed by peer'))
+        self._receive_buffer.commit(received)
+        return received
+
+    def write(self, data):
+        """ Append data to the output buffer, nothing sent until `flush` """
+        if len(data):
+            self._send_buffers.append(data)
+            self._send_pending += len(data)
+
+    def flush(self):
+        """ Send as much buffered data as the socket accepts
+
+        :return: number of bytes still pending
+        """
+        while self._send_buffers:
+            try:
+                if self._gather_write:
+                    sent = self._socket_fd.sendmsg(list(itertools.islice(
+                        self._send_buffers, self.SEND_GATHER_SIZE)))
+                else:
+                    sent = self._socket_fd.send(self._send_buffers[0])
+            except (BlockingIOError, InterruptedError):
+                break
+            except (ssl.SSLWantWriteError, ssl.SSLWantReadError):
+                break
+            except (BrokenPipeError, ConnectionAbortedError,
+                    ConnectionResetError) as e:
+                raise exceptions.ConnectClosed((1006, str(e)))
+            self._send_pending -= sent
+            # drop the sent buffers, keep the rest of partial sent one
+            while sent:
+                data = self._send_buffers[0]
+                if sent >= len(data):
+                    self._send_buffers.popleft()
+                    sent -= len(data)
+                else:
+                    self._send_buffers[0] = memoryview(data)[sent:]
+                    sent = 0
+        return self._send_pending
+
+    @property
+    def pending_bytes(self):
+        return self._send_pending
 
     def get_socket_fd(self):
-        self.ready_receive()
         return self._socket_fd
 
+    @property
+    def peer_name(self):
+        if self._peer_name is None:
+            self._peer_name = self._socket_fd.getpeername()
+        return self._peer_name
+
     def get_buffer_length(self):
-        self.ready_receive()
         return len(self._receive_buffer)
@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 ShadowMan
+#
+# Broadcast bus between the pre-forked workers. Each worker owns a Unix
+# datagram socket bound by the supervisor, the broadcasts of a loop tick
+# are batched into datagrams and sent to each sibling once. The frame
+# bytes are packed by the sender only, siblings deliver them as is.
+#
+# Record: kind(1) sent_at(8) key length(2) frame length(4) key frame
+#
+# A record larger than a datagram is split into fragments, each sent as a
+# datagram of its own and reassembled by the sibling:
+#
+# Fragment: kind(1) message id(4) offset(4) record length(4) data
+import os
+import time
+import errno
+import socket
+import struct
+import shutil
+import tempfile
+from collections import deque
+from websocket.utils import exceptions, logger
+
+
+# broadcast to all clients of the namespace
+BUS_BROADCAST = 1
+# publish to all subscribers of the topic
+BUS_PUBLISH = 2
+
+# fragment of a record larger than a datagram
+_BUS_FRAGMENT = 0
+
+_RECORD_HEADER = struct.Struct('!BdHI')
+_FRAGMENT_HEADER = struct.Struct('!BIII')
+
+
+def create_endpoints(count):
+    """ Bind a datagram socket for each worker, called by the supervisor
+
+    :return: (directory, sockets), release by `remove_endpoints`
+    """
+    directory = tempfile.mkdtemp(prefix='websocket-bus-')
+    endpoints = list()
+    for index in range(count):
+        endpoint = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        endpoint.bind(os.path.join(directory, 'worker-{}'.format(index)))
+        endpoint.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                            WorkerBus.MAX_PENDING_SIZE)
+        endpoint.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                            WorkerBus.MAX_PENDING_SIZE)
+        endpoints.append(endpoint)
+    return directory, endpoints
+
+
+def remove_endpoints(directory, endpoints):
+    for endpoint in endpoints:
+        endpoint.close()
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+class BusStatistics(object):
+    """ Counters of a worker bus, the latency is in seconds
+
+    The fan-out latency is from the broadcast in the sender to the
+    delivery in this worker, including the batching delay.
+    """
+
+    # latest latency samples kept for the percentiles
+    LATENCY_SAMPLES = 1024
+
+    def __init__(self):
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.datagrams_sent = 0
+        self.datagrams_received = 0
+        self.bytes_sent = 0
+        self.datagrams_dropped = 0
+        # fragmented records lost a fragment, never delivered
+        self.fragmented_dropped = 0
+        self.latency_max = 0.0
+        self._latency_sum = 0.0
+        self._latency_samples = deque(maxlen=self.LATENCY_SAMPLES)
+
+    def add_latency(self, latency):
+        self._latency_sum += latency
+        self._latency_samples.append(latency)
+        if latency > self.latency_max:
+            self.latency_max = latency
+
+    @property
+    def latency_average(self):
+        if not self.messages_received:
+            return 0.0
+        return self._latency_sum / self.messages_received
+
+    def latency_percentile(self, percent):
+        if not self._latency_samples:
+            return 0.0
+        samples = sorted(self._latency_samples)
+        return samples[min(len(samples) - 1,
+                           int(len(samples) * percent / 100))]
+
+    def as_dict(self):
+        return {
+            'messages_sent': self.messages_sent,
+            'messages_received': self.messages_received,
+            'datagrams_sent': self.datagrams_sent,
+            'datagrams_received': self.datagrams_received,
+            'bytes_sent': self.bytes_sent,
+            'datagrams_dropped': self.datagrams_dropped,
+            'fragmented_dropped': self.fragmented_dropped,
+            'latency_average': self.latency_average,
+            'latency_p50': self.latency_percentile(50),
+            'latency_p99': self.latency_percentile(99),
+            'latency_max': self.latency_max,
+        }
+
+
+class WorkerBus(object):
+
+    # records of a tick are batched into datagrams up to it
+    MAX_DATAGRAM_SIZE = 64 * 1024
+    # datagrams kept for a busy sibling, the oldest dropped beyond it
+    MAX_PENDING_SIZE = 4 * 1024 * 1024
+    # record size at most, a larger one would be dropped by the pending
+    # limit before a busy sibling received all fragments
+    MAX_RECORD_SIZE = MAX_PENDING_SIZE // 2
+    # datagrams received for each readiness event
+    RECEIVE_BATCH = 64
+    # seconds before retry the datagrams of a busy sibling
+    RETRY_INTERVAL = 0.005
+
+    def __init__(self, index, endpoints):
+        """ WorkerBus members
+
+        :param index: worker index, the endpoint owned by this worker
+        :type self._pending: dict[str, deque[bytes]]
+        """
+        self._index = index
+        self._socket = endpoints[index]  # type: socket.socket
+        self._socket.setblocking(False)
+        # a datagram never exceed the send buffer of the siblings
+        self._receive_buffer = bytearray(max(
+            self.MAX_DATAGRAM_SIZE,
+            self._socket.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)))
+        # endpoint address of all siblings
+        self._peers = [endpoint.getsockname()
+                       for peer_index, endpoint in enumerate(endpoints)
+                       if peer_index != index]
+        # the endpoints of the siblings are only kept by the supervisor
+        for peer_index, endpoint in enumerate(endpoints):
+            if peer_index != index:
+                endpoint.close()
+        # records of the current tick
+        self._batch = list()
+        # datagrams not sent to the sibling yet
+        self._pending = {peer: deque() for peer in self._peers}
+        self._pending_size = {peer: 0 for peer in self._peers}
+        # id of the next fragmented record
+        self._fragment_id = 0
+        # sibling -> (message id, record, bytes received) reassembling
+        self._fragments = dict()
+        # called when the first record of a tick buffered
+        self._flush_scheduler = None
+        self._statistics = BusStatistics()
+        # broadcasts to the clients of the previous worker are stale
+        self._discard_received()
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def statistics(self):
+        return self._statistics
+
+    @property
+    def has_pending(self):
+        return any(self._pending.values())
+
+    def set_flush_scheduler(self, scheduler):
+        self._flush_scheduler = scheduler
+
+    def send(self, kind, key: str, frame_bytes: bytes):
+        """ Buffer the frame for all siblings until the `flush`
+
+        :raise exceptions.BroadcastError: the record exceeds
+            `MAX_RECORD_SIZE`, never sent to any sibling
+        """
+        if not self._peers:
+            return
+        key = key.encode('utf-8')
+        record_size = _RECORD_HEADER.size + len(key) + len(frame_bytes)
+        if record_size > self.MAX_RECORD_SIZE:
+            raise exceptions.BroadcastError(
+                'message of {} bytes exceeds the worker bus limit {}'.format(
+                    record_size, self.MAX_RECORD_SIZE))
+        if not self._batch and self._flush_scheduler is not None:
+            self._flush_scheduler()
+        record = _RECORD_HEADER.pack(
+            kind, time.monotonic(), len(key), len(frame_bytes)) + key
+        self._batch.append(record)
+        self._batch.append(frame_bytes)
+        self._statistics.messages_sent += 1
+
+    def flush(self):
+        """ Send the records of this tick, called once for each loop tick
+
+        :return: True if some datagrams still pending for busy siblings
+        """
+        if self._batch:
+            for datagram in self._split_batch():
+                for peer in self._peers:
+                    self._pending[peer].append(datagram)
+                    self._pending_size[peer] += len(datagram)
+            self._batch.clear()
+        pending = False
+        for peer in self._peers:
+            if self._pending[peer]:
+                pending |= self._send_pending(peer)
+        return pending
+
+    def receive(self):
+        """ Records received from the siblings
+
+        :return: list of (kind, key, frame_bytes)
+        """
+        records = list()
+        view = memoryview(self._receive_buffer)
+        for _ in range(self.RECEIVE_BATCH):
+            try:
+                size, peer = self._socket.recvfrom_into(self._receive_buffer)
+            except (BlockingIOError, InterruptedError):
+                break
+            self._statistics.datagrams_received += 1
+            if size and view[0] == _BUS_FRAGMENT:
+                record = self._reassemble(peer, view[:size])
+                if record is not None:
+                    self._parse_records(
+                        memoryview(record), len(record), records)
+                continue
+            self._parse_records(view, size, records)
+        return records
+
+    def _parse_records(self, view, size, records):
+        now = time.monotonic()
+        offset = 0
+        while offset < size:
+            kind, sent_at, key_length, frame_length = \
+                _RECORD_HEADER.unpack_from(view, offset)
+            offset += _RECORD_HEADER.size
+            key = str(view[offset:offset + key_length], 'utf-8')
+            offset += key_length
+            records.append(
+                (kind, key, bytes(view[offset:offset + frame_length])))
+            offset += frame_length
+            self._statistics.messages_received += 1
+            self._statistics.add_latency(now - sent_at)
+
+    def _reassemble(self, peer, datagram):
+        # the datagrams of a sibling arrive in order, a fragment out of
+        # order means the previous ones dropped by the sender
+        _, message_id, offset, record_size = \
+            _FRAGMENT_HEADER.unpack_from(datagram)
+        data = datagram[_FRAGMENT_HEADER.size:]
+        state = self._fragments.get(peer)
+        if state is not None and (state[0] != message_id or
+                                  state[2] != offset):
+            self._fragments.pop(peer)
+            self._statistics.fragmented_dropped += 1
+            state = None
+        if state is None:
+            if offset != 0:
+                # the head of the record dropped
+                return None
+            state = (message_id, bytearray(record_size), 0)
+        record, received = state[1], state[2] + len(data)
+        record[offset:received] = data
+        if received < record_size:
+            self._fragments[peer] = (message_id, record, received)
+            return None
+        self._fragments.pop(peer, None)
+        return record
+
+    def _split_batch(self):
+        # (record header, frame bytes) pairs never split between datagrams,
+        # unless the record alone exceeds a datagram
+        datagram, size = list(), 0
+        for index in range(0, len(self._batch), 2):
+            record_size = len(self._batch[index]) + len(self._batch[index + 1])
+            if record_size > self.MAX_DATAGRAM_SIZE:
+                if datagram:
+                    yield b''.join(datagram)
+                    datagram, size = list(), 0
+                yield from self._fragment(self._batch[index:index + 2])
+                continue
+            if datagram and size + record_size > self.MAX_DATAGRAM_SIZE:
+                yield b''.join(datagram)
+                datagram, size = list(), 0
+            datagram.extend(self._batch[index:index + 2])
+            size += record_size
+        if datagram:
+            yield b''.join(datagram)
+
+    def _fragment(self, record_parts):
+        record = memoryview(b''.join(record_parts))
+        message_id = self._fragment_id
+        self._fragment_id = (self._fragment_id + 1) & 0xffffffff
+        chunk_size = self.MAX_DATAGRAM_SIZE - _FRAGMENT_HEADER.size
+        for offset in range(0, len(record), chunk_size):
+            yield _FRAGMENT_HEADER.pack(
+                _BUS_FRAGMENT, message_id, offset, len(record)) + \
+                record[offset:offset + chunk_size]
+
+    def _send_pending(self, peer):
+        pending = self._pending[peer]
+        while pending:
+            datagram = pending[0]
+            try:
+                self._socket.sendto(datagram, peer)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                if e.errno == errno.ENOBUFS:
+                    # no send buffer for now, retry as a busy sibling
+                    break
+                # sibling endpoint gone or the datagram too large
+                logger.warning('Worker bus send error occurs({})'.format(e))
+                if e.errno != errno.EMSGSIZE:
+                    self._drop_pending(peer, len(pending))
+                    return False
+                self._drop_pending(peer, 1)
+                continue
+            pending.popleft()
+            self._pending_size[peer] -= len(datagram)
+            self._statistics.datagrams_sent += 1
+            self._statistics.bytes_sent += len(datagram)
+        # the sibling is too busy or dead, drop the oldest datagrams
+        while self._pending_size[peer] > self.MAX_PENDING_SIZE:
+            self._drop_pending(peer, 1)
+        return len(pending) > 0
+
+    def _drop_pending(self, peer, count):
+        pending = self._pending[peer]
+        for _ in range(count):
+            datagram = pending.popleft()
+            self._pending_size[peer] -= len(datagram)
+            self._statistics.datagrams_dropped += 1
+
+    def _discard_received(self):
+        while True:
+            try:
+                self._socket.recv_into(self._receive_buffer)
+            except (BlockingIOError, InterruptedError):
+                return
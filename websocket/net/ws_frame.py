@@ -123,7 +123,7 @@ import os
 import abc
 import struct
 from websocket.utils import (
-    generic, ws_utils, exceptions, packet, logger
+    generic, ws_utils, exceptions, packet, logger, masking
 )
 
 
@@ -134,68 +134,181 @@ def ws_transform_payload_data(data, mask_key):
             mask_key = int(mask_key, 16)
         else:
             raise KeyError('mask key must be hex int')
-    if not isinstance(data, (str, bytes)):
+    if not isinstance(data, (str, bytes, bytearray, memoryview)):
         raise KeyError('data must be str or bytes type')
+    return masking.mask(generic.to_bytes(data), mask_key)
+
+
+# precompiled header formats, network byte order
+_header_octets = struct.Struct('!BB')
+_header_uint16 = struct.Struct('!H')
+_header_uint32 = struct.Struct('!I')
+_header_uint64 = struct.Struct('!Q')
+
+
+class FrameHeader(object):
+    """ Decoded websocket frame header
+
+    :type fin: int
+    :type opcode: int
+    :type mask: int
+    :type payload_length: int
+    :type mask_key: int | bool
+    :type header_length: int
+    """
+    __slots__ = ('fin', 'rsv1', 'rsv2', 'rsv3', 'opcode', 'mask',
+                 'flag_payload_length', 'payload_length', 'mask_key',
+                 'header_length')
+
+    @property
+    def frame_length(self):
+        return self.header_length + self.payload_length
+
+    def __str__(self):
+        return '<FrameHeader Fin={} Opcode={:#x} Mask={} ' \
+               'Payload_length={}>'.format(self.fin, self.opcode, self.mask,
+                                           self.payload_length)
+
+    def __repr__(self):
+        return self.__str__()
 
-    # Octet i of the transformed data is the XOR of octet i of the original
-    # data with octet at index i modulo 4 of the masking key
-    mask_key_octet = {
-        0: (mask_key & 0xff000000) >> 24,
-        1: (mask_key & 0x00ff0000) >> 16,
-        2: (mask_key & 0x0000ff00) >> 8,
-        3: mask_key & 0x000000ff
-    }
 
-    transformed_string = b''
-    for index, value in enumerate(generic.to_bytes(data)):
-        transformed_string += struct.pack(
-            '!B', (value ^ mask_key_octet[index % 4]) & 0xff)
-    return transformed_string
+def decode_frame_header(buffer, offset=0):
+    """ Decode the frame header in the buffer start at `offset`
+
+    The buffer(bytes, bytearray or memoryview) is never copied.
+
+    :return: (FrameHeader, 0) or (None, number of bytes still required)
+    """
+    available = len(buffer) - offset
+    if available < 2:
+        return None, 2 - available
+    # first byte(8-bits)                 second byte(8-bits)
+    # +-+-+-+-+-------+                  +-+-------------+
+    # |F|R|R|R| opcode|                  |M| Payload len |
+    # |I|S|S|S|  (4)  |                  |A|     (7)     |
+    # |N|V|V|V|       |                  |S|             |
+    # | |1|2|3|       |                  |K|             |
+    # +-+-+-+-+-------+                  +-+-------------+
+    first_octet, second_octet = _header_octets.unpack_from(buffer, offset)
+    flag_payload_length = second_octet & 0x7f
+    flag_mask = second_octet >> 7
+
+    header_length = 2
+    if flag_payload_length == 126:
+        header_length = 4
+    elif flag_payload_length == 127:
+        header_length = 10
+    if flag_mask:
+        header_length += 4
+    if available < header_length:
+        return None, header_length - available
+
+    header = FrameHeader()
+    header.fin = first_octet >> 7
+    header.rsv1 = (first_octet >> 6) & 1
+    header.rsv2 = (first_octet >> 5) & 1
+    header.rsv3 = (first_octet >> 4) & 1
+    header.opcode = first_octet & 0x0f
+    header.mask = flag_mask
+    header.flag_payload_length = flag_payload_length
+    header.header_length = header_length
+    if flag_payload_length == 126:
+        # If 126, the following 2 bytes interpreted as a
+        # 16-bit unsigned integer are the payload length
+        header.payload_length = \
+            _header_uint16.unpack_from(buffer, offset + 2)[0]
+    elif flag_payload_length == 127:
+        # If 127, the following 8 bytes interpreted as a
+        # 64-bit unsigned integer (the most significant bit
+        # MUST be 0) are the payload length.
+        header.payload_length = \
+            _header_uint64.unpack_from(buffer, offset + 2)[0]
+    else:
+        header.payload_length = flag_payload_length
+    # Masking-key, if MASK set to 1
+    if flag_mask:
+        header.mask_key = _header_uint32.unpack_from(
+            buffer, offset + header_length - 4)[0]
+    else:
+        header.mask_key = False
+    return header, 0
 
 
 def parse_frame_length(frame_header):
-    if not isinstance(frame_header, (str, bytes)):
+    if not isinstance(frame_header, (str, bytes, bytearray, memoryview)):
         raise KeyError('frame_header must be str or bytes type')
-    header = packet.ByteArray(frame_header)
-    if len(header) < 2:
+    if isinstance(frame_header, str):
+        frame_header = generic.to_bytes(frame_header)
+    if len(frame_header) < 2:
         logger.warning('receive less than 2-bytes')
         raise RuntimeError('frame header less than 2-bytes')
-    # first bit is MASK flag
-    payload_length = packet.bits_to_integer(header.get_bits(1)[1:])
-    # if 0-125, that is the payload length
-    if payload_length <= 125:
-        # if frame is client-to-server, payload length does not include mask-key
-        if header.get_bits(1)[0] is 1:
-            return payload_length + 6
-        return payload_length + 2
-    # If 126, the following 2 bytes interpreted as a
-    # 16-bit unsigned integer are the payload length
-    elif payload_length == 126:
-        # Payload length field is in [2-4)bytes
-        if len(header) < 4:
-            raise exceptions.FrameHeaderParseError(
-                'payload length flag is 126, but header length is {}'.format(
-                    len(header)))
-        if header.get_bits(1)[0] is 1:
-            return packet.bits_to_integer(
-                generic.flatten_list(header.get_bits(2, 2))) + 8
-        return packet.bits_to_integer(
-            generic.flatten_list(header.get_bits(2, 2))) + 4
-    # If 127, the following 8 bytes interpreted as a
-    # 64-bit unsigned integer (the most significant bit
-    # MUST be 0) are the payload length.
-    elif payload_length == 127:
-        # Payload length field is in [2-10)bytes
-        if len(header) < 10:
-            raise exceptions.FrameHeaderParseError(
-                'payload length flag is 127, but header length is {}'.format(
-                    len(header)))
-        if header.get_bits(1)[0] is 1:
-            return packet.bits_to_integer(
-                generic.flatten_list(header.get_bits(2, 2))) + 14
-        return packet.bits_to_integer(
-            generic.flatten_list(header.get_bits(2, 2))) + 10
-    raise exceptions.FatalError('internal error')
+    header, missing = decode_frame_header(frame_header)
+    if header is None:
+        raise exceptions.FrameHeaderParseError(
+            'frame header require {} more bytes, but header length '
+            'is {}'.format(missing, len(frame_header)))
+    # if frame is client-to-server, the length include mask-key
+    return header.frame_length
+
+
+# precompiled header layouts, payload length flag [ <125, 126, 127 ]
+_encode_short = struct.Struct('!BB')
+_encode_medium = struct.Struct('!BBH')
+_encode_long = struct.Struct('!BBQ')
+# masked header layouts, the masking key follows the payload length
+_encode_short_masked = struct.Struct('!BBI')
+_encode_medium_masked = struct.Struct('!BBHI')
+_encode_long_masked = struct.Struct('!BBQI')
+
+
+def encode_frame_header(first_octet, payload_length, mask_key=None):
+    """ Pack the frame header with a single `struct.pack`
+
+    :param first_octet: FIN, RSV1-3 and opcode
+    :param payload_length: length of the payload data
+    :param mask_key: 32-bit masking key or None (server-to-client)
+    :rtype: bytes
+    """
+    if mask_key is None:
+        if payload_length < 126:
+            return _encode_short.pack(first_octet, payload_length)
+        elif payload_length < 65536:
+            return _encode_medium.pack(first_octet, 126, payload_length)
+        return _encode_long.pack(first_octet, 127, payload_length)
+
+    if not isinstance(mask_key, int):
+        mask_key = int.from_bytes(masking.mask_key_to_bytes(mask_key), 'big')
+    if payload_length < 126:
+        return _encode_short_masked.pack(
+            first_octet, 0x80 | payload_length, mask_key)
+    elif payload_length < 65536:
+        return _encode_medium_masked.pack(
+            first_octet, 0x80 | 126, payload_length, mask_key)
+    return _encode_long_masked.pack(
+        first_octet, 0x80 | 127, payload_length, mask_key)
+
+
+def encode_frame_parts(opcode, payload_data, *, fin=1, rsv=0):
+    """ Server-to-client frame as (header, payload) for `socket.sendmsg`
+
+    :param opcode: frame opcode
+    :param payload_data: bytes-like object, never copied
+    :param fin: FIN flag
+    :param rsv: RSV1-3 flags as 3-bit integer, RSV1 is the highest bit
+    """
+    first_octet = (fin << 7) | ((rsv & 0x7) << 4) | (opcode & 0xf)
+    return encode_frame_header(first_octet, len(payload_data)), payload_data
+
+
+def encode_frame(opcode, payload_data, *, fin=1, rsv=0):
+    """ Server-to-client frame in a single buffer
+
+    The frame allocate once, the payload copy once.
+    """
+    header, payload_data = encode_frame_parts(
+        opcode, payload_data, fin=fin, rsv=rsv)
+    return header + payload_data
 
 
 # using for judge frame type
@@ -224,7 +337,7 @@ class FrameBase(object, metaclass=abc.ABCMeta):
         0xF: b'Control Frame',
     }
 
-    def __init__(self, byte_array):
+    def __init__(self, byte_array, header=None):
         if not isinstance(byte_array, packet.ByteArray):
             raise RuntimeError('the byte array is invalid')
 
@@ -244,101 +357,54 @@ class FrameBase(object, metaclass=abc.ABCMeta):
         self._payload_data = None
 
         self._byte_array = byte_array
-        # parse frame
-        self.parse_octet()
-
-    def parse_octet(self):
-        # first byte(8-bits)
-        # +-+-+-+-+-------+
-        # |F|R|R|R| opcode|
-        # |I|S|S|S|  (4)  |
-        # |N|V|V|V|       |
-        # | |1|2|3|       |
-        # +-+-+-+-+-------+
-        self._flag_fin = self._byte_array.get_bit(0, 0)
-        self._flag_rsv1 = self._byte_array.get_bit(0, 1)
-        self._flag_rsv2 = self._byte_array.get_bit(0, 2)
-        self._flag_rsv3 = self._byte_array.get_bit(0, 3)
-        self._flag_opcode = packet.bits_to_integer(
-            self._byte_array.get_bits(0)[4:])
-        # second byte(8-bits)
-        # +-+-------------+
-        # |M| Payload len |
-        # |A|     (7)     |
-        # |S|             |
-        # |K|             |
-        # +-+-+-+-+-------+
-        self._flag_mask = self._byte_array.get_bit(1, 0)
-        self._flag_payload_length = packet.bits_to_integer(
-            self._byte_array.get_bits(1)[1:])
-        self._payload_length = self._flag_payload_length
-
-        _last_byte_index = 2
-        if self._payload_length is 126:
-            # If 126, the following 2 bytes interpreted as a
-            # 16-bit unsigned integer are the payload length
-            self._payload_length = packet.bits_to_integer(
-                generic.flatten_list(
-                    self._byte_array.get_bits(_last_byte_index, 2)))
-            _last_byte_index = 4
-        elif self._payload_length is 127:
-            # If 127, the following 8 bytes interpreted as a
-            # 64-bit unsigned integer (the most significant bit
-            # MUST be 0) are the payload length.
-            self._payload_length = packet.bits_to_integer(
-                generic.flatten_list(
-                    self._byte_array.get_bits(_last_byte_index, 8)))
-            _last_byte_index = 10
-
-        # Masking-key, if MASK set to 1
-        if self._flag_mask is 1:
-            self._mask_key = packet.bits_to_integer(
-                generic.flatten_list(
-                    self._byte_array.get_bits(_last_byte_index, 4)))
-            _last_byte_index += 4
-        else:
-            self._mask_key = False
+        # parse frame, using the header when it already decoded
+        self.parse_octet(header)
+
+    def parse_octet(self, header=None):
+        if header is None:
+            header, missing = decode_frame_header(self._byte_array.view())
+            if header is None:
+                raise exceptions.FrameHeaderParseError(
+                    'frame header require {} more bytes'.format(missing))
+        self._flag_fin = header.fin
+        self._flag_rsv1 = header.rsv1
+        self._flag_rsv2 = header.rsv2
+        self._flag_rsv3 = header.rsv3
+        self._flag_opcode = header.opcode
+        self._flag_mask = header.mask
+        self._flag_payload_length = header.flag_payload_length
+        self._payload_length = header.payload_length
+        self._mask_key = header.mask_key
 
         # Payload Data
-        self._payload_data = self._byte_array.build(_last_byte_index)
-        if self._flag_mask is 1:
-            self._payload_data = ws_transform_payload_data(self._payload_data,
-                                                           self._mask_key)
+        payload_view = self._byte_array.view(header.header_length,
+                                             header.frame_length)
+        if self._flag_mask == 1:
+            self._payload_data = masking.mask(payload_view, self._mask_key)
+        else:
+            self._payload_data = bytes(payload_view)
+        payload_view.release()
 
     def pack(self):
-        frame = packet.Packet()
-        # first-byte
-        frame.put_bits(
-            self._flag_fin,  # FIN flag
-            self._flag_rsv1,  # RSV1 flag
-            self._flag_rsv2,  # RSV2 flag
-            self._flag_rsv3,  # RSV3 flag
-            *packet.number_to_bits(self._flag_opcode, 4)
-        )
-        # second-byte
-        frame.put_bits(
-            self._flag_mask,
-            # Payload length flag [ <125, 126, 127 ]
-            *packet.number_to_bits(self._flag_payload_length, 7)
-        )
-        # payload_length
-        if self._flag_payload_length is 126:
-            frame.put_int16(self.payload_data_length)
-        elif self._flag_payload_length is 127:
-            frame.put_int64(self.payload_data_length)
-        # Masking key
-        if self._flag_mask is 1:
-            frame.put_int32(self._mask_key)
-        # Payload data
-        if self._flag_mask is 1:
+        header, payload_data = self.pack_parts()
+        return header + payload_data
+
+    def pack_parts(self):
+        """ Packed frame as (header, payload) for scatter-gather writes
+
+        The payload of an unmasked frame is returned without any copy.
+        """
+        first_octet = (self._flag_fin << 7) | (self._flag_rsv1 << 6) | \
+            (self._flag_rsv2 << 5) | (self._flag_rsv3 << 4) | \
+            self._flag_opcode
+        if self._flag_mask == 1:
             # If the data is being sent by the client, the frame(s) MUST be
             # masked
-            _payload_data = ws_transform_payload_data(self._payload_data,
-                                                      self._mask_key)
-            frame.put_string(_payload_data)
-        else:
-            frame.put_string(self._payload_data)
-        return frame.build()
+            return (encode_frame_header(first_octet, len(self._payload_data),
+                                        self._mask_key),
+                    masking.mask(self._payload_data, self._mask_key))
+        return (encode_frame_header(first_octet, len(self._payload_data)),
+                self._payload_data)
 
     @property
     def flag_fin(self):
@@ -396,8 +462,9 @@ class FrameBase(object, metaclass=abc.ABCMeta):
 
 
 class WebSocketFrame(FrameBase):
-    def __init__(self, raw_websocket):
-        super(WebSocketFrame, self).__init__(packet.ByteArray(raw_websocket))
+    def __init__(self, raw_websocket, header=None):
+        super(WebSocketFrame, self).__init__(
+            packet.ByteArray(raw_websocket), header)
 
 
 class FrameGenerator(FrameBase):
@@ -457,7 +524,8 @@ class FrameGenerator(FrameBase):
 
     def set_mask_key(self, mask_key):
         self._flag_mask = 1
-        self._mask_key = mask_key
+        self._mask_key = int.from_bytes(
+            masking.mask_key_to_bytes(mask_key), 'big')
         return self
 
     def opcode(self, opcode):
@@ -476,6 +544,82 @@ class FrameGenerator(FrameBase):
         return self
 
 
+class PackedFrame(object):
+    """ Frame packed once, the immutable bytes shared by all recipients
+
+    Handlers can keep the object and return or broadcast it repeatedly,
+    the frame is never packed again.
+    """
+
+    __slots__ = ('_frame_bytes', '_frame_type')
+
+    def __init__(self, message):
+        if isinstance(message, PackedFrame):
+            self._frame_bytes = message._frame_bytes
+            self._frame_type = message._frame_type
+            return
+        if hasattr(message, 'generate_frame'):
+            message = message.generate_frame
+        if not isinstance(message, FrameBase):
+            raise exceptions.ParameterError(
+                'packed frame require a frame or message object')
+        self._frame_bytes = message.pack()
+        self._frame_type = message.frame_type
+
+    @classmethod
+    def from_bytes(cls, frame_bytes: bytes):
+        """ Wrap the bytes of a frame packed by another process """
+        packed_frame = cls.__new__(cls)
+        packed_frame._frame_bytes = frame_bytes
+        packed_frame._frame_type = \
+            FrameBase._global_frame_type[frame_bytes[0] & 0xf]
+        return packed_frame
+
+    def pack(self):
+        return self._frame_bytes
+
+    @property
+    def frame_type(self):
+        return self._frame_type
+
+    def __len__(self):
+        return len(self._frame_bytes)
+
+    def __str__(self):
+        return '<Packed-Frame Type=\'{type}\' Length={length}>'.format(
+            type=generic.to_string(self._frame_type),
+            length=len(self._frame_bytes))
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class BroadcastReport(object):
+    """ Result of a broadcast, always true for the message handler """
+
+    __slots__ = ('recipients', 'frame_bytes')
+
+    def __init__(self, recipients, frame_bytes):
+        # number of clients the frame queued to
+        self.recipients = recipients
+        # length of the packed frame
+        self.frame_bytes = frame_bytes
+
+    @property
+    def total_bytes(self):
+        return self.recipients * self.frame_bytes
+
+    def __bool__(self):
+        return True
+
+    def __str__(self):
+        return '<Broadcast-Report Recipients={} Bytes={}>'.format(
+            self.recipients, self.total_bytes)
+
+    def __repr__(self):
+        return self.__str__()
+
+
 # A server MUST NOT mask any frames that it sends to
 # the client.
 def _build_base_frame(from_client, extra_data):
@@ -546,7 +690,7 @@ class FileTextMessage(TextMessage):
 
 class BinaryMessage(TextMessage):
     def __init__(self, contents, from_client=False):
-        if isinstance(contents, bytes):
+        if not isinstance(contents, bytes):
             raise TypeError('binary frame must be bytes type')
         super(BinaryMessage, self).__init__(contents, from_client)
 
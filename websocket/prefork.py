@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 ShadowMan
+#
+# Pre-fork worker mode. The supervisor forks the workers after the server
+# daemonized, each worker binds its own SO_REUSEPORT listener and the
+# kernel load-balances the incoming connections between them.
+#
+# The supervisor restarts the dead workers, forwards SIGTERM/SIGINT for a
+# graceful drain and keeps the pid file written by `Daemon`. It also binds
+# the worker bus endpoints, a restarted worker reuses the endpoint of the
+# dead one.
+import os
+import time
+import signal
+import socket
+from websocket.utils import exceptions, logger
+from websocket.net import worker_bus
+
+
+# signals handled by the supervisor
+SUPERVISOR_SIGNALS = (signal.SIGCHLD, signal.SIGTERM, signal.SIGINT)
+
+
+def check_workers(workers):
+    """ Validate the `workers` argument
+
+    :return: number of worker processes, 1 is the single process mode
+    """
+    if workers is None:
+        return 1
+    exceptions.raise_parameter_error('workers', int, workers)
+    if workers < 1:
+        raise exceptions.ParameterError('workers must be greater than 0')
+    if workers > 1 and (not hasattr(os, 'fork') or
+                        not hasattr(socket, 'SO_REUSEPORT')):
+        raise exceptions.ParameterError(
+            'workers require fork and SO_REUSEPORT support')
+    return workers
+
+
+def reuse_port(socket_fd):
+    socket_fd.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+
+class Supervisor(object):
+
+    # a worker exit within it after started is a crash loop
+    MIN_WORKER_LIFETIME = 1.0
+    # delay of restarting a crash looping worker
+    RESTART_DELAY = 1.0
+
+    def __init__(self, workers: int, serve, *, shutdown_timeout=10.0):
+        """ Supervisor members
+
+        :param serve: worker process body, called in the forked process
+            with the `WorkerBus` of the worker
+        :param shutdown_timeout: workers still alive after the graceful
+            drain are killed
+        :type self._workers: dict[int, (int, float)]
+        """
+        self._worker_count = workers
+        self._serve = serve
+        self._shutdown_timeout = shutdown_timeout
+        # pid -> (worker index, start time)
+        self._workers = dict()
+        # worker index -> restart time, delayed by crash loop
+        self._restarts = dict()
+        self._stopping = False
+        # worker bus endpoints, index -> socket
+        self._bus_directory = None
+        self._bus_endpoints = list()
+
+    def run(self):
+        """ Fork the workers and supervise them until SIGTERM/SIGINT """
+        # signals are received by `sigtimedwait`, never interrupt the loop
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        self._signal_mask = signal.pthread_sigmask(
+            signal.SIG_BLOCK, SUPERVISOR_SIGNALS)
+        self._bus_directory, self._bus_endpoints = \
+            worker_bus.create_endpoints(self._worker_count)
+        try:
+            for index in range(self._worker_count):
+                self._spawn(index)
+            logger.info('Supervisor({}) started {} workers'.format(
+                os.getpid(), self._worker_count))
+            while not self._stopping:
+                self._wait_signal(self._next_timeout())
+                self._reap()
+                self._restart()
+            self._stop()
+        finally:
+            worker_bus.remove_endpoints(self._bus_directory,
+                                        self._bus_endpoints)
+            signal.pthread_sigmask(signal.SIG_SETMASK, self._signal_mask)
+
+    @property
+    def worker_pids(self):
+        return list(self._workers)
+
+    def _spawn(self, index):
+        pid = os.fork()
+        if pid == 0:
+            self._worker_main(index)
+        self._workers[pid] = (index, time.monotonic())
+        logger.debug('Worker#{} started, pid = {}'.format(index, pid))
+
+    def _worker_main(self, index):
+        # never return to the caller of the supervisor
+        exit_code = 0
+        try:
+            for signum in SUPERVISOR_SIGNALS:
+                signal.signal(signum, signal.SIG_DFL)
+            signal.pthread_sigmask(signal.SIG_SETMASK, self._signal_mask)
+            self._serve(worker_bus.WorkerBus(index, self._bus_endpoints))
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else 0
+        except KeyboardInterrupt:
+            pass
+        except BaseException as e:
+            logger.error('Worker#{} error occurs({})'.format(index, repr(e)))
+            exit_code = 1
+        finally:
+            # the atexit functions belong to the supervisor
+            os._exit(exit_code)
+
+    def _wait_signal(self, timeout):
+        siginfo = signal.sigtimedwait(SUPERVISOR_SIGNALS, timeout)
+        if siginfo is None or siginfo.si_signo == signal.SIGCHLD:
+            return
+        logger.info('Supervisor receive an exit signal({})'.format(
+            siginfo.si_signo))
+        self._stopping = True
+
+    def _next_timeout(self):
+        if not self._restarts:
+            # workers are reaped by SIGCHLD, the timeout is a safety net
+            return 1.0
+        return max(0.0, min(self._restarts.values()) - time.monotonic())
+
+    def _reap(self):
+        while self._workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid not in self._workers:
+                continue
+            index, started = self._workers.pop(pid)
+            if self._stopping:
+                continue
+            logger.warning('Worker#{}({}) exited, status = {}'.format(
+                index, pid, status))
+            restart_at = time.monotonic()
+            if restart_at - started < self.MIN_WORKER_LIFETIME:
+                restart_at += self.RESTART_DELAY
+            self._restarts[index] = restart_at
+
+    def _restart(self):
+        now = time.monotonic()
+        for index, restart_at in list(self._restarts.items()):
+            if restart_at <= now:
+                del self._restarts[index]
+                self._spawn(index)
+
+    def _stop(self):
+        # graceful drain, workers close the listener and the clients
+        self._kill_workers(signal.SIGTERM)
+        deadline = time.monotonic() + self._shutdown_timeout
+        while self._workers and time.monotonic() < deadline:
+            signal.sigtimedwait(SUPERVISOR_SIGNALS,
+                                max(0.0, deadline - time.monotonic()))
+            self._reap()
+        if self._workers:
+            logger.warning('{} workers not exited, killed'.format(
+                len(self._workers)))
+            self._kill_workers(signal.SIGKILL)
+            while self._workers:
+                pid, _ = os.waitpid(-1, 0)
+                self._workers.pop(pid, None)
+        logger.info('Supervisor all workers exited')
+
+    def _kill_workers(self, signum):
+        for pid in self._workers:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
@@ -68,10 +68,11 @@ import os
 import abc
 import ssl
 import sys
+import time
 import atexit
+import inspect
 import signal
 import socket
-import inspect
 import functools
 import selectors
 from collections import deque, OrderedDict
@@ -79,20 +80,64 @@ from websocket.utils import (
     exceptions, logger, ws_utils, generic
 )
 from websocket.ext import (
-    handler, router, http_verifier
+    handler, router, http_verifier, handler_executor, process_executor,
+    extension
 )
 from websocket.net import (
-    ws_frame, tcp_stream, http_message
+    ws_frame, tcp_stream, http_parser, handshake_template, worker_bus
 )
+from websocket.ext.ws_exts import permessage_deflate
 from websocket.controller import (
-    base_controller, plain_controller
+    base_controller, plain_controller, process_controller
 )
 from websocket.controller.base_controller import BaseController
+from websocket import prefork
 
 
 __all__ = ['create_websocket_server', 'create_websocket_secure_server']
 
 
+def handshake_response(peer_name, http_request, extensions=None,
+                       enabled_extensions=None):
+    """ Verify the opening handshake request and build the response
+
+    :param extensions: extension.ExtensionRegistry of the server, None if
+        no extension offered
+    :param enabled_extensions: extensions enabled for the route, None is
+        all registered
+    :return: (http_response, accepted, pipeline), 403 Forbidden if verify
+        failed, pipeline is the negotiated ExtensionPipeline or None
+    """
+    try:
+        extension_offers = \
+            http_verifier.verify_request(peer_name, http_request)
+    except exceptions.HttpVersionError:
+        # unsupported version, return 426 with the supported version
+        return handshake_template.UPGRADE_REQUIRED, False, None
+    except exceptions.HttpVerifierError:
+        # verify error occurs, return 403 Forbidden
+        return handshake_template.FORBIDDEN, False, None
+    if logger.debug_enabled():
+        logger.debug('Request: {}'.format(repr(http_request)))
+
+    response_extensions, pipeline = None, None
+    if extensions and extension_offers:
+        response_extensions, pipeline = extensions.negotiate(
+            extension_offers, enabled_extensions)
+    ws_key = http_request.header.get_value('Sec-WebSocket-Key')
+    # Optionally, other header fields, such as those used to send
+    # cookies or request authentication to a server.
+    template = handshake_template.get_template(response_extensions)
+    return template.render(ws_utils.ws_accept_key(ws_key)), True, pipeline
+
+
+def handshake_error_response(error):
+    """ Response of the malformed or too large handshake request """
+    if isinstance(error, exceptions.HttpHeaderTooLarge):
+        return handshake_template.HEADER_TOO_LARGE
+    return handshake_template.BAD_REQUEST
+
+
 class Daemon(object):
 
     def __init__(self, *, debug=False, pid_file: str=None,
@@ -177,44 +222,49 @@ class Daemon(object):
             os.remove(self._pid_file)
 
 
-class WebSocketServerBase(Daemon, metaclass=abc.ABCMeta):
+class HandlerRegistry(object):
+    """ Handler and controller registration shared by all server engines """
 
-    # max message queue size
-    LISTEN_SIZE = 16
+    # the engine awaits the coroutine handler callbacks
+    COROUTINE_HANDLERS = False
 
-    def __init__(self, host: str, port: int, *, pid_file=None, debug=False):
-        """ WebSocketServerBase members
-
-        :type self._server_fd: socket.socket
-        :type self._client_list: dict[str, dict[socket.socket, BaseController]]
-        :type self._server_address: tuple
-        """
-        super(WebSocketServerBase, self).__init__(pid_file=pid_file,
-                                                  debug=debug)
-        # server file descriptor
-        self._server_fd = None
-        # all handshake client
-        self._client_list = {'default': {}}
-        # Server address information
-        self._server_address = (host, port)
-        # Write queue
-        self._write_queue = OrderedDict()
-        # close frame information (endpoint, receive/send close flag)
-        self._close_information = dict()
+    def __init__(self):
         # router object
         self._router = router.Router()
         # register default controller
         self.register_default_controller(plain_controller.PlainController)
-
-    def register_handler(self, namespace):
+        # None follows the `__offload__` of the handler class
+        self._router.register_default('offload', None)
+        # None follows the `__extensions__` of the handler class
+        self._router.register_default('extensions', None)
+        # thread pool of the offloaded handlers, created by the engine
+        self._handler_executor = None
+        # process pool of `ProcessController`, created by the engine
+        self._process_executor = None
+        # extensions offered to the clients
+        self._extensions = extension.ExtensionRegistry()
+
+    def register_handler(self, namespace, *, offload: bool=None,
+                         extensions=None):
+        """ Register the handler class for the namespace
+
+        :param offload: run the callbacks of the handler in the thread pool
+            of the server, None follows the `__offload__` of the class
+        :param extensions: names of the extensions negotiated for the
+            namespace, None follows the `__extensions__` of the class
+        """
         exceptions.raise_parameter_error('namespace', str, namespace)
+        if offload is not None:
+            self._router.register(namespace, 'offload', bool(offload))
+        if extensions is not None:
+            self._router.register(
+                namespace, 'extensions', frozenset(extensions))
 
         def _decorator_wrapper(class_object):
-            if not issubclass(class_object, handler.WebSocketHandlerProtocol):
-                raise exceptions.ParameterError(
-                    'handlers must be derived with WebSocketHandlerProtocol')
+            self._check_handler(class_object)
             self._router.register(namespace, 'handler', class_object)
             class_object.__namespace__ = namespace
+            class_object.__server__ = self
             logger.info("Handler: '{namespace}' => {handler}".format(
                 namespace=namespace, handler=class_object))
 
@@ -225,17 +275,29 @@ class WebSocketServerBase(Daemon, metaclass=abc.ABCMeta):
         return _decorator_wrapper
 
     def register_default_handler(self, class_object):
-        if not issubclass(class_object, handler.WebSocketHandlerProtocol):
-            raise exceptions.ParameterError(
-                'handlers must be derived with WebSocketHandlerProtocol')
+        self._check_handler(class_object)
         logger.info('Default handler: {}'.format(class_object))
         self._router.register_default('handler', class_object)
+        class_object.__server__ = self
 
         @functools.wraps(class_object)
         def _handler_wrapper(*args, **kwargs):
             return class_object(*args, **kwargs)
         return _handler_wrapper
 
+    def _check_handler(self, class_object):
+        if not isinstance(class_object, type) or not issubclass(
+                class_object, handler.WebSocketHandlerProtocol):
+            raise exceptions.ParameterError(
+                'handlers must be derived with WebSocketHandlerProtocol')
+        if self.COROUTINE_HANDLERS:
+            return
+        for name in ('on_connect', 'on_message', 'on_close', 'on_error'):
+            if inspect.iscoroutinefunction(getattr(class_object, name)):
+                raise exceptions.ParameterError(
+                    'coroutine handler {}.{} require AsyncWebSocketServer'
+                    .format(class_object.__name__, name))
+
     def register_controller(self, namespace, controller_name):
         exceptions.raise_parameter_error('namespace', str, namespace)
         if not issubclass(controller_name, base_controller.BaseController):
@@ -252,22 +314,205 @@ class WebSocketServerBase(Daemon, metaclass=abc.ABCMeta):
         logger.info('Default controller: {}'.format(controller_name))
         self._router.register_default('controller', controller_name)
 
+    def _create_controller(self, namespace, stream, output,
+                           offload_ready=None, extensions=None):
+        """ Controller and handler registered for the namespace
+
+        :param offload_ready: engine callback of the offloaded handler, see
+            `BaseController.set_executor`
+        :param extensions: ExtensionPipeline negotiated by the handshake
+        """
+        try:
+            # get handler or default handler
+            _handler = self._router.solution(namespace, 'handler')(
+                stream.get_socket_fd())
+            # get controller or default controller
+            controller_name = self._router.solution(namespace, 'controller')
+        except exceptions.ParameterError:
+            raise exceptions.FatalError('handler not found')
+        controller = controller_name(stream, output, _handler)
+        offload = self._router.solution(namespace, 'offload')
+        if offload is None:
+            offload = _handler.__offload__
+        controller.set_executor(
+            self._handler_executor if offload else None, offload_ready)
+        if isinstance(controller, process_controller.ProcessController):
+            controller.set_process_executor(self._process_executor)
+        if extensions is not None:
+            controller.set_extensions(extensions)
+        return controller
+
+    @property
+    def process_executor(self):
+        """ Process pool of the message transforms, None until started """
+        return self._process_executor
+
+    def register_extension(self, options):
+        """ Offer the extension to the clients of all namespaces
+
+        :type options: extension.ExtensionOptions
+        """
+        self._extensions.register(options)
+
+    @property
+    def extensions(self):
+        """ Extensions offered to the clients """
+        return self._extensions
+
+    def _enabled_extensions(self, namespace):
+        # names of the extensions negotiated for the namespace, None is all
+        if not self._extensions:
+            return None
+        enabled = self._router.solution(namespace, 'extensions')
+        if enabled is None:
+            try:
+                enabled = self._router.solution(
+                    namespace, 'handler').__extensions__
+            except exceptions.ParameterError:
+                return None
+        return enabled
+
+    def _set_deflate_options(self, options):
+        options = permessage_deflate.create_options(options)
+        if options is not None:
+            self._extensions.register(options)
+
+
+class WebSocketServerBase(Daemon, HandlerRegistry, metaclass=abc.ABCMeta):
+
+    # pending connections the kernel queues before accepted, capped by
+    # net.core.somaxconn
+    LISTEN_SIZE = socket.SOMAXCONN
+    # stop reading from a client when its output buffer exceed it
+    WRITE_HIGH_WATERMARK = 1024 * 1024
+    # resume reading from the client when its output buffer below it
+    WRITE_LOW_WATERMARK = 256 * 1024
+    # seconds waiting for the clients closed on the graceful shutdown
+    SHUTDOWN_TIMEOUT = 10.0
+
+    def __init__(self, host: str, port: int, *, pid_file=None, debug=False,
+                 frame_budget=None, high_watermark=None, low_watermark=None,
+                 workers=None, offload_workers=None, offload_queue_depth=None,
+                 process_workers=None, process_in_flight=None,
+                 max_header_bytes=None, max_header_count=None,
+                 permessage_deflate=None, max_frame_size=None,
+                 listen_backlog=None):
+        """ WebSocketServerBase members
+
+        :type self._server_fd: socket.socket
+        :type self._client_list: dict[str, dict[socket.socket, BaseController]]
+        :type self._server_address: tuple
+        :type self._pending_receive: OrderedDict[socket.socket, tuple]
+        :type self._client_streams: dict[socket.socket, tcp_stream.TCPStream]
+        :type self._dirty_clients: set[socket.socket]
+        :type self._handshake_parsers:
+            dict[socket.socket, http_parser.HandshakeParser]
+        """
+        super(WebSocketServerBase, self).__init__(pid_file=pid_file,
+                                                  debug=debug)
+        # server file descriptor
+        self._server_fd = None
+        # all handshake client
+        self._client_list = {'default': {}}
+        # Server address information
+        self._server_address = (host, port)
+        # Write queue
+        self._write_queue = OrderedDict()
+        # clients with data in the write queue
+        self._dirty_clients = set()
+        # namespace of all clients
+        self._client_namespace = dict()
+        # close frame information (endpoint, receive/send close flag)
+        self._close_information = dict()
+        # frames handled for each readiness event, None is controller default
+        self._frame_budget = frame_budget
+        # payload length of a frame at most, None is controller default
+        self._max_frame_size = max_frame_size
+        # clients with complete frames deferred by the frame budget
+        self._pending_receive = OrderedDict()
+        # select loop counter, frames received in this loop are not drained
+        self._loop_iteration = 0
+        # output buffer of all clients
+        self._client_streams = dict()
+        # clients closed as soon as the output buffer flushed
+        self._close_after_flush = set()
+        # clients stop reading for the output buffer watermark
+        self._paused_reading = set()
+        # clients stop reading until the offloaded handler finished
+        self._offload_paused = set()
+        # handshake request parser of the clients not upgraded yet
+        self._handshake_parsers = dict()
+        # limits of the handshake request, None is parser default
+        self._max_header_bytes = max_header_bytes
+        self._max_header_count = max_header_count
+        # output buffer watermarks
+        self._high_watermark = self.WRITE_HIGH_WATERMARK \
+            if high_watermark is None else high_watermark
+        self._low_watermark = self.WRITE_LOW_WATERMARK \
+            if low_watermark is None else low_watermark
+        if not 0 <= self._low_watermark <= self._high_watermark:
+            raise exceptions.ParameterError(
+                'watermarks must be 0 <= low_watermark <= high_watermark')
+        # accept queue length of the listening socket
+        self._listen_backlog = check_listen_backlog(
+            self.LISTEN_SIZE if listen_backlog is None else listen_backlog)
+        # pre-fork worker processes, 1 is the single process mode
+        self._workers = prefork.check_workers(workers)
+        # set by the shutdown signal of the worker
+        self._shutdown_deadline = None
+        self._wakeup_fd = None
+        # broadcasts between the workers, set in the worker process
+        self._worker_bus = None
+        # thread pool of the offloaded handlers
+        self._offload_workers = offload_workers
+        self._offload_queue_depth = offload_queue_depth
+        # process pool of the message transforms
+        self._process_workers = process_workers
+        self._process_in_flight = process_in_flight
+        # handler and controller registration
+        HandlerRegistry.__init__(self)
+        self._set_deflate_options(permessage_deflate)
+
     def run_forever(self):
         # Start deamon on background
         super(WebSocketServerBase, self).run_forever()
+        if self._workers > 1:
+            # the supervisor keeps the pid file, workers accept the clients
+            prefork.Supervisor(
+                self._workers, self._serve_worker,
+                shutdown_timeout=self.SHUTDOWN_TIMEOUT + 1.0).run()
+            return
+        self._listen()
+        # enter the main loop
+        self._select_loop()
+
+    def _serve_worker(self, bus):
+        # broadcast to the clients of the siblings
+        self._worker_bus = bus
+        # each worker owns a listener, the kernel balances the accepts
+        self._listen(reuse_port=True)
+        # wake up the select loop to start the graceful shutdown
+        self._wakeup_fd, wakeup_writer = socket.socketpair()
+        wakeup_writer.setblocking(False)
+        signal.signal(signal.SIGTERM,
+                      lambda signum, frame: self._wakeup(wakeup_writer))
+        self._select_loop()
+
+    def _listen(self, reuse_port=False):
         # Create server socket file descriptor
         self._server_fd = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         # Set socket option, REUSEADDR = True
         self._server_fd.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            prefork.reuse_port(self._server_fd)
         # Set using non-block socket
         self._server_fd.setblocking(False)
         # Bind server listen port
         self._server_fd.bind(self._server_address)
         # Max connect queue size
-        self._server_fd.listen(WebSocketServer.LISTEN_SIZE)
-        logger.info('Server running in {}:{}'.format(*self._server_address))
-        # enter the main loop
-        self._select_loop()
+        self._server_fd.listen(self._listen_backlog)
+        logger.info('Server running in {}:{}, pid = {}'.format(
+            *self._server_address, os.getpid()))
 
     def _select_loop(self):
         # efficient I/O multiplexing
@@ -275,34 +520,123 @@ class WebSocketServerBase(Daemon, metaclass=abc.ABCMeta):
         # register server socket file descriptor
         self._selector.register(
             self._server_fd, selectors.EVENT_READ, (self._accept_client, None))
+        if self._wakeup_fd is not None:
+            self._selector.register(
+                self._wakeup_fd, selectors.EVENT_READ,
+                (self._begin_shutdown, None))
+        if self._worker_bus is not None:
+            self._selector.register(
+                self._worker_bus, selectors.EVENT_READ,
+                (lambda bus: self._deliver_bus_messages(), None))
+        # results of the offloaded handlers posted back to the loop
+        self._handler_executor = handler_executor.HandlerExecutor(
+            self._offload_workers, self._offload_queue_depth)
+        self._selector.register(
+            self._handler_executor, selectors.EVENT_READ,
+            (lambda executor: executor.run_completed(), None))
+        # the worker processes started on the first transform
+        self._process_executor = process_executor.ProcessExecutor(
+            self._handler_executor.call_soon_threadsafe,
+            self._process_workers, self._process_in_flight)
 
         try:
-            while True:
-                events = self._selector.select()
+            while not self._shutdown_completed():
+                self._loop_iteration += 1
+                events = self._selector.select(self._select_timeout())
 
                 for key, mask in events:
-                    # accept new client
                     callback, namespace = key.data
                     try:
                         if namespace is None:
+                            # accept new client
                             callback(key.fileobj)
-                        else:
+                            continue
+                        if mask & selectors.EVENT_WRITE:
+                            self._flush_client(key.fileobj, namespace)
+                        if mask & selectors.EVENT_READ:
                             callback(key.fileobj, namespace)
                     except exceptions.ExitWrite:
                         # on client/server closed
                         pass
+                    except Exception as e:
+                        if namespace is None:
+                            raise
+                        self._abort_client(key.fileobj, e)
+                # handle frames deferred by the frame budget, round-robin
+                self._drain_pending_receive()
                 # clean all socket write buffer
                 self._clean_write_queue()
+                # broadcasts of this loop to the siblings, batched
+                if self._worker_bus is not None:
+                    self._worker_bus.flush()
         except KeyboardInterrupt:  # when start debug mode listen Ctrl-C
             logger.info('<Ctrl + C> Bye, Never BUG')
             exit()
         except Exception as e:
             logger.error('Fatal Error occurs for {}'.format(repr(e)))
             raise
+        finally:
+            self._process_executor.shutdown(wait=False)
+            self._handler_executor.shutdown(wait=False)
+
+    def _select_timeout(self):
+        # never block while deferred frames are waiting
+        if self._pending_receive:
+            return 0
+        if self._shutdown_deadline is not None:
+            return max(0.0, self._shutdown_deadline - time.monotonic())
+        if self._worker_bus is not None and self._worker_bus.has_pending:
+            # retry the datagrams of the busy siblings
+            return self._worker_bus.RETRY_INTERVAL
+        return None
+
+    @staticmethod
+    def _wakeup(wakeup_writer):
+        try:
+            wakeup_writer.send(b'\0')
+        except OSError:
+            # already woken up
+            pass
+
+    def _begin_shutdown(self, wakeup_fd):
+        wakeup_fd.recv(64)
+        if self._shutdown_deadline is not None:
+            return
+        logger.info('Server shutting down, {} clients connected'.format(
+            len(self._client_namespace)))
+        self._shutdown_deadline = time.monotonic() + self.SHUTDOWN_TIMEOUT
+        # stop accepting, other workers keep listening
+        self._selector.unregister(self._server_fd)
+        self._server_fd.close()
+        for socket_fd, namespace in list(self._client_namespace.items()):
+            if namespace == 'default':
+                # handshake not completed
+                try:
+                    self._close_client(socket_fd, namespace)
+                except exceptions.ExitWrite:
+                    pass
+            elif self._close_information[socket_fd][0] is None:
+                # closed when the client replies the close frame
+                self._enqueue_write(socket_fd, ws_frame.generate_close_frame(
+                    extra_data='server shutting down', errno=1001))
+        self._clean_write_queue()
+
+    def _shutdown_completed(self):
+        if self._shutdown_deadline is None:
+            return False
+        if self._client_namespace:
+            return time.monotonic() >= self._shutdown_deadline
+        return True
 
     def _accept_client(self, server_fd):
+        if server_fd.fileno() < 0:
+            # listener closed by the shutdown in the same select loop
+            return
         # accept new client
         client_fd, client_address = self._socket_accept(server_fd)
+        if client_fd is None:
+            # rejected by the accept hook
+            return
         # logger
         logger.debug('Client({}:{}) connecting'.format(*client_address))
         # set non=blocking
@@ -310,107 +644,149 @@ class WebSocketServerBase(Daemon, metaclass=abc.ABCMeta):
         # register listen EVENT_READ
         self._selector.register(client_fd,
                                 selectors.EVENT_READ,
-                                (self._accept_http_handshake, None))
+                                (self._accept_http_handshake, 'default'))
 
         # close information
         self._close_information[client_fd] = (None, False)
         # write queue for single socket descriptor
         self._write_queue[client_fd] = deque()  # type: deque
+        self._client_namespace[client_fd] = 'default'
         # create tcp stream class
-        self._client_list['default'][client_fd] = \
-            tcp_stream.TCPStream(client_fd)
+        _tcp_stream = tcp_stream.TCPStream(client_fd, client_address)
+        self._client_streams[client_fd] = _tcp_stream
+        self._client_list['default'][client_fd] = _tcp_stream
+        self._handshake_parsers[client_fd] = http_parser.HandshakeParser(
+            self._max_header_bytes, self._max_header_count)
 
     def _socket_accept(self, socket_fd):
         return socket_fd.accept()
 
-    def _accept_http_handshake(self, socket_fd):
+    def _accept_http_handshake(self, socket_fd, namespace='default'):
         _tcp_stream = \
             self._client_list['default'][socket_fd]  # type:tcp_stream.TCPStream
         # receive data from kernel tcp buffer
-        pos = _tcp_stream.find_buffer(b'\r\n\r\n')
-        if pos is -1:
-            return
-        http_request = http_message.factory_http_message(
-            _tcp_stream.feed_buffer(pos))
-        # Verify http request is correct
-        support_extension = tuple()
         try:
-            support_extension_list = \
-                http_verifier.verify_request(
-                    socket_fd.getpeername(), http_request)
-            support_extension = (
-                b'Sec-WebSocket-Extensions',
-                b','.join(map(
-                    lambda x: generic.to_bytes(x), support_extension_list)))
-            if not support_extension[1]:
-                support_extension = None
-        except exceptions.HttpVerifierError:
-            # verify error occurs, return 403 Forbidden
-            http_response = http_message.HttpResponse(
-                403, (b'X-Forbidden-Reason', b'http-options-invalid'))
-            # write directly to the data, and then close the connection
-            self._socket_ready_write(
-                socket_fd, http_response, http_request.url_path)
-            # close connection
+            _tcp_stream.ready_receive()
+        except exceptions.ConnectClosed:
+            # closed before handshake completed
             self._close_client(socket_fd, 'default')
-        logger.debug('Request: {}'.format(repr(http_request)))
-        # TODO. chunk header-field
-        if 'Content-Length' in http_request.header:
-            logger.info('Request has payload, length = {}'.format(
-                http_request.header.get_value('Content-Length')))
-            # buffer length is too short
-            if _tcp_stream.get_buffer_length() < \
-                    http_request.header.get_value('Content-Length'):
+        parser = self._handshake_parsers.get(socket_fd)
+        if parser is None:
+            # rejected, closed when the response sent
+            return
+        try:
+            # resume from the previous scan, the payload dropped
+            http_request = parser.feed(_tcp_stream)
+        except exceptions.HttpParserError as e:
+            logger.warning('Client({}:{}) handshake invalid({})'.format(
+                *_tcp_stream.peer_name, e))
+            http_response, accepted = handshake_error_response(e), False
+        else:
+            if http_request is None:
                 return
-            # drop payload data
-            _tcp_stream.feed_buffer(http_request['Content-Length'].value)
-
-        ws_key = http_request.header.get_value('Sec-WebSocket-Key')
-        # Optionally, other header fields, such as those used to send
-        # cookies or request authentication to a server.
-        http_response = http_message.HttpResponse(
-            101, *(
-                (b'Upgrade', b'websocket'),
-                (b'Connection', b'Upgrade'),
-                (b'Sec-WebSocket-Accept', ws_utils.ws_accept_key(ws_key)),
-                support_extension
-            )
-        )
+            # Verify http request is correct
+            http_response, accepted, extensions = handshake_response(
+                _tcp_stream.peer_name, http_request, self._extensions,
+                self._enabled_extensions(
+                    generic.to_string(http_request.url_path)))
+        self._handshake_parsers.pop(socket_fd)
+        if not accepted:
+            # write directly to the data, and then close the connection
+            self._socket_ready_write(socket_fd, http_response, 'default')
+            # close connection when the response sent
+            self._close_after_flush.add(socket_fd)
+            self._flush_client(socket_fd, 'default')
+            return
+
+        namespace = generic.to_string(http_request.url_path)
+        # initial controller
+        controller = self._create_controller(
+            namespace, _tcp_stream,
+            functools.partial(self._enqueue_write, socket_fd),
+            functools.partial(self._offload_ready, socket_fd, namespace),
+            extensions)
+        if self._frame_budget is not None:
+            controller.frame_budget = self._frame_budget
+        if self._max_frame_size is not None:
+            controller.max_frame_size = self._max_frame_size
+        if namespace not in self._client_list:
+            self._client_list[namespace] = dict()
+        self._client_list['default'].pop(socket_fd)
+        self._client_list[namespace][socket_fd] = controller
+        self._client_namespace[socket_fd] = namespace
+        # send http-handshake-response
+        self._enqueue_write(socket_fd, http_response)
+        # notification handler connect event, the response queued
         try:
-            namespace = generic.to_string(http_request.url_path)
-            # get handler or default handler
-            _handler = self._router.solution(namespace, 'handler')(socket_fd)
-            # get controller or default controller
-            controller_name = self._router.solution(namespace, 'controller')
-            # initial controller
-            if namespace not in self._client_list:
-                self._client_list[namespace] = dict()
-            self._client_list[namespace][socket_fd] = controller_name(
-                self._client_list['default'].pop(socket_fd),
-                self._write_queue[socket_fd].append,
-                _handler)
-            # send http-handshake-response
-            self._write_queue[socket_fd].append(http_response)
-            # notification handler connect event
-            response = _handler.on_connect()
-            # send connect message
-            if hasattr(response, 'pack'):
-                self._write_queue[socket_fd].append(response)
-            elif hasattr(response, 'generate_frame'):
-                self._write_queue[socket_fd].append(response.generate_frame)
-            # modify selector data
-            self._selector.modify(socket_fd,
-                                  selectors.EVENT_READ,
-                                  (self._socket_ready_receive, namespace))
-        except exceptions.ParameterError:
-            raise exceptions.FatalError('handler not found')
+            controller.connect()
+        except exceptions.InvalidResponse as e:
+            logger.error('Connect handler error occurs({})'.format(e))
+            self._enqueue_write(socket_fd, ws_frame.generate_close_frame(
+                extra_data=str(e), errno=1011))
+            self._close_after_flush.add(socket_fd)
+        # modify selector data
+        self._selector.modify(socket_fd,
+                              selectors.EVENT_READ,
+                              (self._socket_ready_receive, namespace))
+        # frames pipelined behind the handshake request
+        if _tcp_stream.buffer_length():
+            self._pending_receive[socket_fd] = (namespace, 0)
 
     def _socket_ready_receive(self, socket_fd, namespace):
+        self._handle_frames(socket_fd, namespace, True)
+
+    def _drain_pending_receive(self):
+        for socket_fd, (namespace, iteration) in \
+                list(self._pending_receive.items()):
+            # already handled a budget of frames in this loop
+            if iteration == self._loop_iteration:
+                continue
+            # waiting for the output buffer drain
+            if socket_fd in self._paused_reading:
+                continue
+            try:
+                self._handle_frames(socket_fd, namespace, False)
+            except exceptions.ExitWrite:
+                # on client/server closed
+                pass
+            except Exception as e:
+                self._abort_client(socket_fd, e)
+
+    def _abort_client(self, socket_fd, error):
+        # unexpected error of a client, never stops the other clients
+        logger.error('Client error occurs({}), connection closed'.format(
+            repr(error)))
+        namespace = self._client_namespace.get(socket_fd)
+        if namespace is None:
+            # already closed
+            return
+        try:
+            self._close_client(socket_fd, namespace)
+        except exceptions.ExitWrite:
+            pass
+
+    def _handle_frames(self, socket_fd, namespace, receive):
         try:
             controller = \
                 self._client_list[namespace][socket_fd]  # type: BaseController
-            controller.ready_receive()
+            if receive:
+                more_frames = controller.ready_receive()
+            else:
+                more_frames = controller.drain_frames()
+            # move to the end of the round-robin order
+            self._pending_receive.pop(socket_fd, None)
+            if more_frames:
+                self._pending_receive[socket_fd] = \
+                    (namespace, self._loop_iteration)
+            if controller.offload_enabled:
+                self._update_offload_interest(socket_fd, namespace, controller)
         except exceptions.ConnectClosed as e:
+            self._pending_receive.pop(socket_fd, None)
+            # closed abnormally, a close frame can't be sent
+            if e.args[0][0] == 1006:
+                logger.info('Client connection lost, reason({})'.format(
+                    e.args[0][1]))
+                self._close_client(socket_fd, namespace)
             # from server close
             if self._close_information[socket_fd][0] is None:
                 # TODO. handler send close-frame
@@ -425,115 +801,435 @@ class WebSocketServerBase(Daemon, metaclass=abc.ABCMeta):
             if e.args[0][0] != 1000:
                 logger.info('Server active close-frame, reason({})'.format(
                     e.args[0][0]))
+                # the frames after the error can't be parsed, closed when
+                # the close frame sent
+                self._close_after_flush.add(socket_fd)
 
-            self._write_queue[socket_fd].append(ws_frame.generate_close_frame(
+            self._enqueue_write(socket_fd, ws_frame.generate_close_frame(
                 extra_data=e.args[0][1], errno=e.args[0][0]))
 
+    def _offload_ready(self, socket_fd, namespace):
+        # the offloaded handler finished or the executor has capacity
+        if self._client_namespace.get(socket_fd) != namespace:
+            # closed while the handler running
+            return
+        try:
+            self._handle_frames(socket_fd, namespace, False)
+        except exceptions.ExitWrite:
+            # on client/server closed
+            pass
+
+    def _update_offload_interest(self, socket_fd, namespace, controller):
+        # read ahead a little while the offloaded handler busy
+        _tcp_stream = self._client_streams[socket_fd]
+        paused = controller.offload_blocked and \
+            _tcp_stream.buffer_length() >= controller.OFFLOAD_READ_AHEAD
+        if paused == (socket_fd in self._offload_paused):
+            return
+        if paused:
+            self._offload_paused.add(socket_fd)
+        else:
+            self._offload_paused.discard(socket_fd)
+        self._update_interest(socket_fd, namespace, _tcp_stream.pending_bytes)
+
+    def _enqueue_write(self, socket_fd, data_pack):
+        self._write_queue[socket_fd].append(data_pack)
+        self._dirty_clients.add(socket_fd)
+
     def _clean_write_queue(self):
-        _clients = dict()
-        for namespace in self._client_list:
-            for socket_fd in self._client_list[namespace].keys():
-                _clients[socket_fd] = namespace
-        for socket_fd, namespace in _clients.items():
-            while len(self._write_queue[socket_fd]):
-                try:
+        # only the clients with data queued in this loop
+        while self._dirty_clients:
+            socket_fd = self._dirty_clients.pop()
+            namespace = self._client_namespace[socket_fd]
+            write_queue = self._write_queue[socket_fd]
+            try:
+                while write_queue:
                     self._socket_ready_write(
-                        socket_fd, self._write_queue[socket_fd].popleft(),
-                        namespace)
-                except exceptions.ExitWrite:
-                    break
+                        socket_fd, write_queue.popleft(), namespace)
+                self._flush_client(socket_fd, namespace)
+            except exceptions.ExitWrite:
+                continue
 
     def _socket_ready_write(self, socket_fd, data_pack, namespace: str):
+        """ Pack the data into the output buffer of the client """
+        if isinstance(data_pack, (ws_frame.FrameBase, ws_frame.PackedFrame)):
+            if data_pack.frame_type == ws_frame.Close_Frame:
+                # from server(normal or error occurs) first send close-frame
+                if self._close_information[socket_fd][0] is None:
+                    self._close_information[socket_fd] = ('server', False)
+                else:
+                    self._close_information[socket_fd] = (
+                        self._close_information[socket_fd][0], True)
+        _tcp_stream = self._client_streams[socket_fd]
+        if logger.debug_enabled():
+            logger.debug('Response: {}'.format(data_pack))
+        if hasattr(data_pack, 'pack_parts'):
+            # header and payload sent by scatter-gather, payload not copied
+            for data in data_pack.pack_parts():
+                _tcp_stream.write(data)
+        elif hasattr(data_pack, 'pack'):
+            _tcp_stream.write(data_pack.pack())
+        else:
+            raise exceptions.SendDataPackError('data pack invalid')
+        if self._close_information[socket_fd][1] is True:
+            self._close_after_flush.add(socket_fd)
+
+    def _flush_client(self, socket_fd, namespace):
+        try:
+            pending = self._client_streams[socket_fd].flush()
+        except exceptions.ConnectClosed as e:
+            logger.info('Client connection lost, reason({})'.format(
+                e.args[0][1]))
+            self._close_client(socket_fd, namespace)
+        if pending == 0 and socket_fd in self._close_after_flush:
+            self._close_client(socket_fd, namespace)
+        self._update_interest(socket_fd, namespace, pending)
+
+    def _update_interest(self, socket_fd, namespace, pending):
+        # output buffer watermarks
+        if socket_fd in self._paused_reading:
+            if pending <= self._low_watermark:
+                self._paused_reading.discard(socket_fd)
+                self._notify_backpressure(socket_fd, namespace, False)
+        elif pending >= self._high_watermark:
+            self._paused_reading.add(socket_fd)
+            self._notify_backpressure(socket_fd, namespace, True)
+        # listen EVENT_WRITE only while data pending
+        events = selectors.EVENT_WRITE if pending else 0
+        if socket_fd not in self._paused_reading and \
+                socket_fd not in self._offload_paused and \
+                socket_fd not in self._close_after_flush:
+            events |= selectors.EVENT_READ
+        key = self._selector.get_key(socket_fd)
+        if events != key.events:
+            self._selector.modify(socket_fd, events, key.data)
+
+    def _notify_backpressure(self, socket_fd, namespace, paused):
+        logger.debug('Client output buffer {}'.format(
+            'exceeds the high watermark' if paused else 'drained'))
+        controller = self._client_list[namespace].get(socket_fd)
+        if not isinstance(controller, BaseController):
+            return
         try:
-            if isinstance(data_pack, ws_frame.FrameBase):
-                if data_pack.frame_type == ws_frame.Close_Frame:
-                    # from server(normal or error occurs) first send close-frame
-                    if self._close_information[socket_fd][0] is None:
-                        self._close_information[socket_fd] = ('server', False)
-                    else:
-                        self._close_information[socket_fd] = (
-                            self._close_information[socket_fd][0], True)
-            if hasattr(data_pack, 'pack'):
-                logger.debug('Response: {}'.format(data_pack))
-                socket_fd.sendall(data_pack.pack())
+            if paused:
+                handler.invoke(controller.handler.on_pause_writing)
             else:
-                raise exceptions.SendDataPackError('data pack invalid')
-            if self._close_information[socket_fd][1] is True:
-                self._close_client(socket_fd, namespace)
-        except ConnectionAbortedError as e:
-            raise exceptions.ConnectClosed((1002, str(e)))
-        except Exception:
-            raise
+                handler.invoke(controller.handler.on_resume_writing)
+        except Exception as e:
+            logger.error('Backpressure callback error occurs({})'.format(e))
 
     def _close_client(self, socket_fd, namespace):
         logger.debug('Client({}:{}) socket fd closed'.format(
-            *socket_fd.getpeername()))
+            *self._client_streams[socket_fd].peer_name))
 
         self._selector.unregister(socket_fd)
         self._client_list[namespace].pop(socket_fd)
+        self._pending_receive.pop(socket_fd, None)
+        self._client_streams.pop(socket_fd)
+        self._close_after_flush.discard(socket_fd)
+        self._paused_reading.discard(socket_fd)
+        self._offload_paused.discard(socket_fd)
+        self._handshake_parsers.pop(socket_fd, None)
         self._write_queue.pop(socket_fd)
+        self._dirty_clients.discard(socket_fd)
+        self._client_namespace.pop(socket_fd)
         self._close_information.pop(socket_fd)
         socket_fd.close()
         raise exceptions.ExitWrite()
 
 
-class WebSocketServer(WebSocketServerBase):
-
-    def __init__(self, host, port, *, debug=False, server_name=None):
-        self._debug = bool(debug)
-        if os.name == 'nt':
-            logger.wait_logger_init_msg(
-                logger.warning,
-                'WebSocketServer running in Windows, only DEBUG mode')
-            self._debug = True
-        if server_name is None:
-            server_name = host
-        http_verifier.set_server_name(server_name, port=port)
-        super(WebSocketServer, self).__init__(host, port, debug=self._debug)
-
+def check_listen_backlog(backlog):
+    if not isinstance(backlog, int) or backlog < 1:
+        raise exceptions.ParameterError(
+            'listen backlog must be a positive integer')
+    return backlog
+
+
+def in_loop_thread(method):
+    """ Server method called by the offloaded handler runs in the loop
+
+    The server state is only touched by the loop thread, the handler
+    thread waits for the result.
+    """
+    @functools.wraps(method)
+    def _method_wrapper(self, *args, **kwargs):
+        executor = self._handler_executor
+        if executor is None or executor.in_loop_thread():
+            return method(self, *args, **kwargs)
+        return executor.run_in_loop(
+            handler.current_handler(),
+            functools.partial(method, self, *args, **kwargs))
+    return _method_wrapper
+
+
+class Broadcaster(object):
+    """ Broadcast and topic publish/subscribe shared by all server engines
+
+    The engine provides `_client_list`, `_client_namespace`,
+    `extensions` and `_enqueue_write(socket_fd, data_pack)`.
+
+    With the extensions negotiated, e.g. permessage-deflate, the message
+    is encoded once for all recipients with the same `parameters` of the
+    extensions, the recipients with the context takeover encode it by
+    their own extensions.
+
+    In the worker mode the broadcasts are also sent to the siblings by the
+    worker bus, the report only counts the clients of this worker.
+    """
+
+    def __init__(self):
+        # topic -> subscribed clients
+        self._topic_subscribers = dict()
+        # client -> subscribed topics
+        self._client_topics = dict()
+        # subscribed topics end with wildcard, 'chat.*' or '*'
+        self._prefix_topics = set()
+        # set in the worker process of the pre-fork mode
+        self._worker_bus = None  # type: worker_bus.WorkerBus
+        # encoded frames of the recent broadcasts
+        self._compression_cache = permessage_deflate.CompressionCache()
+
+    @in_loop_thread
     def broadcast(self, message, include_self: bool=False):
         _self_class = self._get_handler_self()
 
-        if not hasattr(_self_class, '__namespace__'):
+        namespace = self._client_namespace.get(_self_class.socket_fd)
+        if namespace is None:
             raise exceptions.BroadcastError('broadcast context invalid')
-
-        namespace = _self_class.__namespace__
         if namespace not in self._client_list:
             raise exceptions.FatalError(
                 'handler context invalid for namespace not found')
 
-        if hasattr(message, 'pack'):
-            pass
-        elif hasattr(message, 'generate_frame'):
-            message = message.generate_frame
-        else:
-            raise exceptions.BroadcastError('broadcast message invalid')
+        message = self._pack_message(message)
+        if self._worker_bus is not None:
+            self._worker_bus.send(
+                worker_bus.BUS_BROADCAST, namespace, message.pack())
+        return self._queue_broadcast(self._client_list[namespace], message,
+                                     _self_class.socket_fd, include_self)
 
-        _context_socket_fd = _self_class.socket_fd
-        for socket_fd in self._client_list[namespace]:
-            if socket_fd == _context_socket_fd and not include_self:
-                continue
-            self._write_queue[socket_fd].append(message)
+    @in_loop_thread
+    def subscribe(self, topic: str):
+        """ Subscribe current connection to the topic
+
+        The topic end with '*' matches all topics start with the prefix,
+        e.g. 'room.*' receives the message published to 'room.1'
+        """
+        _self_class = self._get_handler_self()
+        self._check_topic(topic, True)
+
+        socket_fd = _self_class.socket_fd
+        if topic not in self._topic_subscribers:
+            self._topic_subscribers[topic] = set()
+            if topic.endswith('*'):
+                self._prefix_topics.add(topic)
+        self._topic_subscribers[topic].add(socket_fd)
+        self._client_topics.setdefault(socket_fd, set()).add(topic)
+        return True
+
+    @in_loop_thread
+    def unsubscribe(self, topic: str=None):
+        """ Unsubscribe current connection from the topic, or all topics """
+        _self_class = self._get_handler_self()
+
+        socket_fd = _self_class.socket_fd
+        if topic is None:
+            return self._unsubscribe_all(socket_fd)
+        self._check_topic(topic, True)
+
+        topics = self._client_topics.get(socket_fd)
+        if not topics or topic not in topics:
+            return False
+        topics.discard(topic)
+        if not topics:
+            self._client_topics.pop(socket_fd)
+        self._remove_subscriber(topic, socket_fd)
         return True
 
+    @in_loop_thread
+    def publish(self, topic: str, message, include_self: bool=False):
+        """ Send message to all subscribers of the topic
+
+        The cost is proportional to the subscribers, not to all clients
+        """
+        _self_class = self._get_handler_self()
+        self._check_topic(topic, False)
+
+        message = self._pack_message(message)
+        if self._worker_bus is not None:
+            self._worker_bus.send(
+                worker_bus.BUS_PUBLISH, topic, message.pack())
+        return self._queue_broadcast(self._topic_recipients(topic), message,
+                                     _self_class.socket_fd, include_self)
+
+    @in_loop_thread
+    def subscriber_count(self, topic: str):
+        self._check_topic(topic, True)
+        return len(self._topic_subscribers.get(topic, ()))
+
+    @in_loop_thread
     def client_count(self):
         _self_class = self._get_handler_self()
 
-        if not hasattr(_self_class, '__namespace__'):
+        namespace = self._client_namespace.get(_self_class.socket_fd)
+        if namespace is None:
             raise exceptions.BroadcastError('broadcast context invalid')
-
-        namespace = _self_class.__namespace__
         if namespace not in self._client_list:
             return 1
         return len(self._client_list[namespace]) + 1  # and current connection
 
+    @property
+    def worker_bus(self):
+        return self._worker_bus
+
+    @property
+    def compression_cache(self):
+        return self._compression_cache
+
+    def _topic_recipients(self, topic):
+        subscribers = self._topic_subscribers.get(topic, ())
+        if self._prefix_topics:
+            # each prefix of the topic matches at most one wildcard topic
+            subscribers = set(subscribers)
+            for index in range(len(topic) + 1):
+                prefix_subscribers = \
+                    self._topic_subscribers.get(topic[:index] + '*')
+                if prefix_subscribers:
+                    subscribers |= prefix_subscribers
+        return subscribers
+
+    def _deliver_bus_messages(self):
+        # broadcasts of the siblings, the frames already packed
+        for kind, key, frame_bytes in self._worker_bus.receive():
+            message = ws_frame.PackedFrame.from_bytes(frame_bytes)
+            if kind == worker_bus.BUS_BROADCAST:
+                socket_fds = self._client_list.get(key, ())
+            else:
+                socket_fds = self._topic_recipients(key)
+            self._queue_broadcast(socket_fds, message, None, True)
+
+    @staticmethod
+    def _pack_message(message):
+        if isinstance(message, ws_frame.PackedFrame):
+            return message
+        try:
+            # pack once, the frame bytes shared by all recipients
+            return ws_frame.PackedFrame(message)
+        except exceptions.ParameterError:
+            raise exceptions.BroadcastError('broadcast message invalid')
+
+    def _queue_broadcast(self, socket_fds, message, context_socket_fd,
+                         include_self):
+        if self.extensions:
+            return self._queue_encoded_broadcast(
+                socket_fds, message, context_socket_fd, include_self)
+        recipients = 0
+        for socket_fd in socket_fds:
+            if socket_fd == context_socket_fd and not include_self:
+                continue
+            self._enqueue_write(socket_fd, message)
+            recipients += 1
+        return ws_frame.BroadcastReport(recipients, len(message))
+
+    def _queue_encoded_broadcast(self, socket_fds, message,
+                                 context_socket_fd, include_self):
+        # parameters -> encoded frame, shared by the group of recipients
+        groups = dict()
+        recipients = 0
+        for socket_fd in socket_fds:
+            if socket_fd == context_socket_fd and not include_self:
+                continue
+            extensions = self._client_extensions(socket_fd)
+            if extensions is None:
+                frame = message
+            else:
+                parameters = extensions.parameters
+                frame = groups.get(parameters) \
+                    if parameters is not None else None
+                if frame is None:
+                    frame = self._compression_cache.compress_frame(
+                        extensions, message)
+                    if parameters is not None:
+                        groups[parameters] = frame
+            self._enqueue_write(socket_fd, frame)
+            recipients += 1
+        return ws_frame.BroadcastReport(recipients, len(message))
+
+    def _client_extensions(self, socket_fd):
+        # the clients still in the handshake have no controller
+        controller = self._client_list[
+            self._client_namespace[socket_fd]].get(socket_fd)
+        if not isinstance(controller, BaseController):
+            return None
+        return controller.extensions
+
+    @staticmethod
+    def _check_topic(topic, wildcard):
+        exceptions.raise_parameter_error('topic', str, topic)
+        if not topic:
+            raise exceptions.ParameterError('topic must be non-empty string')
+        # wildcard only allowed at the end of subscribe topic
+        if '*' in (topic[:-1] if wildcard else topic):
+            raise exceptions.ParameterError(
+                'wildcard \'*\' invalid in topic \'{}\''.format(topic))
+
+    def _unsubscribe_all(self, socket_fd):
+        topics = self._client_topics.pop(socket_fd, ())
+        for topic in topics:
+            self._remove_subscriber(topic, socket_fd)
+        return len(topics) > 0
+
+    def _remove_subscriber(self, topic, socket_fd):
+        subscribers = self._topic_subscribers[topic]
+        subscribers.discard(socket_fd)
+        if not subscribers:
+            self._topic_subscribers.pop(topic)
+            self._prefix_topics.discard(topic)
+
     @staticmethod
     def _get_handler_self():
-        prev_locals = inspect.stack()[2][0].f_locals
-        if 'self' in prev_locals:
-            _self_class = prev_locals['self']
-            return _self_class
-        raise exceptions.FatalError('cannot find handler class')
+        # set around all handler callbacks by `handler.invoke`
+        _self_class = handler.current_handler()
+        if _self_class is None:
+            raise exceptions.FatalError('cannot find handler class')
+        return _self_class
+
+
+class WebSocketServer(WebSocketServerBase, Broadcaster):
+
+    def __init__(self, host, port, *, debug=False, server_name=None,
+                 frame_budget=None, high_watermark=None, low_watermark=None,
+                 workers=None, offload_workers=None, offload_queue_depth=None,
+                 process_workers=None, process_in_flight=None,
+                 max_header_bytes=None, max_header_count=None,
+                 permessage_deflate=None, max_frame_size=None,
+                 listen_backlog=None):
+        self._debug = bool(debug)
+        if os.name == 'nt':
+            logger.wait_logger_init_msg(
+                logger.warning,
+                'WebSocketServer running in Windows, only DEBUG mode')
+            self._debug = True
+        if server_name is None:
+            server_name = host
+        http_verifier.set_server_name(server_name, port=port)
+        # broadcast and topic subscriptions
+        Broadcaster.__init__(self)
+        super(WebSocketServer, self).__init__(
+            host, port, debug=self._debug, frame_budget=frame_budget,
+            high_watermark=high_watermark, low_watermark=low_watermark,
+            workers=workers, offload_workers=offload_workers,
+            offload_queue_depth=offload_queue_depth,
+            process_workers=process_workers,
+            process_in_flight=process_in_flight,
+            max_header_bytes=max_header_bytes,
+            max_header_count=max_header_count,
+            permessage_deflate=permessage_deflate,
+            max_frame_size=max_frame_size, listen_backlog=listen_backlog)
+
+    def _close_client(self, socket_fd, namespace):
+        # drop all subscriptions of the client
+        self._unsubscribe_all(socket_fd)
+        super(WebSocketServer, self)._close_client(socket_fd, namespace)
 
     @property
     def is_debug(self):
@@ -592,12 +1288,13 @@ class WebsocketSecureServer(WebSocketServer):
             # If the connection is happening on an HTTPS (HTTP-over-TLS) port,
             # perform a TLS handshake over the connection.
             client = self._ssl_context.wrap_socket(client, server_side=True)
-        except ssl.SSLError:
-            raise
-        except Exception:
-            raise
-        finally:
-            return client, address
+        except (ssl.SSLError, OSError) as e:
+            # closed or not speaking TLS, the socket already closed
+            logger.warning('Client({}:{}) TLS handshake failed({})'.format(
+                *address, e))
+            client.close()
+            return None, address
+        return client, address
 
     @staticmethod
     def _find_file(file_name, path_range=('.', '..')):
@@ -612,9 +1309,56 @@ class WebsocketSecureServer(WebSocketServer):
 
 def create_websocket_server(host='localhost', port=8999, *, debug=False,
                             logging_level='info', log_file=None,
-                            server_name=True):
-    with WebSocketServer(host, port, debug=debug,
-                         server_name=server_name) as server:
+                            server_name=True, loop='selectors', workers=None,
+                            offload_workers=None, offload_queue_depth=None,
+                            process_workers=None, process_in_flight=None,
+                            max_header_bytes=None, max_header_count=None,
+                            permessage_deflate=None, max_frame_size=None,
+                            listen_backlog=None):
+    """ Create the websocket server
+
+    :param loop: 'selectors' for the built-in loop, 'asyncio' or 'uvloop'
+        for the asyncio engine (uvloop falls back to asyncio if missing)
+    :param workers: number of pre-forked worker processes sharing the port
+        by SO_REUSEPORT, None runs the server in a single process
+    :param offload_workers: threads running the offloaded handlers
+    :param offload_queue_depth: offloaded callbacks in flight at most
+    :param process_workers: processes running the transforms of
+        `ProcessController`
+    :param process_in_flight: transforms in flight at most
+    :param max_header_bytes: handshake request header size at most
+    :param max_header_count: handshake request header fields at most
+    :param permessage_deflate: True or `PerMessageDeflateOptions` to
+        compress the messages of the clients offered permessage-deflate
+    :param max_frame_size: payload length of a received frame at most, the
+        connection closed with 1009 if exceeded
+    :param listen_backlog: connections queued by the kernel before
+        accepted, `socket.SOMAXCONN` by default
+    """
+    if loop != 'selectors':
+        # the asyncio engine imports this module
+        from websocket.async_server import create_async_websocket_server
+        return create_async_websocket_server(
+            host, port, debug=debug, logging_level=logging_level,
+            log_file=log_file, server_name=server_name, loop=loop,
+            workers=workers, offload_workers=offload_workers,
+            offload_queue_depth=offload_queue_depth,
+            process_workers=process_workers,
+            process_in_flight=process_in_flight,
+            max_header_bytes=max_header_bytes,
+            max_header_count=max_header_count,
+            permessage_deflate=permessage_deflate,
+            max_frame_size=max_frame_size, listen_backlog=listen_backlog)
+    with WebSocketServer(host, port, debug=debug, server_name=server_name,
+                         workers=workers, offload_workers=offload_workers,
+                         offload_queue_depth=offload_queue_depth,
+                         process_workers=process_workers,
+                         process_in_flight=process_in_flight,
+                         max_header_bytes=max_header_bytes,
+                         max_header_count=max_header_count,
+                         permessage_deflate=permessage_deflate,
+                         max_frame_size=max_frame_size,
+                         listen_backlog=listen_backlog) as server:
         logger.init(logging_level, server.is_debug, log_file)
         return server
 
@@ -60,9 +60,29 @@ class HttpVerifierError(Exception):
     pass
 
 
+class HttpVersionError(HttpVerifierError):
+    pass
+
+
+class HttpParserError(Exception):
+    pass
+
+
+class HttpHeaderTooLarge(HttpParserError):
+    pass
+
+
 class FrameVerifierError(Exception):
     pass
 
 
 class WSSCertificateFileNotFound(Exception):
     pass
+
+
+class ExtensionError(Exception):
+    pass
+
+
+class MessageTooBig(ExtensionError):
+    pass
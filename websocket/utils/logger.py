@@ -6,7 +6,7 @@ import logging
 from websocket.utils import exceptions
 
 
-__all__ = ['init', 'info', 'warning', 'error', 'debug']
+__all__ = ['init', 'info', 'warning', 'error', 'debug', 'debug_enabled']
 
 
 def _logger_level(level):
@@ -72,6 +72,11 @@ def debug(message):
     logging.debug(message)
 
 
+def debug_enabled():
+    # guard the messages formatted for each frame
+    return logging.getLogger().isEnabledFor(logging.DEBUG)
+
+
 def info(message):
     logging.info(message)
 
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+#
+# Copyright (C) 2017 ShadowMan
+#
+# Octet i of the transformed data is the XOR of octet i of the original
+# data with octet at index i modulo 4 of the masking key
+#
+#     j                   = i MOD 4
+#     transformed-octet-i = original-octet-i XOR masking-key-octet-j
+#
+# The payload is transformed a whole chunk at a time, the masking key is
+# repeated to the chunk length and both are XOR-ed as big integers (or as
+# 32-bit words when NumPy is available).
+from websocket.utils import exceptions
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# bytes of payload transformed by each big integer XOR, multiple of 4
+CHUNK_SIZE = 64 * 1024
+
+# payload shorter than it not worth to convert into NumPy array
+NUMPY_THRESHOLD = 1024
+
+
+def mask_key_to_bytes(mask_key):
+    """ Normalize the 32-bit masking key to 4-bytes (network byte order)
+
+    :param mask_key: int, hex string or 4-bytes bytes-like object
+    :rtype: bytes
+    """
+    if isinstance(mask_key, int):
+        return (mask_key & 0xffffffff).to_bytes(4, 'big')
+    if isinstance(mask_key, str):
+        return (int(mask_key, 16) & 0xffffffff).to_bytes(4, 'big')
+    if isinstance(mask_key, (bytes, bytearray, memoryview)):
+        if len(mask_key) == 4:
+            return bytes(mask_key)
+    raise exceptions.ParameterError('mask key must be a 32-bit value')
+
+
+def mask(data, mask_key):
+    """ Mask(or unmask) data, return the transformed bytes
+
+    :param data: bytes-like object
+    :param mask_key: see `mask_key_to_bytes`
+    :rtype: bytes
+    """
+    output = bytearray(len(data))
+    mask_into(output, mask_key, data)
+    return bytes(output)
+
+
+def mask_into(output, mask_key, data=None):
+    """ Mask(or unmask) data into the caller-supplied buffer
+
+    Transform `output` in place when `data` is None, otherwise write the
+    transformed `data` to the head of `output`.
+
+    :param output: writable bytes-like object, bytearray or memoryview
+    :param mask_key: see `mask_key_to_bytes`
+    :param data: bytes-like object or None
+    :return: the number of bytes transformed
+    """
+    mask_key = mask_key_to_bytes(mask_key)
+    output_view = memoryview(output).cast('B')
+    if data is None:
+        data_view = output_view
+    else:
+        data_view = memoryview(data).cast('B')
+    length = data_view.nbytes
+    if length > output_view.nbytes:
+        raise exceptions.ParameterError('output buffer too small')
+    if length == 0:
+        return 0
+    if numpy is not None and length >= NUMPY_THRESHOLD:
+        _numpy_mask_into(output_view, data_view, mask_key, length)
+    else:
+        _integer_mask_into(output_view, data_view, mask_key, length)
+    return length
+
+
+def _integer_mask_into(output_view, data_view, mask_key, length):
+    chunk_size = min(CHUNK_SIZE, length)
+    # repeated key shared by all full chunks
+    key_integer = int.from_bytes(mask_key * (chunk_size // 4 + 1), 'little')
+    for start in range(0, length, chunk_size):
+        stop = min(start + chunk_size, length)
+        size = stop - start
+        value = int.from_bytes(data_view[start:stop], 'little')
+        # the low `size` bytes of the little-endian key is the prefix
+        value ^= key_integer & ((1 << (size * 8)) - 1)
+        output_view[start:stop] = value.to_bytes(size, 'little')
+
+
+def _numpy_mask_into(output_view, data_view, mask_key, length):
+    words = length // 4
+    if words:
+        key_word = numpy.frombuffer(mask_key, dtype=numpy.uint32)[0]
+        numpy.bitwise_xor(
+            numpy.frombuffer(data_view, dtype=numpy.uint32, count=words),
+            key_word,
+            out=numpy.frombuffer(output_view, dtype=numpy.uint32, count=words))
+    # trailing 0-3 bytes, the key phase restarts at a word boundary
+    for index in range(words * 4, length):
+        output_view[index] = data_view[index] ^ mask_key[index & 3]
+
+
+if __name__ == '__main__':
+    import os
+    import random
+    import struct
+
+    def reference_transform(data, mask_key):
+        # per-byte implementation of the previous ws_transform_payload_data
+        mask_key_octet = {
+            0: (mask_key & 0xff000000) >> 24,
+            1: (mask_key & 0x00ff0000) >> 16,
+            2: (mask_key & 0x0000ff00) >> 8,
+            3: mask_key & 0x000000ff
+        }
+        transformed_string = b''
+        for index, value in enumerate(data):
+            transformed_string += struct.pack(
+                '!B', (value ^ mask_key_octet[index % 4]) & 0xff)
+        return transformed_string
+
+    def test_mask():
+        assert mask(b'\x7f\x9f\x4d\x51\x58', 0x37fa213d) == b'Hello'
+        assert mask(b'Hello', b'\x37\xfa\x21\x3d') == b'\x7f\x9f\x4d\x51\x58'
+        assert mask(b'Hello', '37fa213d') == b'\x7f\x9f\x4d\x51\x58'
+        assert mask(b'', 0x37fa213d) == b''
+
+        sizes = [1, 2, 3, 4, 5, 125, 126, 1023, 1024, 1027, 65535,
+                 CHUNK_SIZE, CHUNK_SIZE + 3, 3 * CHUNK_SIZE + 1]
+        for size in sizes:
+            data = os.urandom(size)
+            key = random.getrandbits(32)
+            expected = reference_transform(data, key)
+            assert mask(data, key) == expected, size
+            assert mask(expected, key) == data, size
+
+            in_place = bytearray(data)
+            assert mask_into(in_place, key) == size
+            assert in_place == expected, size
+
+            output = bytearray(size + 8)
+            mask_into(memoryview(output)[8:], key, memoryview(data))
+            assert output[8:] == expected, size
+
+    def test_mask_invalid():
+        for key in (b'\x00\x01\x02', 1.5, None):
+            try:
+                mask(b'data', key)
+            except exceptions.ParameterError:
+                continue
+            raise AssertionError('invalid mask key accepted')
+        try:
+            mask_into(bytearray(2), 0x1, b'data')
+        except exceptions.ParameterError:
+            pass
+        else:
+            raise AssertionError('short output buffer accepted')
+
+    test_mask()
+    test_mask_invalid()
+    if numpy is not None:
+        # the same cases through the pure Python path
+        numpy, _numpy = None, numpy
+        test_mask()
+        numpy = _numpy
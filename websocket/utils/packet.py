@@ -2,131 +2,93 @@
 #
 # Copyright (C) 2017 ShadowMan
 #
-import ctypes
 import struct
 from websocket.utils import generic, exceptions
 
 
-class Byte(ctypes.Union):
-    """c
-    typedef union {
-        struct {
-            unsigned b0 : 1;
-            unsigned b1 : 1;
-            unsigned b2 : 1;
-            unsigned b3 : 1;
-            unsigned b4 : 1;
-            unsigned b5 : 1;
-            unsigned b6 : 1;
-            unsigned b7 : 1;
-        } _Bits;
-        unsigned char value;
-    } Byte;
-    """
+# bits of all octet, index by the octet value. (MSB first)
+_octet_bits = tuple(
+    tuple((value >> (7 - offset)) & 1 for offset in range(8))
+    for value in range(256)
+)
 
-    class _Bits(ctypes.Structure):
-
-        _fields_ = [
-            ('b7', ctypes.c_uint8, 1), ('b6', ctypes.c_uint8, 1),
-            ('b5', ctypes.c_uint8, 1), ('b4', ctypes.c_uint8, 1),
-            ('b3', ctypes.c_uint8, 1), ('b2', ctypes.c_uint8, 1),
-            ('b1', ctypes.c_uint8, 1), ('b0', ctypes.c_uint8, 1),
-        ]
-
-    _fields_ = [
-        ('value', ctypes.c_char),
-        ('bits', _Bits)
-    ]
-    _anonymous_ = ('bits',)
-
-    def __init__(self, octet_data):
-        super(Byte, self).__init__()
-        if isinstance(octet_data, int):
-            self.value = octet_data & 0xff
-        else:
-            raise exceptions.ParameterError('octet data must be 1-byte length')
+# precompiled network byte order formats
+_uint16 = struct.Struct('!H')
+_uint32 = struct.Struct('!I')
+_uint64 = struct.Struct('!Q')
 
 
 class ByteArray(object):
-    """
-    :type raw_data: int | bytes | str | None
-    :type size: int
-    :type self.elements: list[Byte]
+    """ A byte array backed by a single `bytearray`
+
+    :type raw_data: int | bytes | bytearray | memoryview | str | None
+    :type self._buffer: bytearray
     """
     def __init__(self, raw_data):
         if raw_data is None:
-            self.size = 0
-            # deque is not support slice
-            self.elements = list()
+            self._buffer = bytearray()
         elif isinstance(raw_data, int):
-            self._factory_from_int(raw_data)
-        elif isinstance(raw_data, bytes):
-            self._factory_from_bytes(raw_data)
+            self._buffer = self._factory_from_int(raw_data)
+        elif isinstance(raw_data, (bytes, bytearray, memoryview)):
+            self._buffer = bytearray(raw_data)
         elif isinstance(raw_data, str):
-            self._factory_from_bytes(generic.to_bytes(raw_data))
+            self._buffer = bytearray(generic.to_bytes(raw_data))
         else:
             raise exceptions.ParameterError('raw data type invalid')
 
-    def _factory_from_int(self, raw_data):
-        hex_string = hex(raw_data)[2:]  # strip 0x
-        if len(hex_string) % 2:
-            hex_string = '0' + hex_string
-        self.size = int(len(hex_string) / 2)
-        self.elements = list(
-            list(
-                map(
-                    lambda el: Byte(el), [
-                        int(hex_string[index:index + 2], 16)
-                        for index in range(0, len(hex_string), 2)
-                    ]
-                )
-            )
-        )
-
-    def _factory_from_bytes(self, raw_data):
-        self.size = len(raw_data)
-        self.elements = list(
-            map(lambda el: Byte(el), [
-                el for el in raw_data
-            ])
-        )
+    @staticmethod
+    def _factory_from_int(raw_data):
+        # minimal big-endian representation, 0 is 1-byte
+        length = max(1, (raw_data.bit_length() + 7) // 8)
+        return bytearray(raw_data.to_bytes(length, 'big'))
+
+    @property
+    def size(self):
+        return len(self._buffer)
 
     def build(self, start=0):
         self._check_index(start)
-        return struct.pack('!{}B'.format(self.size - start), *[
-            ord(byte.value) for byte in self.elements[start:]
-        ])
+        return bytes(memoryview(self._buffer)[start:])
+
+    def view(self, start=0, stop=None):
+        """ Zero-copy view of the buffer, release it before resizing
+
+        :rtype: memoryview
+        """
+        return memoryview(self._buffer)[start:stop]
+
+    def unpack_from(self, fmt, offset=0):
+        if isinstance(fmt, struct.Struct):
+            return fmt.unpack_from(self._buffer, offset)
+        return struct.unpack_from(fmt, self._buffer, offset)
 
     def to_integer(self):
-        return generic.to_integer(self.build())
+        return int.from_bytes(self._buffer, 'big')
 
     def get_bits(self, index, length=1):
         self._check_index(index)
         self._check_index(index + length)
-        _bytes = self.elements[index:index + length]
-        if len(_bytes) == 1:
-            byte = _bytes[0]
-            return (byte.b0, byte.b1, byte.b2, byte.b3,
-                    byte.b4, byte.b5, byte.b6, byte.b7)
-        else:
-            return [
-                (byte.b0, byte.b1, byte.b2, byte.b3,
-                 byte.b4, byte.b5, byte.b6, byte.b7) for byte in _bytes
-            ]
+        if length == 1:
+            return _octet_bits[self._buffer[index]]
+        return [_octet_bits[octet]
+                for octet in self._buffer[index:index + length]]
 
     def get_bit(self, index, offset):
         self._check_index(index)
-        if 7 < offset < 0:
+        if not 0 <= offset <= 7:
             raise exceptions.ParameterError('bit offset invalid')
-        return self.get_bits(index)[offset]
+        return (self._buffer[index] >> (7 - offset)) & 1
 
     def _check_index(self, index):
-        if index > self.size or index < 0:
+        if index > len(self._buffer) or index < 0:
             raise exceptions.ParameterError('operator index invalid')
         return True
 
     def __len__(self):
-        return self.size
+        return len(self._buffer)
+
+    def __bytes__(self):
+        return bytes(self._buffer)
 
     def __str__(self):
         return '<{} size={}>'.format(self.__class__.__name__, self.size)
@@ -138,84 +100,83 @@ class Packet(ByteArray):
         super(Packet, self).__init__(value)
 
     def update(self, raw_data):
-        ba = ByteArray(raw_data)
-        self.size += ba.size
-        self.elements += ba.elements
+        if isinstance(raw_data, (bytes, bytearray, memoryview)):
+            self._buffer += raw_data
+        else:
+            self._buffer += ByteArray(raw_data)._buffer
 
     def modify(self, index, value):
         self._check_index(index)
-        self.elements[index].value = generic.to_int8(value)
+        self._buffer[index] = generic.to_int8(value)
 
     def insert(self, index, value):
         self._check_index(index)
-        self.elements.insert(index, Byte(generic.to_int8(value)))
-        self.size += 1
+        self._buffer.insert(index, generic.to_int8(value))
+
+    def pack_into(self, fmt, offset, *values):
+        if not isinstance(fmt, struct.Struct):
+            fmt = struct.Struct(fmt)
+        self._check_index(offset)
+        # grow the buffer when the value overflows the tail
+        overflow = offset + fmt.size - len(self._buffer)
+        if overflow > 0:
+            self._buffer.extend(bytes(overflow))
+        fmt.pack_into(self._buffer, offset, *values)
 
     def put_int8(self, value):
-        self.insert(self.size, value)
+        self._buffer.append(generic.to_int8(value))
 
     def put_int16(self, value):
-        self.insert(self.size, (value & 0xff00) >> 8)
-        self.insert(self.size, (value & 0x00ff) >> 0)
+        self.pack_into(_uint16, len(self._buffer), value & 0xffff)
 
     def put_int32(self, value):
-        self.put_int16((value & 0xffff0000) >> 16)
-        self.put_int16((value & 0x0000ffff) >> 0)
+        self.pack_into(_uint32, len(self._buffer), value & 0xffffffff)
 
     def put_int64(self, value):
-        self.put_int32((value & 0xffffffff00000000) >> 32)
-        self.put_int32((value & 0x00000000ffffffff) >> 0)
+        self.pack_into(_uint64, len(self._buffer), value & 0xffffffffffffffff)
 
     def put_bits(self, *bits):
-        bit_length = len(bits)
-        if bit_length < 8:
-            octet = ([0] * (8 - bit_length)) + list(bits)
-        else:
-            octet = bits[0:8]
-        self.put_int8(int(''.join([str(b) for b in octet]), 2))
+        octet = 0
+        for bit in bits[0:8]:
+            octet = (octet << 1) | (bit & 1)
+        self._buffer.append(octet)
 
     def put_string(self, value):
         self.update(value)
 
     def get_int8(self, index=None):
-        if index is None:
-            index = self.size - 1
-        self._check_index(index)
-        return self.elements[index].value
+        return self._get_octets(index, 1)
 
     def get_int16(self, index=None):
-        if index is None:
-            index = self.size - 2
-        self._check_index(index)
-        self._check_index(index + 2)
-        return b''.join([el.value for el in self.elements[index:(index + 2)]])
+        return self._get_octets(index, 2)
 
     def get_int32(self, index=None):
-        if index is None:
-            index = self.size - 4
-        self._check_index(index)
-        self._check_index(index + 4)
-        return b''.join([el.value for el in self.elements[index:(index + 4)]])
+        return self._get_octets(index, 4)
 
     def get_int64(self, index=None):
+        return self._get_octets(index, 8)
+
+    def _get_octets(self, index, length):
         if index is None:
-            index = self.size - 8
+            index = len(self._buffer) - length
         self._check_index(index)
-        self._check_index(index + 8)
-        return b''.join([el.value for el in self.elements[index:(index + 8)]])
+        self._check_index(index + length)
+        return bytes(self._buffer[index:index + length])
 
     def get_last(self, length):
         self._check_index(length)
-        return b''.join(
-            [el.value for el in self.elements[-1:-length - 1:-1][::-1]])
+        return bytes(self._buffer[len(self._buffer) - length:])
 
     def clear(self):
-        self.elements.clear()
-        self.size = 0
+        # a new buffer, exported views of the old one are still valid
+        self._buffer = bytearray()
 
 
 def bits_to_integer(bits_array):
-    return int(''.join([str(b) for b in bits_array]), 2)
+    number = 0
+    for bit in bits_array:
+        number = (number << 1) | bit
+    return number
 
 
 def number_to_bits(number, pad_bit_length=0):
@@ -259,7 +220,26 @@ if __name__ == '__main__':
 
         packet.put_string(b'Hello World')
         assert packet.get_last(len(b'Hello World')) == b'Hello World'
+        assert packet.get_last(0) == b''
 
         packet.clear()
         assert packet.size == 0
+
+    def test_byte_array():
+        byte_array = ByteArray(b'\x81\x85\x37\xfa')
+        assert byte_array.get_bits(0) == (1, 0, 0, 0, 0, 0, 0, 1)
+        assert byte_array.get_bits(2, 2) == [(0, 0, 1, 1, 0, 1, 1, 1),
+                                             (1, 1, 1, 1, 1, 0, 1, 0)]
+        assert byte_array.get_bit(1, 0) == 1
+        assert bits_to_integer(byte_array.get_bits(1)[1:]) == 5
+        assert byte_array.unpack_from('!H', 2) == (0x37fa,)
+        assert bytes(byte_array.view(1, 3)) == b'\x85\x37'
+        assert byte_array.build(2) == b'\x37\xfa'
+        assert ByteArray(0x0).build() == b'\x00'
+        assert ByteArray(0x1234).to_integer() == 0x1234
+
+        packet = Packet(b'\x00\x00')
+        packet.pack_into('!H', 1, 0xabcd)
+        assert packet.build() == b'\x00\xab\xcd'
     test_packet()
+    test_byte_array()
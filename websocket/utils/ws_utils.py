@@ -2,6 +2,7 @@
 #
 # Copyright (C) 2017 ShadowMan
 #
+import os
 import base64
 import hashlib
 from websocket.utils import generic
@@ -43,6 +44,76 @@ def ws_check_key_length(key):
 # All frames sent from the client to the server are masked by a
 # 32-bit value that is contained within the frame.
 def ws_generate_frame_mask_key():
-    # 0x00 - 0xFF = 1byte(8 bit)
-    return generic.random_bytes_string(4, start = 0x00, stop = 0xff)
+    # 0x00 - 0xFF = 1byte(8 bit), exactly 4 octets
+    return os.urandom(4)
 
+
+# Sec-WebSocket-Extensions = extension-list
+#     extension-list = 1#extension
+#     extension = extension-token *( ";" extension-param )
+#     extension-param = token [ "=" (token | quoted-string) ]
+def ws_parse_extensions(header_value):
+    """ Extensions offered by the client, in the order of preference
+
+    Malformed elements are dropped, the others still negotiated.
+
+    :return: list of (name, [(param, value or None), ...]), all str
+    """
+    if not header_value:
+        return []
+    extensions = list()
+    for element in _split_quoted(generic.to_string(header_value), ','):
+        parts = _split_quoted(element, ';')
+        name = parts[0].strip()
+        if not _is_token(name):
+            continue
+        params = list()
+        for part in parts[1:]:
+            param, _, value = part.partition('=')
+            param, value = param.strip(), value.strip()
+            if value.startswith('"'):
+                if len(value) < 2 or not value.endswith('"'):
+                    break
+                value = value[1:-1].replace('\\', '')
+            if not _is_token(param) or ('=' in part and not _is_token(value)):
+                break
+            params.append((param, value if '=' in part else None))
+        else:
+            extensions.append((name, params))
+    return extensions
+
+
+def ws_format_extension(name, params):
+    """ Extension of the response, the reverse of `ws_parse_extensions`
+
+    :rtype: bytes
+    """
+    return generic.to_bytes('; '.join([name] + [
+        param if value is None else '{}={}'.format(param, value)
+        for param, value in params]))
+
+
+# separators of RFC 7230 section 3.2.6, never in a token
+_separators = frozenset('()<>@,;:\\"/[]?={} \t')
+
+
+def _is_token(value):
+    return bool(value) and all(
+        32 < ord(char) < 127 and char not in _separators for char in value)
+
+
+def _split_quoted(value, separator):
+    # split by the separator outside of the quoted-strings
+    parts, start, quoted, escaped = list(), 0, False, False
+    for index, char in enumerate(value):
+        if escaped:
+            escaped = False
+        elif char == '\\' and quoted:
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif char == separator and not quoted:
+            parts.append(value[start:index])
+            start = index + 1
+    parts.append(value[start:])
+    return [part.strip() for part in parts if part.strip()]